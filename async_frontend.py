@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import Counter, deque
+
+import numpy as np
+
+# Asyncio front end of the retrieval service. Queries that arrive at about the same time are gathered into micro-batches and
+# ranked together with the batch engine (retrieve_and_rank.bm25_batch_rank_documents_for_queries), which fetches and weights
+# the postings list of each term once per batch. A query that is identical to one already waiting or being ranked is not ranked
+# again: it waits for the result of the first one. Every batch is ranked in its own task, so the next batch is gathered (and
+# ranked, if the executor has a free worker) while the previous one is being ranked.
+
+class AsyncQueryFrontend:
+    '''
+    Micro-batching query front end over a RetrievalService (see server.py). The CPU-bound ranking runs in an executor so the event
+    loop keeps accepting queries while a batch is being ranked.
+    '''
+
+    def __init__(self, service, max_batch_size=32, max_wait=0.005, executor=None, latency_window=10000):
+        '''
+        Parameters:
+            service (RetrievalService): Provides search_batch(queries, top_n).
+            max_batch_size (int): Maximum number of distinct queries ranked together.
+            max_wait (float): Maximum time in seconds the first query of a batch waits for more queries.
+            executor (Executor): Where the batches are ranked (by default, the default executor of the event loop).
+            latency_window (int): Number of most recent request latencies kept for the percentiles.
+        '''
+        self.service = service
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.executor = executor
+        self.queue = None
+        self.batcher = None
+        self.in_flight = {} #(query string, top n) -> future of its ranking
+        self.batch_tasks = set() #tasks ranking a batch
+
+        self.requests = 0
+        self.coalesced = 0
+        self.latencies = deque(maxlen=latency_window)
+        self.batch_sizes = Counter() #batch size -> number of batches
+
+    async def search(self, text, top_n=100):
+        '''
+        Returns the top n (doc_id, score) pairs for a query string.
+        '''
+        started = time.perf_counter()
+        self.requests += 1
+        if self.batcher is None:
+            self.queue = asyncio.Queue()
+            self.batcher = asyncio.get_running_loop().create_task(self.run_batches())
+
+        key = (text, top_n)
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.in_flight[key] = future
+            self.queue.put_nowait(key)
+        else:
+            self.coalesced += 1
+
+        # Shielded so that a cancelled request does not cancel the result other requests are waiting for
+        top_documents = await asyncio.shield(future)
+        self.latencies.append(time.perf_counter() - started)
+        # The requests coalesced on the same query each get their own list
+        return list(top_documents)
+
+    async def next_batch(self):
+        '''
+        Wait for a query, then gather the queries that arrive within max_wait of it, up to max_batch_size.
+        '''
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            self.batch_sizes[len(batch)] += 1
+
+            # The batch engine ranks every query of a call with the same top n
+            groups = {}
+            for key in batch:
+                groups.setdefault(key[1], []).append(key)
+
+            # The batches are not awaited here, so gathering the next batch does not wait for the ranking of this one
+            for top_n, keys in groups.items():
+                task = loop.create_task(self.rank_batch(keys, top_n))
+                self.batch_tasks.add(task)
+                task.add_done_callback(self.batch_tasks.discard)
+
+    async def rank_batch(self, keys, top_n):
+        '''
+        Rank a batch of queries with the same top n in the executor and pass the rankings to the requests waiting for them.
+        '''
+        queries = [(str(position), text) for position, (text, _) in enumerate(keys)]
+        try:
+            rankings = await asyncio.get_running_loop().run_in_executor(self.executor, self.service.search_batch, queries, top_n)
+        except Exception as error:
+            for key in keys:
+                future = self.in_flight.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(error)
+            return
+        for key, top_documents in zip(keys, rankings):
+            # The future is gone if the front end was closed while the batch was being ranked
+            future = self.in_flight.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(top_documents)
+
+    def stats(self):
+        '''
+        Returns the request counts, the p50 and p99 latencies in milliseconds and the histogram of the batch sizes.
+        '''
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "requests": self.requests,
+            "coalesced": self.coalesced,
+            "batches": sum(self.batch_sizes.values()),
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+    async def close(self):
+        '''
+        Stop gathering and ranking batches (queries still waiting are cancelled; a batch already running in the executor runs to
+        completion, but its rankings are dropped).
+        '''
+        if self.batcher is not None:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+            self.batcher = None
+        for task in list(self.batch_tasks):
+            task.cancel()
+        await asyncio.gather(*self.batch_tasks, return_exceptions=True)
+        self.batch_tasks.clear()
+        for future in self.in_flight.values():
+            future.cancel()
+        self.in_flight.clear()
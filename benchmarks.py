@@ -0,0 +1,735 @@
+import asyncio
+import os
+import pickle
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from indexing import InvertedIndex, CompactInvertedIndex, MultiFieldInvertedIndex
+from postings_codec import intersect_postings
+from preprocessing import Document, Query, NormalizationCache, extract_index_terms
+from doc_utils import load_jsonl, load_inverted_index_jsonl, save_inverted_index_jsonl, DocStore
+from parallel_indexing import build_index_parallel
+from matrix_ranking import BM25Matrix
+from server import RetrievalService
+from async_frontend import AsyncQueryFrontend
+from query_cache import QueryResultCache, cached_rank_documents_for_query
+from binary_index import save_inverted_index_binary, load_inverted_index_binary, VBYTE_CODEC
+from term_cache import CachedInvertedIndex
+from segmented_index import SegmentedIndex
+from sharded_index import ShardedIndex
+from evaluation import Evaluator, load_run, rankings_by_query
+from parameter_sweep import ParameterSweep, make_grid, run_sweep, print_sweep_results
+from positional_index import build_positional_index, LazyPositionalIndex, get_phrase_terms, positional_rank_documents_for_query
+from retrieve_and_rank import get_bm25_document_vector, get_document_magnitudes, bm25_rank_documents_for_query, bm25_taat_rank_documents_for_query, bm25_maxscore_rank_documents_for_query, bm25_batch_rank_documents_for_queries
+
+# Scripts used to check that the faster retrieval backends produce the same results as the original ones and to measure how much faster they are.
+# Run with: python benchmarks.py <benchmark name>
+
+CORPUS_FILE = "scifact/corpus.jsonl"
+QUERIES_FILE = "queries_for_test.jsonl"
+TITLES_INDEX_FILE = "inverted_index_titles.jsonl"
+
+def load_scifact(titles_only=False, delta=0.25):
+    '''
+    Build the documents, the inverted index, the average document length and the BM25+ document vectors the same way main.py does.
+
+    Parameters:
+        titles_only (bool): If True, only the titles of the documents are indexed.
+        delta (float): The BM25+ delta used for the document vectors.
+    Returns:
+        documents (dict), inv_index (InvertedIndex), avg_doc_length (float), document_vectors (dict)
+    '''
+    documents = {}
+    for doc in load_jsonl(CORPUS_FILE):
+        documents[doc["_id"]] = Document(title=doc['title'], text="" if titles_only else doc['text'], _id=doc['_id'], metadata=doc['metadata'])
+
+    inv_index = InvertedIndex()
+    for document in documents.values():
+        inv_index.add_documents(document.get_id(), document.get_index_terms())
+
+    avg_doc_length = sum(len(document.get_index_terms()) for document in documents.values()) / len(documents)
+
+    document_vectors = {}
+    for _id, document in documents.items():
+        document_vectors[_id] = get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=delta)
+
+    return documents, inv_index, avg_doc_length, document_vectors
+
+def load_queries():
+    return [Query(_id=query['_id'], query=query['text']) for query in load_jsonl(QUERIES_FILE)]
+
+def same_ranking(expected, actual, tolerance=0):
+    '''
+    Returns True if two ranked lists of (doc_id, score) have the same documents in the same order (tied documents included) and
+    scores that differ by at most tolerance (0 for the backends that add up the same weights in the same order).
+    '''
+    if [doc_id for doc_id, _ in expected] != [doc_id for doc_id, _ in actual]:
+        return False
+    return all(abs(expected_score - actual_score) <= tolerance for (_, expected_score), (_, actual_score) in zip(expected, actual))
+
+def check_taat_parity(k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Check that the term-at-a-time scorer returns exactly the same rankings as the original scorer on the SciFact test queries
+    (test_retrieve_and_rank.py checks the same on corpus_first_5.jsonl).
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    doc_magnitudes = get_document_magnitudes(document_vectors)
+    queries = load_queries()
+
+    mismatches = []
+    original_time = 0
+    taat_time = 0
+    for query in queries:
+        start = time.perf_counter()
+        expected = bm25_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
+        original_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n, doc_magnitudes=doc_magnitudes)
+        taat_time += time.perf_counter() - start
+
+        if actual != expected:
+            mismatches.append(query.get_id())
+
+    print(f"Original scorer: {original_time:.2f}s, term-at-a-time scorer: {taat_time:.2f}s for {len(queries)} queries")
+    if mismatches:
+        print(f"Rankings differ for queries: {mismatches}")
+    else:
+        print("Rankings are identical for all queries.")
+    return not mismatches
+
+def benchmark_maxscore(k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Compare MaxScore top-k retrieval with the term-at-a-time scorer and report how many postings were evaluated and skipped.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    inv_index.compute_max_scores(document_vectors)
+    queries = load_queries()
+
+    mismatches = []
+    taat_time = 0
+    maxscore_time = 0
+    stats = {}
+    total_postings = 0
+    for query in queries:
+        total_postings += sum(len(inv_index.get_postings(term)) for term in query.get_index_terms())
+
+        start = time.perf_counter()
+        expected = bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
+        taat_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = bm25_maxscore_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n, stats=stats)
+        maxscore_time += time.perf_counter() - start
+
+        if not same_ranking(expected, actual):
+            mismatches.append(query.get_id())
+
+    print(f"Term-at-a-time scorer: {taat_time:.2f}s, MaxScore: {maxscore_time:.2f}s for {len(queries)} queries (top {top_n})")
+    print(f"Postings of the query terms: {total_postings}, evaluated: {stats['postings_evaluated']}, skipped: {stats['postings_skipped']}, documents scored: {stats['documents_scored']}")
+    if mismatches:
+        print(f"Rankings differ for queries: {mismatches}")
+    else:
+        print("Rankings are identical for all queries.")
+    return not mismatches
+
+def documents_from_index(inv_index):
+    '''
+    Rebuild the index terms of every document from the postings of an inverted index.
+
+    Returns:
+        doc_terms (dict): A dictionary where the document ID is the key and its index terms and term frequencies are the value.
+    '''
+    doc_terms = {}
+    for term, postings in inv_index.index.items():
+        for doc_id, freq in postings.items():
+            doc_terms.setdefault(doc_id, {})[term] = freq
+    return doc_terms
+
+def measure_memory(build):
+    '''
+    Returns the object returned by build and the memory (in bytes) it allocated.
+    '''
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+def benchmark_compact_index_memory(index_file=TITLES_INDEX_FILE):
+    '''
+    Compare the memory used by the nested dictionaries of InvertedIndex with the packed arrays of CompactInvertedIndex for the same postings.
+    '''
+    doc_terms = documents_from_index(load_inverted_index_jsonl(index_file))
+    total_postings = sum(len(terms) for terms in doc_terms.values())
+
+    def build(index_class):
+        inv_index = index_class()
+        for doc_id, terms in doc_terms.items():
+            inv_index.add_documents(doc_id, terms)
+        if isinstance(inv_index, CompactInvertedIndex):
+            inv_index.pack()
+        return inv_index
+
+    for index_class in (InvertedIndex, CompactInvertedIndex):
+        start = time.perf_counter()
+        inv_index, memory = measure_memory(lambda: build(index_class))
+        build_time = time.perf_counter() - start
+        print(f"{index_class.__name__}: {memory / 2**20:.2f} MiB ({memory / total_postings:.1f} bytes per posting), built in {build_time:.2f}s")
+
+        try:
+            print(f"    pickled size: {len(pickle.dumps(inv_index)) / 2**20:.2f} MiB")
+        except (pickle.PicklingError, AttributeError, TypeError) as error:
+            print(f"    cannot be pickled: {error}")
+
+def benchmark_postings_compression(index_file=TITLES_INDEX_FILE):
+    '''
+    Compare the size (bytes per posting) and decoding throughput of the compressed postings lists with the uncompressed arrays.
+    '''
+    compact_index = load_inverted_index_jsonl(index_file, CompactInvertedIndex)
+    uncompressed = dict(compact_index.index)
+    total_postings = sum(len(postings) for postings in uncompressed.values())
+
+    start = time.perf_counter()
+    compact_index.compress()
+    compress_time = time.perf_counter() - start
+    compressed = compact_index.index
+
+    uncompressed_bytes = sum(postings.entries.itemsize * len(postings.entries) for postings in uncompressed.values())
+    compressed_bytes = sum(len(postings.to_bytes()) for postings in compressed.values())
+    print(f"Uncompressed: {uncompressed_bytes / total_postings:.2f} bytes per posting")
+    print(f"Compressed:   {compressed_bytes / total_postings:.2f} bytes per posting (including skip tables), compressed in {compress_time:.2f}s")
+
+    for name, postings_lists in (("Uncompressed", uncompressed), ("Compressed", compressed)):
+        start = time.perf_counter()
+        for postings in postings_lists.values():
+            postings.doc_numbers()
+            postings.frequencies()
+        decode_time = time.perf_counter() - start
+        print(f"{name} decoding: {total_postings / decode_time / 1e6:.2f} million postings per second")
+
+    # Intersect the postings lists of the most frequent terms, checking the result against the uncompressed postings
+    frequent_terms = sorted(compressed, key=lambda term: len(compressed[term]), reverse=True)[:20]
+    start = time.perf_counter()
+    for first, second in zip(frequent_terms, frequent_terms[1:]):
+        common = intersect_postings([compressed[first], compressed[second]])
+        assert common == sorted(set(uncompressed[first].doc_numbers()) & set(uncompressed[second].doc_numbers()))
+    print(f"Intersected {len(frequent_terms) - 1} pairs of frequent terms with skips in {time.perf_counter() - start:.4f}s")
+
+def benchmark_parallel_indexing(max_workers=None, titles_only=False):
+    '''
+    Build the index of the corpus with 1 to max_workers worker processes, report the documents indexed per second and check
+    that every parallel build saves exactly the same index files as the build with 1 worker.
+    '''
+    max_workers = max_workers or os.cpu_count() or 1
+    saved_files = {}
+
+    worker_counts = sorted({1, max_workers} | {workers for workers in (2, 4, 8, 16) if workers < max_workers})
+    for workers in worker_counts:
+        start = time.perf_counter()
+        inv_index, _ = build_index_parallel(CORPUS_FILE, workers=workers, titles_only=titles_only)
+        build_time = time.perf_counter() - start
+
+        file_path = f"benchmark_index_{workers}.jsonl"
+        save_inverted_index_jsonl(inv_index, file_path)
+        files = (file_path, file_path.replace(".jsonl", "_doc_stats.jsonl"))
+        contents = []
+        for path in files:
+            with open(path, "rb") as file:
+                contents.append(file.read())
+            os.remove(path)
+        saved_files[workers] = contents
+
+        document_count = inv_index.get_document_count()
+        print(f"{workers} workers: {document_count / build_time:.0f} docs/s ({build_time:.2f}s), identical to 1 worker: {saved_files[workers] == saved_files[1]}")
+
+def benchmark_streaming_ingestion(batch_size=1000):
+    '''
+    Compare the peak memory of loading the whole corpus with load_jsonl and keeping every Document with the streaming ingestion,
+    which discards the raw text of every batch once its index terms are extracted.
+    '''
+    def load_all():
+        documents = {}
+        for doc in load_jsonl(CORPUS_FILE):
+            documents[doc["_id"]] = Document(title=doc['title'], text=doc['text'], _id=doc['_id'], metadata=doc['metadata'])
+        inv_index = InvertedIndex()
+        for document in documents.values():
+            inv_index.add_documents(document.get_id(), document.get_index_terms())
+        return inv_index, documents
+
+    def stream():
+        doc_store = DocStore(CORPUS_FILE)
+        inv_index, documents = build_index_parallel(CORPUS_FILE, workers=1, keep_documents=True, discard_text=True, doc_store=doc_store, batch_size=batch_size)
+        return inv_index, documents, doc_store
+
+    for name, ingest in (("load_jsonl", load_all), (f"streaming (batches of {batch_size})", stream)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = ingest()
+        ingest_time = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{name}: peak {peak / 2**20:.1f} MiB, retained {current / 2**20:.1f} MiB, {ingest_time:.2f}s")
+
+    doc_store = result[2]
+    doc_id = next(iter(doc_store.offsets))
+    print(f"Snippet of document {doc_id} from the doc store: {doc_store.get_snippet(doc_id, length=80)}")
+
+def benchmark_batch_queries(k1=1.8, b=1.0, delta=1.0, top_n=100, batch_size=256):
+    '''
+    Compare ranking all the queries at once with the batch engine with ranking them one at a time with the term-at-a-time scorer.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+
+    start = time.perf_counter()
+    expected = [bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+    taat_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = bm25_batch_rank_documents_for_queries(queries, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n, batch_size=batch_size)
+    batch_time = time.perf_counter() - start
+
+    print(f"One query at a time: {taat_time:.2f}s, batch: {batch_time:.2f}s for {len(queries)} queries")
+    print(f"Rankings are identical: {expected == actual}")
+    return expected == actual
+
+def benchmark_matrix_ranking(k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Compare building the BM25+ document x term matrices and ranking with sparse matrix-vector products with building the
+    dictionary document vectors and ranking with the term-at-a-time scorer.
+    '''
+    documents = {}
+    for doc in load_jsonl(CORPUS_FILE):
+        documents[doc["_id"]] = Document(title=doc['title'], text=doc['text'], _id=doc['_id'], metadata=doc['metadata'])
+    queries = load_queries()
+
+    start = time.perf_counter()
+    inv_index = InvertedIndex()
+    for document in documents.values():
+        inv_index.add_documents(document.get_id(), document.get_index_terms())
+    avg_doc_length = inv_index.get_avg_unique_terms()
+    document_vectors = {}
+    for _id, document in documents.items():
+        document_vectors[_id] = get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=0.25)
+    dict_build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matrix = BM25Matrix(documents, avg_doc_length, k1=k1, b=b, delta=delta)
+    matrix_build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    expected = [bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+    dict_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = [matrix.rank(query, top_n=top_n) for query in queries]
+    matrix_time = time.perf_counter() - start
+
+    # The matrices add up the weights in another order, so the scores may differ in the last bits
+    matching = sum(same_ranking(e, a, tolerance=1e-12) for e, a in zip(expected, actual))
+    print(f"Build: dictionaries {dict_build_time:.2f}s, matrices {matrix_build_time:.2f}s ({dict_build_time / matrix_build_time:.1f}x), {matrix.products.nnz} postings, {len(matrix.vocabulary)} terms")
+    print(f"Ranking: dictionaries {dict_time:.2f}s, matrices {matrix_time:.2f}s ({dict_time / matrix_time:.1f}x) for {len(queries)} queries")
+    print(f"Rankings are the same for {matching}/{len(queries)} queries")
+    return matching == len(queries)
+
+def benchmark_async_frontend(k1=1.8, b=1.0, delta=1.0, top_n=100, max_batch_size=32, max_wait=0.005, repeats=2):
+    '''
+    Send every query repeats times concurrently to the micro-batching front end and compare with answering them one at a time.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    service = RetrievalService(inv_index, documents, document_vectors, avg_doc_length, k1=k1, b=b, delta=delta)
+    texts = [query['text'] for query in load_jsonl(QUERIES_FILE)] * repeats
+
+    start = time.perf_counter()
+    expected = [service.search(text, top_n) for text in texts]
+    sequential_time = time.perf_counter() - start
+
+    async def send_all():
+        frontend = AsyncQueryFrontend(service, max_batch_size=max_batch_size, max_wait=max_wait)
+        results = await asyncio.gather(*(frontend.search(text, top_n) for text in texts))
+        await frontend.close()
+        return results, frontend.stats()
+
+    start = time.perf_counter()
+    actual, stats = asyncio.run(send_all())
+    async_time = time.perf_counter() - start
+
+    print(f"One at a time: {sequential_time:.2f}s, micro-batched: {async_time:.2f}s for {len(texts)} requests")
+    print(f"Stats: {stats}")
+    print(f"Rankings are identical: {expected == actual}")
+    return expected == actual
+
+def benchmark_result_cache(k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Rank every query, then the same queries in upper case (same index terms, so they should be answered from the cache),
+    then add a document to the index and check that the cache is invalidated.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+    variants = [Query(_id=query.get_id(), query=query.get_query().upper()) for query in queries]
+    cache = QueryResultCache()
+
+    def rank_all(queries):
+        start = time.perf_counter()
+        rankings = [cached_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n, cache=cache) for query in queries]
+        return rankings, time.perf_counter() - start
+
+    expected, cold_time = rank_all(queries)
+    actual, warm_time = rank_all(variants)
+    print(f"Cold: {cold_time:.3f}s, warm (same index terms): {warm_time:.3f}s for {len(queries)} queries")
+    print(f"Stats: {cache.stats()}")
+
+    inv_index.add_documents("benchmark-document", {"cache": 1})
+    rank_all(queries[:1])
+    print(f"After adding a document: {cache.stats()}")
+    return expected == actual and cache.invalidations == 1
+
+def benchmark_term_cache(k1=1.8, b=1.0, delta=1.0, top_n=100, max_postings=1000000):
+    '''
+    Compute the document vectors and rank the queries with a compressed memory-mapped index, with and without the term cache in front of it.
+    '''
+    documents, inv_index, avg_doc_length, _ = load_scifact()
+    queries = load_queries()
+
+    with tempfile.TemporaryDirectory() as directory:
+        base_path = os.path.join(directory, "index")
+        save_inverted_index_binary(inv_index, base_path, codec=VBYTE_CODEC)
+        with load_inverted_index_binary(base_path) as binary_index:
+            results = {}
+            for name, index in (("No cache", binary_index), ("Term cache", CachedInvertedIndex(binary_index, max_postings))):
+                start = time.perf_counter()
+                document_vectors = {_id: get_bm25_document_vector(document, index, len(documents), avg_doc_length, delta=0.25) for _id, document in documents.items()}
+                vectors_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                results[name] = [bm25_taat_rank_documents_for_query(query, index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+                ranking_time = time.perf_counter() - start
+                print(f"{name}: document vectors {vectors_time:.2f}s, ranking {ranking_time:.2f}s for {len(queries)} queries")
+                if isinstance(index, CachedInvertedIndex):
+                    print(f"    {index.stats()}")
+
+    identical = results["No cache"] == results["Term cache"]
+    print(f"Rankings are identical: {identical}")
+    return identical
+
+def benchmark_segmented_index(k1=1.8, b=1.0, delta=1.0, top_n=100, buffer_size=500, merge_factor=4):
+    '''
+    Add the corpus to a segmented index (with merges in the background), then check that searching its snapshot gives the same
+    rankings as the term-at-a-time scorer over a single index of the same documents.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        with SegmentedIndex(directory, buffer_size=buffer_size, merge_factor=merge_factor) as segmented_index:
+            for _id, document in documents.items():
+                segmented_index.add_document(_id, document.get_index_terms())
+            segmented_index.flush()
+            segmented_index.wait_for_merges()
+            ingest_time = time.perf_counter() - start
+            print(f"Added {len(segmented_index)} documents in {ingest_time:.2f}s: {segmented_index.merges} merges, segments {[len(segment) for segment in segmented_index.segments]}")
+
+            snapshot = segmented_index.snapshot()
+            start = time.perf_counter()
+            actual = [snapshot.search(query, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+            search_time = time.perf_counter() - start
+
+    expected = [bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+    matching = sum(same_ranking(e, a) for e, a in zip(expected, actual))
+    print(f"Searched the snapshot in {search_time:.2f}s for {len(queries)} queries (document vectors computed on first use)")
+    print(f"Rankings are the same for {matching}/{len(queries)} queries")
+    return matching == len(queries)
+
+def benchmark_multi_field_index():
+    '''
+    Compare building the index of the whole documents and the index of the titles separately (as main.py used to) with building
+    one multi-field index, and check that its field and combined postings are the same.
+    '''
+    def postings(inv_index):
+        return {term: dict(term_postings) for term, term_postings in inv_index.index.items()}
+
+    start = time.perf_counter()
+    full_index, _ = build_index_parallel(CORPUS_FILE, workers=1)
+    titles_index, _ = build_index_parallel(CORPUS_FILE, workers=1, titles_only=True)
+    separate_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    multi_field_index, _ = build_index_parallel(CORPUS_FILE, workers=1, index_class=MultiFieldInvertedIndex)
+    multi_field_time = time.perf_counter() - start
+
+    identical = postings(full_index) == postings(multi_field_index) and postings(titles_index) == postings(multi_field_index.get_field_index("title"))
+    print(f"Two separate indexes: {separate_time:.2f}s, one multi-field index: {multi_field_time:.2f}s")
+    print(f"Combined and title postings are identical: {identical}")
+    return identical
+
+def benchmark_positional_index(k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Build the positional index of the corpus and check that its term frequencies are the ones of the inverted index and that the
+    lazily loaded index has the same positions. Then rank the queries as phrases and check every match against the positions.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+
+    start = time.perf_counter()
+    positional_index = build_positional_index(CORPUS_FILE)
+    build_time = time.perf_counter() - start
+    same_freqs = all(
+        dict(inv_index.get_postings(term)) == {doc_id: len(positions) for doc_id, positions in positional_index.get_doc_positions(term).items()}
+        for term in inv_index.index
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        base_path = os.path.join(directory, "positions")
+        positional_index.save(base_path)
+        size = os.path.getsize(base_path + ".pos")
+        lazy_index = LazyPositionalIndex(base_path)
+        same_positions = all(lazy_index.get_doc_positions(term) == positional_index.get_doc_positions(term) for term in inv_index.index)
+        lazy_index.close()
+    print(f"Built the positional index in {build_time:.2f}s ({size / 2**20:.1f} MiB of positions)")
+    print(f"Term frequencies match the inverted index: {same_freqs}, lazily loaded positions are identical: {same_positions}")
+
+    start = time.perf_counter()
+    rankings = [positional_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, positional_index, k1=k1, b=b, delta=delta, top_n=top_n, phrase=True) for query in queries]
+    phrase_time = time.perf_counter() - start
+
+    # A phrase matches a document if some position of its first term is followed by the other terms at their offsets
+    def contains_phrase(phrase_terms, doc_id):
+        first_term, first_offset = phrase_terms[0]
+        return any(
+            all(start - first_offset + offset in positional_index.get_positions(term, doc_id) for term, offset in phrase_terms)
+            for start in positional_index.get_positions(first_term, doc_id)
+        )
+
+    correct = all(
+        all(contains_phrase(get_phrase_terms(query.get_query()), doc_id) for doc_id, _ in ranking)
+        for query, ranking in zip(queries, rankings)
+    )
+    matched = sum(1 for ranking in rankings if ranking)
+    print(f"Ranked {len(queries)} phrase queries in {phrase_time:.2f}s, {matched} with at least one match, all matches verified: {correct}")
+    return same_freqs and same_positions and correct
+
+def benchmark_sharded_index(shards=4, k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Build a sharded index served by worker processes and check that its scatter-gather rankings are the same as the term-at-a-time
+    scorer over one index of the whole corpus.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+
+    start = time.perf_counter()
+    expected = [bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ShardedIndex(CORPUS_FILE, shards=shards, k1=k1, b=b, delta=delta) as sharded_index:
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = sharded_index.search_batch([(query.get_id(), query.get_query()) for query in queries], top_n=top_n)
+        sharded_time = time.perf_counter() - start
+        print(f"Built {shards} shards in {build_time:.2f}s, documents per shard {sharded_index.shard_sizes}")
+
+    matching = sum(same_ranking(e, a) for e, a in zip(expected, actual))
+    print(f"Single index: {single_time:.2f}s, sharded index: {sharded_time:.2f}s for {len(queries)} queries")
+    print(f"Rankings are the same for {matching}/{len(queries)} queries")
+    return matching == len(queries)
+
+def benchmark_preprocessing_startup(repeats=5):
+    '''
+    Measure how long a new Python process takes to import preprocessing.py, and to import it and normalize a first sentence
+    (which loads the stopwords, the spellchecker and the lemmatizer), with and without the prebuilt resources file.
+    '''
+    import preprocessing
+
+    def run(code, env=None):
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+
+    first_query = "import preprocessing; preprocessing.Query('Body-mass index of patients with insulin resistance')"
+    print(f"Import: {run('import preprocessing'):.3f}s (median of {repeats} processes)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, PREPROCESSING_RESOURCES=os.path.join(directory, "missing.json"))
+        print(f"Import and first query, NLTK and pyspellchecker: {run(first_query, env):.3f}s")
+
+        env["PREPROCESSING_RESOURCES"] = os.path.join(directory, "resources.json")
+        preprocessing.build_preprocessing_resources(env["PREPROCESSING_RESOURCES"])
+        print(f"Import and first query, prebuilt resources: {run(first_query, env):.3f}s")
+
+# Pattern of the RegexpTokenizer used before the tokenizer was fused
+REFERENCE_WORD_SPLITTER = re.compile(r"\w+[-]\w+|\w+['.,!?]*|\w+|\S+", re.UNICODE | re.MULTILINE | re.DOTALL)
+
+def reference_extract_index_terms(text, cache):
+    '''The previous extract_index_terms: escape round trip, then every word normalized and counted in the order of the text.'''
+    if not text:
+        return {}
+    text = text.lower().strip()
+    text = text.encode('unicode_escape').decode('unicode_escape')
+    index_terms = dict()
+    for word in REFERENCE_WORD_SPLITTER.findall(text):
+        for root_word in cache.get(word):
+            if root_word in index_terms:
+                index_terms[root_word] += 1
+            else:
+                index_terms[root_word] = 1
+    return index_terms
+
+def benchmark_tokenizer_throughput(repeats=3):
+    '''
+    Measure the throughput in MB/s of extract_index_terms over the text of the corpus, compared with the previous implementation,
+    and check that both give the same term dictionaries (same terms, frequencies and order). The normalization cache is warmed
+    first, so the time is the one of the tokenizer pipeline rather than of the lemmatizer.
+    '''
+    texts = [doc["title"] + " " + doc["text"] for doc in load_jsonl(CORPUS_FILE)]
+    megabytes = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+    cache = NormalizationCache(maxsize=10**7)
+
+    identical = all(list(extract_index_terms(text, cache).items()) == list(reference_extract_index_terms(text, cache).items()) for text in texts)
+
+    for name, extract in (("Previous pipeline", reference_extract_index_terms), ("Single pass", extract_index_terms)):
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for text in texts:
+                extract(text, cache)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name}: {megabytes / best:.1f} MB/s ({megabytes:.1f} MB in {best:.2f}s)")
+
+    print(f"Term dictionaries are identical: {identical}")
+    return identical
+
+def benchmark_lemma_table():
+    '''
+    Build the preprocessing resources with the root words of the corpus, then normalize every distinct token of the corpus with an
+    empty normalization cache, once with the WordNet lemmatizer and once with the prebuilt root words, and check that the index
+    terms are the same.
+    '''
+    import preprocessing
+
+    texts = [doc["title"] + " " + doc["text"] for doc in load_jsonl(CORPUS_FILE)]
+    tokens = sorted({token for text in texts for token in preprocessing.word_splitter.findall(text.lower())})
+    saved = (preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas, preprocessing.resources_checked)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        resources = preprocessing.build_preprocessing_resources(os.path.join(directory, "resources.json"), CORPUS_FILE)
+        print(f"Built {len(resources['lemmas'])} root words in {time.perf_counter() - start:.2f}s")
+
+    try:
+        results = {}
+        for name, lemmas in (("WordNet", None), ("Prebuilt root words", resources["lemmas"])):
+            preprocessing.lemmas = lemmas
+            preprocessing.resources_checked = True
+            start = time.perf_counter()
+            results[name] = [preprocessing.normalize_token(token) for token in tokens]
+            print(f"{name}: normalized {len(tokens)} distinct tokens in {time.perf_counter() - start:.2f}s")
+    finally:
+        preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas, preprocessing.resources_checked = saved
+
+    identical = results["WordNet"] == results["Prebuilt root words"]
+    print(f"Index terms are identical: {identical}")
+    return identical
+
+def benchmark_evaluation(k1=1.8, b=1.0, delta=1.0, top_n=100):
+    '''
+    Evaluate the rankings of the queries in memory, and by writing and reading back a run file (the rankings trec_eval would see),
+    and check that the measures are the same.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+    rankings = bm25_batch_rank_documents_for_queries(queries, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
+    evaluator = Evaluator.from_file()
+
+    start = time.perf_counter()
+    in_memory = evaluator.evaluate(rankings_by_query(queries, rankings))
+    memory_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        run_file = os.path.join(directory, "run.txt")
+        start = time.perf_counter()
+        with open(run_file, "w") as output_file:
+            # Same lines as write_results, without printing the top documents
+            for query, top_documents in zip(queries, rankings):
+                for rank, (doc_id, score) in enumerate(top_documents, start=1):
+                    output_file.write(f"{query.get_id()} Q0 {doc_id} {rank} {score:.6f} run1\n")
+        from_file = evaluator.evaluate(load_run(run_file))
+        file_time = time.perf_counter() - start
+
+    print(f"In memory: {memory_time * 1000:.1f}ms, through a run file: {file_time * 1000:.1f}ms")
+    print(f"Measures: {in_memory}")
+    # The run file rounds the scores to 6 decimals, which can only reorder documents with (almost) tied scores
+    same = all(abs(in_memory[name] - from_file[name]) < 1e-3 for name in in_memory)
+    print(f"Measures are the same: {same}")
+    return same
+
+def benchmark_parameter_sweep(workers=None):
+    '''
+    Evaluate a grid of (k1, b, delta) points with the parameter sweep, check that it gives the same rankings as the term-at-a-time
+    scorer for the parameters of main.py, and compare its time with ranking the queries once per point.
+    '''
+    documents, inv_index, avg_doc_length, document_vectors = load_scifact()
+    queries = load_queries()
+    evaluator = Evaluator.from_file()
+
+    start = time.perf_counter()
+    sweep = ParameterSweep(queries, inv_index, documents, document_vectors, avg_doc_length, evaluator)
+    prepare_time = time.perf_counter() - start
+
+    identical = True
+    for k1, b, delta in ((1.8, 1.0, 1.0), (1.2, 0.5, 1.0)):
+        start = time.perf_counter()
+        expected = {query.get_id(): bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=100) for query in queries}
+        point_time = time.perf_counter() - start
+        identical = identical and expected == sweep.rankings(k1, b, delta)
+
+    grid = make_grid([0.6, 0.9, 1.2, 1.5, 1.8, 2.1], [0.25, 0.5, 0.75, 1.0], [0.0, 0.5, 1.0])
+    start = time.perf_counter()
+    results = run_sweep(sweep, grid, workers=workers)
+    sweep_time = time.perf_counter() - start
+
+    print(f"Gathered {len(sweep.term_freqs)} term-document pairs in {prepare_time:.2f}s")
+    print(f"Evaluated {len(grid)} points in {sweep_time:.2f}s (ranking the queries with the term-at-a-time scorer takes {point_time:.2f}s per point)")
+    print_sweep_results(results, top=5)
+    print(f"Rankings are identical to the term-at-a-time scorer: {identical}")
+    return identical
+
+BENCHMARKS = {
+    "taat_parity": check_taat_parity,
+    "maxscore": benchmark_maxscore,
+    "compact_index_memory": benchmark_compact_index_memory,
+    "postings_compression": benchmark_postings_compression,
+    "parallel_indexing": benchmark_parallel_indexing,
+    "streaming_ingestion": benchmark_streaming_ingestion,
+    "batch_queries": benchmark_batch_queries,
+    "matrix_ranking": benchmark_matrix_ranking,
+    "async_frontend": benchmark_async_frontend,
+    "result_cache": benchmark_result_cache,
+    "term_cache": benchmark_term_cache,
+    "segmented_index": benchmark_segmented_index,
+    "multi_field_index": benchmark_multi_field_index,
+    "positional_index": benchmark_positional_index,
+    "sharded_index": benchmark_sharded_index,
+    "preprocessing_startup": benchmark_preprocessing_startup,
+    "tokenizer_throughput": benchmark_tokenizer_throughput,
+    "lemma_table": benchmark_lemma_table,
+    "evaluation": benchmark_evaluation,
+    "parameter_sweep": benchmark_parameter_sweep,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name} ==")
+        BENCHMARKS[name]()
@@ -0,0 +1,432 @@
+import mmap
+import struct
+import sys
+from math import sqrt
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+from indexing import DocumentStatistics, InvertedIndex, CompactInvertedIndex
+from postings_codec import CompressedPostings, BLOCK_SIZE
+
+# Binary on-disk format of the inverted index. An index saved under base_path is made of 3 files:
+#   base_path.lex:  the lexicon, i.e. the sorted terms and where their postings start in the postings file
+#   base_path.post: the postings, i.e. for every term the sorted internal document numbers followed by the term frequencies,
+#                   either as raw arrays or compressed with postings_codec.py
+#   base_path.docs: the document statistics, i.e. the corpus totals and the document ID, number of unique terms, number of tokens,
+#                   maximum term frequency and sum of squared term frequencies of every document
+# Every file starts with the same header (magic, format version, byte order) and every array starts on an 8-byte boundary,
+# so the files can be opened with mmap and the arrays read in place with memoryview.cast without parsing the whole index.
+
+MAGIC = b"IRBI"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHH")
+COUNT = struct.Struct("<Q")
+TOTALS = struct.Struct("<QQ")
+CODEC = struct.Struct("<II")
+RAW_CODEC, VBYTE_CODEC = 0, 1
+LITTLE_ENDIAN, BIG_ENDIAN = 1, 2
+
+LEXICON_EXTENSION = ".lex"
+POSTINGS_EXTENSION = ".post"
+DOC_STATS_EXTENSION = ".docs"
+
+def _byte_order():
+    return LITTLE_ENDIAN if sys.byteorder == "little" else BIG_ENDIAN
+
+def _write_header(file):
+    file.write(HEADER.pack(MAGIC, FORMAT_VERSION, _byte_order()))
+
+def _write_array(file, values):
+    '''Write an array, padding the file first so the array starts on an 8-byte boundary.'''
+    file.write(b"\0" * (-file.tell() % 8))
+    file.write(values.tobytes())
+
+def _write_strings(file, strings):
+    '''Write a list of strings as an array of offsets followed by the UTF-8 encoded strings.'''
+    encoded = [string.encode("utf-8") for string in strings]
+    offsets = array("Q", [0])
+    for string in encoded:
+        offsets.append(offsets[-1] + len(string))
+    _write_array(file, offsets)
+    file.write(b"".join(encoded))
+
+def save_inverted_index_binary(inv_index: InvertedIndex, base_path, codec=RAW_CODEC, block_size=BLOCK_SIZE):
+    '''
+    Save an inverted index (InvertedIndex or CompactInvertedIndex) in the binary format.
+
+    Parameters:
+        inv_index (InvertedIndex): The inverted index to save.
+        base_path (str): Path of the index files without their extensions.
+        codec (int): RAW_CODEC to write the postings as arrays or VBYTE_CODEC to compress them.
+        block_size (int): Number of postings per compressed block (only used by VBYTE_CODEC).
+    '''
+    # Number the live documents in the order of their statistics (the order they were added in), including the documents
+    # without any index term, so the saved index has the same N and average document length as the index in memory
+    doc_ids = list(inv_index.doc_stats)
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_ids)}
+    doc_stats = [inv_index.doc_stats[doc_id] for doc_id in doc_ids]
+    unique_terms = array("I", (stats.unique_terms for stats in doc_stats))
+    tokens = array("I", (stats.length for stats in doc_stats))
+    max_term_frequencies = array("I", (stats.max_term_frequency for stats in doc_stats))
+    sums_of_squares = array("Q", (stats.sum_of_squares for stats in doc_stats))
+
+    # Only the live postings are written (get_postings skips the tombstoned documents) and the terms without any are left out
+    terms = []
+    postings_offsets = array("Q")
+    doc_freqs = array("I")
+
+    with open(base_path + POSTINGS_EXTENSION, "wb") as postings_file:
+        _write_header(postings_file)
+        for term in sorted(inv_index.index.keys(), key=lambda term: term.encode("utf-8")):
+            postings = sorted((doc_numbers[doc_id], freq) for doc_id, freq in inv_index.get_postings(term).items())
+            if not postings:
+                continue
+            terms.append(term)
+            doc_freqs.append(len(postings))
+            if codec == RAW_CODEC:
+                postings_file.write(b"\0" * (-postings_file.tell() % 8))
+            postings_offsets.append(postings_file.tell())
+            doc_numbers_array = array("I", (doc_number for doc_number, _ in postings))
+            frequencies_array = array("I", (freq for _, freq in postings))
+            if codec == VBYTE_CODEC:
+                postings_file.write(CompressedPostings.from_postings(None, doc_numbers_array, frequencies_array, block_size).to_bytes())
+            else:
+                postings_file.write(doc_numbers_array.tobytes())
+                postings_file.write(frequencies_array.tobytes())
+        postings_offsets.append(postings_file.tell())
+
+    with open(base_path + LEXICON_EXTENSION, "wb") as lexicon_file:
+        _write_header(lexicon_file)
+        lexicon_file.write(COUNT.pack(len(terms)))
+        lexicon_file.write(CODEC.pack(codec, block_size))
+        _write_array(lexicon_file, postings_offsets)
+        _write_array(lexicon_file, doc_freqs)
+        _write_strings(lexicon_file, terms)
+
+    with open(base_path + DOC_STATS_EXTENSION, "wb") as doc_stats_file:
+        _write_header(doc_stats_file)
+        doc_stats_file.write(COUNT.pack(len(doc_ids)))
+        doc_stats_file.write(TOTALS.pack(inv_index.total_length, inv_index.total_unique_terms))
+        _write_array(doc_stats_file, unique_terms)
+        _write_array(doc_stats_file, tokens)
+        _write_array(doc_stats_file, max_term_frequencies)
+        _write_array(doc_stats_file, sums_of_squares)
+        _write_strings(doc_stats_file, doc_ids)
+
+def convert_jsonl_index(jsonl_path, base_path, codec=RAW_CODEC):
+    '''
+    Convert an inverted index saved with doc_utils.save_inverted_index_jsonl to the binary format.
+
+    Parameters:
+        jsonl_path (str): Path of the JSONL index file.
+        base_path (str): Path of the binary index files without their extensions.
+        codec (int): RAW_CODEC or VBYTE_CODEC.
+    '''
+    from doc_utils import load_inverted_index_jsonl
+
+    save_inverted_index_binary(load_inverted_index_jsonl(jsonl_path, CompactInvertedIndex), base_path, codec=codec)
+
+
+class _MappedFile:
+    '''A read-only memory-mapped index file with a cursor used to read its arrays in order.'''
+
+    def __init__(self, file_path):
+        with open(file_path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+        magic, version, byte_order = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{file_path} is not a binary index file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{file_path} has format version {version}, only version {FORMAT_VERSION} is supported")
+        if byte_order != _byte_order():
+            raise ValueError(f"{file_path} was written on a machine with a different byte order")
+        self.position = HEADER.size
+
+    def read_count(self):
+        count, = COUNT.unpack_from(self.map, self.position)
+        self.position += COUNT.size
+        return count
+
+    def read_totals(self):
+        totals = TOTALS.unpack_from(self.map, self.position)
+        self.position += TOTALS.size
+        return totals
+
+    def read_codec(self):
+        codec, block_size = CODEC.unpack_from(self.map, self.position)
+        self.position += CODEC.size
+        return codec, block_size
+
+    def read_array(self, typecode, length):
+        self.position += -self.position % 8
+        values = self.view[self.position:self.position + length * array(typecode).itemsize].cast(typecode)
+        self.position += values.nbytes
+        return values
+
+    def read_strings(self, count):
+        offsets = self.read_array("Q", count + 1)
+        strings = self.view[self.position:self.position + offsets[-1]]
+        self.position += offsets[-1]
+        return offsets, strings
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+
+class BinaryPostings(Mapping):
+    '''Postings list of one term decoded from the postings file. Behaves like the dictionary returned by InvertedIndex.get_postings.'''
+
+    __slots__ = ("doc_numbers", "frequencies", "index")
+
+    def __init__(self, index, doc_numbers, frequencies):
+        self.doc_numbers = doc_numbers
+        self.frequencies = frequencies
+        self.index = index
+
+    def find(self, doc_number: int):
+        '''Returns the position of an internal document number in the postings list, or -1 if it is not there.'''
+        position = bisect_left(self.doc_numbers, doc_number)
+        if position < len(self.doc_numbers) and self.doc_numbers[position] == doc_number:
+            return position
+        return -1
+
+    def __getitem__(self, doc_id):
+        doc_number = self.index.find_doc_number(doc_id)
+        position = -1 if doc_number is None else self.find(doc_number)
+        if position < 0:
+            raise KeyError(doc_id)
+        return self.frequencies[position]
+
+    def __contains__(self, doc_id):
+        doc_number = self.index.find_doc_number(doc_id)
+        return doc_number is not None and self.find(doc_number) >= 0
+
+    def __iter__(self):
+        get_doc_id = self.index.get_doc_id
+        return (get_doc_id(doc_number) for doc_number in self.doc_numbers)
+
+    def __len__(self):
+        return len(self.doc_numbers)
+
+    def items(self):
+        get_doc_id = self.index.get_doc_id
+        return [(get_doc_id(doc_number), freq) for doc_number, freq in zip(self.doc_numbers, self.frequencies)]
+
+
+class BinaryLexicon(Mapping):
+    '''The terms of a binary index, searched in place in the memory-mapped lexicon. Behaves like InvertedIndex.index.'''
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, term):
+        postings = self.index.get_postings(term)
+        if not postings:
+            raise KeyError(term)
+        return postings
+
+    def __contains__(self, term):
+        return self.index.find_term(term) >= 0
+
+    def __iter__(self):
+        return (self.index.get_term(term_number) for term_number in range(self.index.term_count))
+
+    def __len__(self):
+        return self.index.term_count
+
+
+class BinaryDocumentStatistics(Mapping):
+    '''The statistics of the documents of a binary index, read in place in the memory-mapped file. Behaves like InvertedIndex.doc_stats.'''
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, doc_id):
+        doc_number = self.index.find_doc_number(doc_id)
+        if doc_number is None:
+            raise KeyError(doc_id)
+        index = self.index
+        return DocumentStatistics(index.tokens[doc_number], index.unique_terms[doc_number], index.max_term_frequencies[doc_number], index.sums_of_squares[doc_number])
+
+    def __contains__(self, doc_id):
+        return self.index.find_doc_number(doc_id) is not None
+
+    def __iter__(self):
+        return (self.index.get_doc_id(doc_number) for doc_number in range(self.index.doc_count))
+
+    def __len__(self):
+        return self.index.doc_count
+
+
+class BinaryInvertedIndex(InvertedIndex):
+    '''
+    Read-only inverted index opened from the binary format with mmap. Nothing is deserialized when the index is opened:
+    terms are found by binary search in the lexicon and a term's postings are only read when get_postings is called.
+    The postings (index) and document statistics (doc_stats) are read-only views of the files.
+    '''
+
+    def __init__(self, base_path):
+        super().__init__()
+        self.base_path = base_path
+
+        self.lexicon_file = _MappedFile(base_path + LEXICON_EXTENSION)
+        self.term_count = self.lexicon_file.read_count()
+        self.codec, self.block_size = self.lexicon_file.read_codec()
+        self.postings_offsets = self.lexicon_file.read_array("Q", self.term_count + 1)
+        self.doc_freqs = self.lexicon_file.read_array("I", self.term_count)
+        self.term_offsets, self.terms = self.lexicon_file.read_strings(self.term_count)
+
+        self.postings_file = _MappedFile(base_path + POSTINGS_EXTENSION)
+
+        self.doc_stats_file = _MappedFile(base_path + DOC_STATS_EXTENSION)
+        self.doc_count = self.doc_stats_file.read_count()
+        self.total_length, self.total_unique_terms = self.doc_stats_file.read_totals()
+        self.unique_terms = self.doc_stats_file.read_array("I", self.doc_count)
+        self.tokens = self.doc_stats_file.read_array("I", self.doc_count)
+        self.max_term_frequencies = self.doc_stats_file.read_array("I", self.doc_count)
+        self.sums_of_squares = self.doc_stats_file.read_array("Q", self.doc_count)
+        self.doc_id_offsets, self.doc_id_strings = self.doc_stats_file.read_strings(self.doc_count)
+
+        # Built the first time they are needed
+        self.doc_ids = None
+        self.doc_numbers = None
+
+        self.index = BinaryLexicon(self)
+        self.doc_stats = BinaryDocumentStatistics(self)
+
+    def get_term(self, term_number: int):
+        return bytes(self.terms[self.term_offsets[term_number]:self.term_offsets[term_number + 1]]).decode("utf-8")
+
+    def find_term(self, term: str):
+        '''Returns the term number of a term by binary search in the sorted lexicon, or -1 if the term is not in the index.'''
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if bytes(self.terms[self.term_offsets[middle]:self.term_offsets[middle + 1]]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.terms[self.term_offsets[low]:self.term_offsets[low + 1]] == key:
+            return low
+        return -1
+
+    def load_doc_ids(self):
+        '''Decode the document IDs (only done once, the first time a document ID or number is needed).'''
+        self.doc_ids = [bytes(self.doc_id_strings[self.doc_id_offsets[i]:self.doc_id_offsets[i + 1]]).decode("utf-8") for i in range(self.doc_count)]
+        self.doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(self.doc_ids)}
+
+    def get_doc_id(self, doc_number: int):
+        if self.doc_ids is None:
+            self.load_doc_ids()
+        return self.doc_ids[doc_number]
+
+    def find_doc_number(self, doc_id):
+        if self.doc_numbers is None:
+            self.load_doc_ids()
+        return self.doc_numbers.get(doc_id)
+
+    def add_documents(self, doc_id: int, terms: dict):
+        raise TypeError("A binary inverted index is read-only, add the documents to an InvertedIndex and save it again")
+
+    def add_postings(self, term: str, postings: dict):
+        raise TypeError("A binary inverted index is read-only, add the postings to an InvertedIndex and save it again")
+
+    def add_posting(self, term: str, doc_id, freq: int):
+        raise TypeError("A binary inverted index is read-only, add the postings to an InvertedIndex and save it again")
+
+    def merge(self, other):
+        raise TypeError("A binary inverted index is read-only, merge the indexes into an InvertedIndex and save it again")
+
+    def delete_document(self, doc_id, terms: dict=None):
+        raise TypeError("A binary inverted index is read-only, delete the document from an InvertedIndex and save it again")
+
+    def update_document(self, doc_id, terms: dict, old_terms: dict=None):
+        raise TypeError("A binary inverted index is read-only, update the document in an InvertedIndex and save it again")
+
+    def get_postings(self, term: str):
+        '''Get postings list for a term, reading it from the postings file.
+
+        term (str): term obtained from tokenization step
+
+        Returns:
+            BinaryPostings or CompressedPostings: the document IDs and their term frequencies (an empty dict if the term is not in the index)
+        '''
+        term_number = self.find_term(term)
+        if term_number < 0:
+            return {}
+
+        # Only this term's postings are copied out of the memory map
+        doc_freq = self.doc_freqs[term_number]
+        start = self.postings_offsets[term_number]
+        if self.codec == VBYTE_CODEC:
+            end = self.postings_offsets[term_number + 1]
+            return CompressedPostings.from_bytes(self, doc_freq, self.postings_file.map[start:end], self.block_size)
+
+        doc_numbers = array("I", self.postings_file.map[start:start + 4 * doc_freq])
+        frequencies = array("I", self.postings_file.map[start + 4 * doc_freq:start + 8 * doc_freq])
+        return BinaryPostings(self, doc_numbers, frequencies)
+
+    def get_doc_freq(self, term: str):
+        '''Get the number of documents a term appears in, from the lexicon (the postings list is not read).'''
+        term_number = self.find_term(term)
+        return 0 if term_number < 0 else self.doc_freqs[term_number]
+
+    def get_total_terms_in_doc(self, doc_id: int):
+        doc_number = self.find_doc_number(doc_id)
+        return 0 if doc_number is None else self.tokens[doc_number]
+
+    def get_max_term_frequency_in_doc(self, doc_id: int):
+        doc_number = self.find_doc_number(doc_id)
+        return 0 if doc_number is None else self.max_term_frequencies[doc_number]
+
+    def get_unique_terms_in_doc(self, doc_id: int):
+        doc_number = self.find_doc_number(doc_id)
+        return 0 if doc_number is None else self.unique_terms[doc_number]
+
+    def get_doc_norm(self, doc_id: int):
+        doc_number = self.find_doc_number(doc_id)
+        return 0.0 if doc_number is None else sqrt(self.sums_of_squares[doc_number])
+
+    def get_document_count(self):
+        return self.doc_count
+
+    def get_avg_doc_length(self):
+        return self.total_length / self.doc_count if self.doc_count else 0
+
+    def get_avg_unique_terms(self):
+        return self.total_unique_terms / self.doc_count if self.doc_count else 0
+
+    def close(self):
+        '''Release the memory maps of the index files.'''
+        for values in (self.postings_offsets, self.doc_freqs, self.term_offsets, self.terms, self.unique_terms, self.tokens,
+                       self.max_term_frequencies, self.sums_of_squares, self.doc_id_offsets, self.doc_id_strings):
+            values.release()
+        for mapped_file in (self.lexicon_file, self.postings_file, self.doc_stats_file):
+            mapped_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_inverted_index_binary(base_path):
+    '''
+    Open an inverted index saved in the binary format.
+
+    Parameters:
+        base_path (str): Path of the index files without their extensions.
+    Returns:
+        BinaryInvertedIndex: The memory-mapped inverted index.
+    '''
+    return BinaryInvertedIndex(base_path)
+
+# Convert an existing JSONL index: python binary_index.py inverted_index_titles.jsonl inverted_index_titles [--compress]
+if __name__ == "__main__":
+    convert_jsonl_index(sys.argv[1], sys.argv[2], codec=VBYTE_CODEC if "--compress" in sys.argv[3:] else RAW_CODEC)
+    print(f"Converted {sys.argv[1]} to {sys.argv[2]}{LEXICON_EXTENSION}, {sys.argv[2]}{POSTINGS_EXTENSION} and {sys.argv[2]}{DOC_STATS_EXTENSION}.")
@@ -1,25 +1,206 @@
+import glob
 import json
 import os
 
-from indexing import InvertedIndex
+from indexing import InvertedIndex, CompactInvertedIndex, DocumentStatistics
+from preprocessing import StoredDocument
 
 def load_jsonl(file_path):
     with open(file_path, 'r') as file:
         return [json.loads(line) for line in file]
 
+# Read a JSONL file one record at a time instead of loading the whole file (with_offsets also yields the byte offset of each record)
+def iter_jsonl(file_path, with_offsets=False):
+    with open(file_path, 'rb') as file:
+        offset = 0
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield (offset, record) if with_offsets else record
+            offset += len(line)
+
+# Group the items of an iterable into lists of at most batch_size items
+def iter_batches(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class DocStore:
+    '''
+    Lightweight handle to the documents of a JSONL corpus: only the byte offset of every document is kept in memory and a
+    document is read back from the file when it is needed (e.g. to show a snippet of a retrieved document).
+    '''
+
+    def __init__(self, file_path, offsets=None):
+        self.file_path = file_path
+        self.offsets = {} if offsets is None else offsets #doc_id -> byte offset of the document in the file
+
+    @classmethod
+    def build(cls, file_path):
+        '''Scan a corpus file and record the offset of every document.'''
+        return cls(file_path, {record["_id"]: offset for offset, record in iter_jsonl(file_path, with_offsets=True)})
+
+    def add(self, doc_id, offset):
+        self.offsets[doc_id] = offset
+
+    def get(self, doc_id):
+        '''Returns the record of a document (with its title, text and metadata) or None if it is not in the store.'''
+        offset = self.offsets.get(doc_id)
+        if offset is None:
+            return None
+        with open(self.file_path, 'rb') as file:
+            file.seek(offset)
+            return json.loads(file.readline())
+
+    def get_snippet(self, doc_id, length=200):
+        '''Returns the title and the beginning of the text of a document.'''
+        record = self.get(doc_id)
+        if record is None:
+            return ""
+        text = record.get("text", "")
+        return f"{record.get('title', '')}: {text[:length]}{'...' if len(text) > length else ''}"
+
+    def __contains__(self, doc_id):
+        return doc_id in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+# The document statistics of an index are saved next to it, e.g. inverted_index.jsonl -> inverted_index_doc_stats.jsonl
+def get_doc_stats_path(file_path):
+    root, extension = os.path.splitext(file_path)
+    return root + "_doc_stats" + extension
+
 def save_inverted_index_jsonl(inv_index, file_path):
+    # Deleted documents are left out, and the segments of changes of a previous version of the index are removed
     with open(file_path, 'w') as file:
-        for term, postings in inv_index.index.items():
-            file.write(json.dumps({term: postings}) + "\n")
+        for term in inv_index.index:
+            postings = inv_index.get_postings(term)
+            if postings:
+                file.write(json.dumps({term: dict(postings.items())}) + "\n")
+
+    with open(get_doc_stats_path(file_path), 'w') as file:
+        for doc_id, stats in inv_index.doc_stats.items():
+            file.write(json.dumps({doc_id: stats.to_dict()}) + "\n")
+
+    for segment_path in get_segment_paths(file_path):
+        os.remove(segment_path)
+    inv_index.mark_saved()
+
+# The changes made to an index after it was saved are appended as segments, e.g. inverted_index.jsonl -> inverted_index_segment_1.jsonl
+def get_segment_path(file_path, number):
+    root, extension = os.path.splitext(file_path)
+    return f"{root}_segment_{number}{extension}"
 
-# Load inverted index from JSONL file
-def load_inverted_index_jsonl(file_path):
-    inverted_index = InvertedIndex()
+def get_segment_numbers(file_path):
+    '''Returns the numbers of the segments of an index file, oldest first.'''
+    root, extension = os.path.splitext(file_path)
+    numbers = [path[len(root) + len("_segment_"):len(path) - len(extension)] for path in glob.glob(glob.escape(root) + "_segment_*" + extension)]
+    return sorted(int(number) for number in numbers if number.isdigit())
+
+def get_segment_paths(file_path):
+    return [get_segment_path(file_path, number) for number in get_segment_numbers(file_path)]
+
+def save_index_changes_jsonl(inv_index, file_path):
+    '''
+    Save only what changed since the index was last saved or loaded, as a new segment next to the index file: the whole postings
+    list of every changed term (empty if the term was removed), the statistics of every changed document (null if it was deleted)
+    and the tombstoned documents. Nothing is written to the existing files; compact_index_jsonl merges the segments into the index file.
+    If the index file does not exist yet, the whole index is saved.
+
+    Returns:
+        str: The path of the file written.
+    '''
+    if not os.path.exists(file_path):
+        save_inverted_index_jsonl(inv_index, file_path)
+        return file_path
+
+    numbers = get_segment_numbers(file_path)
+    segment_path = get_segment_path(file_path, numbers[-1] + 1 if numbers else 1)
+    with open(segment_path, 'w') as file:
+        file.write(json.dumps({"deleted": list(inv_index.deleted)}) + "\n")
+        for term in inv_index.changed_terms:
+            file.write(json.dumps({"term": term, "postings": dict(inv_index.get_postings(term).items())}) + "\n")
+        for doc_id in inv_index.changed_docs:
+            stats = inv_index.doc_stats.get(doc_id)
+            file.write(json.dumps({"doc": doc_id, "stats": None if stats is None else stats.to_dict()}) + "\n")
+
+    inv_index.mark_saved()
+    return segment_path
+
+def apply_index_segment_jsonl(inverted_index, doc_stats: dict, segment_path):
+    '''Replay a segment written by save_index_changes_jsonl on an index being loaded (doc_stats are the statistics being loaded).'''
+    for record in iter_jsonl(segment_path):
+        if "deleted" in record:
+            inverted_index.deleted = set(record["deleted"])
+        elif "term" in record:
+            if record["postings"]:
+                inverted_index.add_postings(record["term"], record["postings"])
+            else:
+                inverted_index.index.pop(record["term"], None)
+        elif record["stats"] is None:
+            doc_stats.pop(record["doc"], None)
+        else:
+            doc_stats[record["doc"]] = DocumentStatistics.from_dict(record["stats"])
+
+# Load inverted index from JSONL file (index_class can be InvertedIndex or CompactInvertedIndex), with the segments of changes saved after it
+def load_inverted_index_jsonl(file_path, index_class=InvertedIndex):
+    inverted_index = index_class()
     if os.path.exists(file_path):
         with open(file_path, 'r') as file:
             for line in file:
                 entry = json.loads(line.strip())
                 for term, postings in entry.items():
-                    inverted_index.index[term] = postings
+                    inverted_index.add_postings(term, postings)
+
+        # Indexes saved before the document statistics were added get them rebuilt from the postings
+        doc_stats_path = get_doc_stats_path(file_path)
+        if os.path.exists(doc_stats_path):
+            doc_stats = {}
+            with open(doc_stats_path, 'r') as file:
+                for line in file:
+                    entry = json.loads(line.strip())
+                    for doc_id, stats in entry.items():
+                        doc_stats[doc_id] = DocumentStatistics.from_dict(stats)
+        else:
+            inverted_index.compute_doc_stats()
+            doc_stats = inverted_index.doc_stats
+
+        for segment_path in get_segment_paths(file_path):
+            apply_index_segment_jsonl(inverted_index, doc_stats, segment_path)
+        inverted_index.set_doc_stats(doc_stats)
+        inverted_index.mark_saved()
+        if isinstance(inverted_index, CompactInvertedIndex):
+            inverted_index.pack()
     return inverted_index
 
+def get_stored_documents(inverted_index):
+    '''
+    Returns the documents of an index with their index terms, read from its postings (e.g. to rank the documents of a saved index
+    without preprocessing the corpus again). The documents are in the order of the document statistics, the order of the corpus.
+
+    Returns:
+        documents (dict): A dictionary where the document ID is the key and the StoredDocument object is the value.
+    '''
+    document_terms = {doc_id: {} for doc_id in inverted_index.doc_stats}
+    for term in inverted_index.index:
+        for doc_id, freq in inverted_index.get_postings(term).items():
+            document_terms[doc_id][term] = freq
+    return {doc_id: StoredDocument(doc_id, terms) for doc_id, terms in document_terms.items()}
+
+def compact_index_jsonl(file_path, index_class=InvertedIndex):
+    '''
+    Merge the segments of an index file into it, removing the deleted documents for good.
+
+    Returns:
+        InvertedIndex: The index.
+    '''
+    inverted_index = load_inverted_index_jsonl(file_path, index_class)
+    inverted_index.purge_deleted()
+    save_inverted_index_jsonl(inverted_index, file_path)
+    return inverted_index
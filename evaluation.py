@@ -0,0 +1,194 @@
+import argparse
+import csv
+
+import numpy as np
+
+# In-process evaluation of rankings against the SciFact relevance judgements (qrels), computing the same measures as trec_eval
+# (map, ndcg_cut_10, P_10 and recall_100) without writing run files or running trec_eval. The relevance of the ranked documents of
+# every query is put in one matrix (one row per query) and every measure is computed for all the queries at once with numpy.
+
+QRELS_FILE = "scifact/qrels/test.tsv"
+
+def load_qrels(file_path=QRELS_FILE):
+    '''
+    Load relevance judgements from a TSV file with a header (query-id, corpus-id, score), like scifact/qrels/test.tsv.
+
+    Returns:
+        qrels (dict): A dictionary where the query ID is the key and a dictionary of document IDs and relevance scores is the value.
+    '''
+    qrels = {}
+    with open(file_path, 'r', newline='') as file:
+        reader = csv.reader(file, delimiter="\t")
+        next(reader, None)
+        for row in reader:
+            if row:
+                query_id, doc_id, score = row[:3]
+                qrels.setdefault(query_id, {})[doc_id] = int(score)
+    return qrels
+
+def load_run(file_path):
+    '''
+    Load a run file in the TREC format written by write_results ("query_id Q0 doc_id rank score run_tag").
+    The documents of every query are sorted like trec_eval sorts them: by decreasing score, then by decreasing document ID.
+
+    Returns:
+        rankings (dict): A dictionary where the query ID is the key and the ranked list of (doc_id, score) pairs is the value.
+    '''
+    rankings = {}
+    with open(file_path, 'r') as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) >= 5:
+                rankings.setdefault(fields[0], []).append((fields[2], float(fields[4])))
+    for query_id, ranking in rankings.items():
+        ranking.sort(key=lambda item: (item[1], item[0]), reverse=True)
+    return rankings
+
+
+class Evaluator:
+    '''
+    Computes trec_eval measures for rankings held in memory. The relevance judgements are loaded once and reused for every
+    ranking evaluated (e.g. every point of a parameter sweep).
+    '''
+
+    def __init__(self, qrels: dict, ndcg_cutoff=10, precision_cutoff=10, recall_cutoff=100):
+        '''
+        Parameters:
+            qrels (dict): The relevance judgements (see load_qrels).
+            ndcg_cutoff (int), precision_cutoff (int), recall_cutoff (int): The ranks at which nDCG, precision and recall are computed.
+        '''
+        self.qrels = qrels
+        self.ndcg_cutoff = ndcg_cutoff
+        self.precision_cutoff = precision_cutoff
+        self.recall_cutoff = recall_cutoff
+        self.query_ids = list(qrels)
+        self.query_numbers = {query_id: number for number, query_id in enumerate(self.query_ids)}
+
+        # Number of relevant documents and ideal DCG of every query
+        self.relevant_counts = np.array([sum(1 for score in qrels[query_id].values() if score > 0) for query_id in self.query_ids], dtype=np.float64)
+        ideal_gains = np.zeros((len(self.query_ids), ndcg_cutoff))
+        for number, query_id in enumerate(self.query_ids):
+            gains = sorted((score for score in qrels[query_id].values() if score > 0), reverse=True)[:ndcg_cutoff]
+            ideal_gains[number, :len(gains)] = gains
+        self.discounts = 1 / np.log2(np.arange(2, ndcg_cutoff + 2))
+        self.ideal_dcg = ideal_gains @ self.discounts
+
+    @classmethod
+    def from_file(cls, file_path=QRELS_FILE, **kwargs):
+        return cls(load_qrels(file_path), **kwargs)
+
+    def get_gains(self, rankings: dict):
+        '''
+        Returns the row of every evaluated query and the matrix of the relevance scores of the ranked documents (one row per query,
+        padded with zeros). Only the queries that have relevance judgements and at least one ranked document are evaluated, like trec_eval.
+        '''
+        evaluated = [query_id for query_id, ranking in rankings.items() if ranking and query_id in self.query_numbers]
+        depth = max((len(rankings[query_id]) for query_id in evaluated), default=0)
+        depth = max(depth, self.ndcg_cutoff, self.precision_cutoff, self.recall_cutoff)
+
+        gains = np.zeros((len(evaluated), depth))
+        for row, query_id in enumerate(evaluated):
+            judgements = self.qrels[query_id]
+            # A ranking is a list of (doc_id, score) pairs or of document IDs
+            doc_ids = [item[0] if isinstance(item, tuple) else item for item in rankings[query_id]]
+            gains[row, :len(doc_ids)] = [judgements.get(doc_id, 0) for doc_id in doc_ids]
+        return evaluated, np.maximum(gains, 0)
+
+    def evaluate(self, rankings: dict, per_query=False):
+        '''
+        Evaluate the rankings of a run.
+
+        Parameters:
+            rankings (dict): A dictionary where the query ID is the key and the ranked list of (doc_id, score) pairs (or of document IDs) is the value.
+            per_query (bool): If True, the measures of every query are also returned.
+        Returns:
+            measures (dict): The mean of every measure over the evaluated queries and their number (num_q). If per_query is True,
+                             "per_query" maps every measure to a dictionary of query IDs and values.
+        '''
+        evaluated, gains = self.get_gains(rankings)
+        return self.compute_measures(evaluated, gains, per_query)
+
+    def compute_measures(self, evaluated, gains, per_query=False):
+        '''
+        Compute the measures from the relevance scores of the ranked documents.
+
+        Parameters:
+            evaluated (list): The IDs of the evaluated queries (they must have relevance judgements).
+            gains (ndarray): The relevance scores of the ranked documents of every evaluated query (one row per query, in the same
+                             order, padded with zeros), with at least as many columns as the largest cutoff.
+            per_query (bool): If True, the measures of every query are also returned.
+        Returns:
+            measures (dict): See evaluate.
+        '''
+        rows = np.array([self.query_numbers[query_id] for query_id in evaluated], dtype=np.int64)
+        relevant_counts = self.relevant_counts[rows]
+        # Queries without any relevant document get 0 for every measure instead of dividing by 0
+        safe_counts = np.where(relevant_counts > 0, relevant_counts, 1)
+
+        relevant = gains > 0
+        ranks = np.arange(1, gains.shape[1] + 1)
+        precision_at_rank = np.cumsum(relevant, axis=1) / ranks
+        average_precision = (precision_at_rank * relevant).sum(axis=1) / safe_counts
+
+        ndcg_cutoff = self.ndcg_cutoff
+        ideal_dcg = self.ideal_dcg[rows]
+        dcg = gains[:, :ndcg_cutoff] @ self.discounts
+        ndcg = np.divide(dcg, ideal_dcg, out=np.zeros_like(dcg), where=ideal_dcg > 0)
+
+        precision = relevant[:, :self.precision_cutoff].sum(axis=1) / self.precision_cutoff
+        recall = relevant[:, :self.recall_cutoff].sum(axis=1) / safe_counts
+
+        values = {
+            "map": average_precision,
+            f"ndcg_cut_{ndcg_cutoff}": ndcg,
+            f"P_{self.precision_cutoff}": precision,
+            f"recall_{self.recall_cutoff}": recall,
+        }
+        measures = {name: float(value.mean()) if len(evaluated) else 0.0 for name, value in values.items()}
+        measures["num_q"] = len(evaluated)
+        if per_query:
+            measures["per_query"] = {name: dict(zip(evaluated, value.tolist())) for name, value in values.items()}
+        return measures
+
+    def evaluate_runs(self, runs: dict):
+        '''
+        Evaluate several runs with the same relevance judgements.
+
+        Parameters:
+            runs (dict): A dictionary where the name of the run is the key and its rankings (see evaluate) are the value.
+        Returns:
+            measures (dict): A dictionary where the name of the run is the key and its measures are the value.
+        '''
+        return {name: self.evaluate(rankings) for name, rankings in runs.items()}
+
+def rankings_by_query(queries, rankings):
+    '''
+    Returns the rankings of a list of Query objects (e.g. the output of bm25_batch_rank_documents_for_queries) as a dictionary
+    where the query ID is the key, as taken by Evaluator.evaluate.
+    '''
+    return {query.get_id(): ranking for query, ranking in zip(queries, rankings)}
+
+def print_measures(measures, run_name="all"):
+    '''Print the measures in the format of trec_eval.'''
+    print(f"{'num_q':<22}\t{run_name}\t{measures['num_q']}")
+    for name, value in measures.items():
+        if name not in ("num_q", "per_query"):
+            print(f"{name:<22}\t{run_name}\t{value:.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate TREC run files against the relevance judgements (replaces trec_eval).")
+    parser.add_argument("runs", nargs="+", help="Run files written by main.py")
+    parser.add_argument("--qrels", default=QRELS_FILE, help="Relevance judgements (TSV with a header)")
+    parser.add_argument("-q", "--per-query", action="store_true", help="Also print the measures of every query")
+    args = parser.parse_args()
+
+    evaluator = Evaluator.from_file(args.qrels)
+    for run_file in args.runs:
+        measures = evaluator.evaluate(load_run(run_file), per_query=args.per_query)
+        print(run_file)
+        if args.per_query:
+            for name, values in measures["per_query"].items():
+                for query_id, value in values.items():
+                    print(f"{name:<22}\t{query_id}\t{value:.4f}")
+        print_measures(measures)
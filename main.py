@@ -1,45 +1,43 @@
+import argparse
 import os
-from collections import defaultdict
-from indexing import InvertedIndex
-from retrieve_and_rank import get_bm25_document_vector, process_and_save_results
-from preprocessing import Document
+from indexing import MultiFieldInvertedIndex
+from retrieve_and_rank import get_bm25_document_vector, process_and_save_results_batch, bm25f_rank_documents_for_query, write_results
+from preprocessing import Query, normalization_cache
 from doc_utils import load_inverted_index_jsonl,load_jsonl, save_inverted_index_jsonl
+from parallel_indexing import build_index_parallel
 
 #Corpus loading 
-corpus = load_jsonl('scifact/corpus.jsonl')  # all
+corpus_path = 'scifact/corpus.jsonl'  # all
 queries = load_jsonl('queries_for_test.jsonl')  # test queries
 
-def rank_documents_with_titles_and_text():
-    print("Retrieving and ranking documents...")
+# Reuse the index terms of the tokens normalized in previous runs
+normalization_cache_path = "normalization_cache.json"
+normalization_cache.load(normalization_cache_path)
 
-    documents = {}
+def build_index(titles_only=False):
+    # Preprocess the documents in parallel. documents is a dictionary where the key is the ID and the value is the Document object itself
+    return build_index_parallel(corpus_path, titles_only=titles_only, keep_documents=True, discard_text=True)
 
-    for doc in corpus:
-        # Store the documents in a dictionary where the key is the ID and the value is the Document object itself
-        documents[doc["_id"]] = Document(title=doc['title'], text=doc['text'], _id=doc['_id'], metadata=doc['metadata'])
+def build_multi_field_index():
+    print("Preprocessing the documents (title and text fields)...")
 
-    #add the path to the inverted index
-    index_file_path = "inverted_index.jsonl"
-    index_file_path_titles = "inverted_index_titles.jsonl"
+    # The index has the postings of the whole documents and of their titles and texts separately
+    return build_index_parallel(corpus_path, index_class=MultiFieldInvertedIndex, keep_documents=True, discard_text=True)
 
+def load_or_save_index(index_file_path, built_index):
     if os.path.exists(index_file_path):
         # Load the existing index
         inv_index = load_inverted_index_jsonl(index_file_path)
         print("Loaded existing inverted index.")
     else:
-        # Create and save a new inverted index
-        inv_index = InvertedIndex()
-        # Add documents to inverted index
-        for document in documents.values():
-            
-            terms = document.get_index_terms() 
-        
-            # print(document._id)
-            inv_index.add_documents(document._id, terms)
+        # Save the inverted index built with the documents
+        inv_index = built_index
 
         save_inverted_index_jsonl(inv_index, index_file_path)
         print("Saved new inverted index.")
+    return inv_index
 
+def rank_documents(inv_index, documents, output_file_name, k1, b, delta, run_tag):
     document_vectors = {}
 
     # Calculate the average document length
@@ -59,82 +57,70 @@ def rank_documents_with_titles_and_text():
 
         document_vectors[document_id] = doc_vector
 
-    process_and_save_results(
+    # Rank all the queries at once
+    process_and_save_results_batch(
         queries=queries, 
         inv_index=inv_index, 
         document_vectors=document_vectors, 
         documents=documents, 
         avg_doc_length=avg_doc_length,
-        output_file_name="bm25_result_for_titles_and_text.txt",
-        k1=1.8,
-        b=1.0,
-        delta=1.0,
+        output_file_name=output_file_name,
+        k1=k1,
+        b=b,
+        delta=delta,
         top_n=100,
-        run_tag="run1" 
+        run_tag=run_tag
     )
 
+def rank_documents_with_titles_and_text():
+    print("Retrieving and ranking documents...")
+
+    built_index, documents = build_index()
+
+    #add the path to the inverted index
+    index_file_path = "inverted_index.jsonl"
+    inv_index = load_or_save_index(index_file_path, built_index)
+
+    rank_documents(inv_index, documents, "bm25_result_for_titles_and_text.txt", k1=1.8, b=1.0, delta=1.0, run_tag="run1")
+
 def rank_documents_with_titles():
     print("Retrieving and ranking documents (using only titles)...")
 
-    documents = {}
-
-    for doc in corpus:
-        # Store the documents in a dictionary where the key is the ID and the value is the Document object itself
-        documents[doc["_id"]] = Document(title=doc['title'], text="", _id=doc['_id'], metadata=doc['metadata'])
+    built_index, documents = build_index(titles_only=True)
 
     #add the path to the inverted index
     index_file_path_titles = "inverted_index_titles.jsonl"
+    inv_index = load_or_save_index(index_file_path_titles, built_index)
 
-    if os.path.exists(index_file_path_titles):
-        # Load the existing index
-        inv_index = load_inverted_index_jsonl(index_file_path_titles)
-        print("Loaded existing inverted index.")
-    else:
-        # Create and save a new inverted index
-        inv_index = InvertedIndex()
-        # Add documents to inverted index
-        for document in documents.values():
-            
-            terms = document.get_index_terms() 
-        
-            # print(document._id)
-            inv_index.add_documents(document._id, terms)
-
-        save_inverted_index_jsonl(inv_index, index_file_path_titles)
-        print("Saved new inverted index.")
-        
-    document_vectors = {}
+    rank_documents(inv_index, documents, "bm25_result_for_titles.txt", k1=1.2, b=0.5, delta=1.0, run_tag="run2")
 
-    # Calculate the average document length
-    avg_doc_length = 0
+def rank_documents_with_bm25f(field_weights=None):
+    print("Retrieving and ranking documents (BM25F over the title and text fields)...")
 
-    for _id, document in documents.items():
-        avg_doc_length += len(document.get_index_terms())
+    built_index, _ = build_multi_field_index()
 
-    avg_doc_length = avg_doc_length / len(documents)
+    if field_weights is None:
+        field_weights = {"title": 2.0, "text": 1.0}
 
-    for _id, document in documents.items():
-
-        document_id = _id
+    output_file_name = "bm25f_result.txt"
+    with open(output_file_name, "w") as output_file:
+        for query in queries:
+            query = Query(_id=query['_id'], query=query['text'])
+            top_documents = bm25f_rank_documents_for_query(query, built_index, field_weights, k1=1.2, b=0.75, delta=1.0, top_n=100)
+            write_results(output_file, query, top_documents, "run3")
 
-        # doc_vector = get_document_vector(document_id, inv_index, len(documents))
-        doc_vector = get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=0.25)
+    print(f"Results have been saved to {output_file_name}.")
 
-        document_vectors[document_id] = doc_vector
+# The worker processes of the parallel index builder must not run the ranking again when they import this module
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rank the test queries with BM25+, over the titles and texts and over the titles only.")
+    parser.add_argument("--bm25f", action="store_true", help="Also rank them with BM25F over the title and text fields (saved to bm25f_result.txt)")
+    args = parser.parse_args()
 
-    process_and_save_results(
-        queries=queries, 
-        inv_index=inv_index, 
-        document_vectors=document_vectors, 
-        documents=documents, 
-        avg_doc_length=avg_doc_length,
-        output_file_name="bm25_result_for_titles.txt",
-        k1=1.2,
-        b=0.5,
-        delta=1.0,
-        top_n=100,
-        run_tag="run2" 
-    )
+    rank_documents_with_titles_and_text()
+    rank_documents_with_titles()
+    if args.bm25f:
+        rank_documents_with_bm25f()
 
-rank_documents_with_titles_and_text()
-rank_documents_with_titles()
\ No newline at end of file
+    print(normalization_cache)
+    normalization_cache.save(normalization_cache_path)
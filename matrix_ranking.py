@@ -0,0 +1,143 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from preprocessing import Query
+
+# Matrix backend for BM25+ ranking. The whole corpus is stored as sparse document x term matrices (CSR) over a term-id vocabulary,
+# so ranking a query is a sparse matrix-vector product instead of Python loops over dictionaries of document vectors.
+#
+# The similarity used by retrieve_and_rank is the cosine between the BM25+ query vector of a query for a document (which depends on
+# the document) and the BM25+ document vector. For a query with indicator vector x (1 for every query term), it is
+#     (P @ x) / (sqrt(S @ x) * norm of the document vector)
+# where P holds the products of the query-side and document-side weights and S the squared query-side weights of every posting.
+
+def bm25_plus_weights(total_documents, term_freqs, doc_freqs, doc_lengths, avg_doc_length, k1=1.2, b=0.75, delta=1):
+    '''
+    Vectorized version of retrieve_and_rank.compute_bm25_plus (all arguments but total_documents and avg_doc_length are NumPy arrays).
+    '''
+    idf = np.log((total_documents - doc_freqs + 0.5) / (doc_freqs + 0.5))
+    return ((term_freqs + delta) * idf) / ((k1 * ((1 - b) + (b * doc_lengths / avg_doc_length))) + term_freqs)
+
+class BM25Matrix:
+    '''
+    Document x term matrices of the BM25+ weights of a corpus with precomputed document vector norms.
+
+    The document-side parameters are the ones used for the document vectors (get_bm25_document_vector) and the query-side
+    parameters are the ones used when ranking (get_bm25_query_vector). Both are fixed when the matrices are built.
+    '''
+
+    def __init__(self, documents: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, doc_k1=1.2, doc_b=0.75, doc_delta=0.25):
+        '''
+        Parameters:
+            documents (dict): A dictionary where the document ID is the key and the Document object is the value.
+            avg_doc_length (float): The average document length in index terms.
+            k1, b, delta: BM25+ hyperparameters used for the query vectors.
+            doc_k1, doc_b, doc_delta: BM25+ hyperparameters used for the document vectors.
+        '''
+        self.doc_ids = list(documents.keys())
+        self.k1 = k1
+        self.b = b
+        self.delta = delta
+        self.vocabulary = {} #term -> column of the term in the matrices
+
+        rows = []
+        columns = []
+        term_freqs = []
+        doc_lengths = np.zeros(len(self.doc_ids))
+        for row, document in enumerate(documents.values()):
+            index_terms = document.get_index_terms()
+            doc_lengths[row] = len(index_terms)
+            for term, term_freq in index_terms.items():
+                column = self.vocabulary.setdefault(term, len(self.vocabulary))
+                rows.append(row)
+                columns.append(column)
+                term_freqs.append(term_freq)
+
+        rows = np.array(rows, dtype=np.int64)
+        columns = np.array(columns, dtype=np.int64)
+        term_freqs = np.array(term_freqs, dtype=np.float64)
+        # The document frequency of a term is the number of documents it appears in (the length of its postings list)
+        doc_freqs = np.bincount(columns, minlength=len(self.vocabulary)).astype(np.float64)[columns]
+        doc_lengths = doc_lengths[rows]
+        total_documents = len(self.doc_ids)
+
+        doc_weights = bm25_plus_weights(total_documents, term_freqs, doc_freqs, doc_lengths, avg_doc_length, k1=doc_k1, b=doc_b, delta=doc_delta)
+        query_weights = bm25_plus_weights(total_documents, term_freqs, doc_freqs, doc_lengths, avg_doc_length, k1=k1, b=b, delta=delta)
+
+        shape = (total_documents, len(self.vocabulary))
+        self.doc_norms = np.sqrt(np.bincount(rows, weights=doc_weights**2, minlength=total_documents))
+        self.products = csr_matrix((query_weights * doc_weights, (rows, columns)), shape=shape)
+        self.squared_query_weights = csr_matrix((query_weights**2, (rows, columns)), shape=shape)
+
+    def query_vector(self, query: Query):
+        '''
+        Returns the indicator vector of the query terms that are in the vocabulary.
+        '''
+        x = np.zeros(len(self.vocabulary))
+        for term in query.get_index_terms():
+            column = self.vocabulary.get(term)
+            if column is not None:
+                x[column] = 1
+        return x
+
+    def score(self, query: Query, similarity="cosine"):
+        '''
+        Returns the score of every document for a query.
+
+        Parameters:
+            query (Query): The query.
+            similarity (str): "cosine" for the cosine similarity used by retrieve_and_rank, "dot" for the dot product of the query and document vectors.
+        '''
+        x = self.query_vector(query)
+        dot_products = self.products @ x
+        if similarity == "dot":
+            return dot_products
+
+        query_magnitudes = np.sqrt(self.squared_query_weights @ x)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = dot_products / (query_magnitudes * self.doc_norms)
+        scores[(query_magnitudes == 0) | (self.doc_norms == 0)] = 0
+        return scores
+
+    def rank(self, query: Query, top_n=100, similarity="cosine"):
+        '''
+        Rank the documents for a query.
+
+        Parameters:
+            query (Query): The query.
+            top_n (int): Maximum number of top documents to retrieve.
+            similarity (str): "cosine" or "dot" (see score).
+        Returns:
+            top_documents (list): The top n (doc_id, score) pairs with a score greater than 0, best first.
+        '''
+        scores = self.score(query, similarity)
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > top_n:
+            # Only the top n scores are sorted
+            candidates = candidates[np.argpartition(-scores[candidates], top_n - 1)[:top_n]]
+        ranked = candidates[np.lexsort((candidates, -scores[candidates]))]
+        return [(self.doc_ids[row], float(scores[row])) for row in ranked]
+
+def matrix_rank_documents_for_query(query: Query, matrix: BM25Matrix, top_n=100):
+    '''
+    Rank the documents for a query with the matrices, in the results format of retrieve_and_rank.bm25_rank_documents_for_query.
+    Use make_matrix_rank_function to get a function that can be passed as the rank_function of process_and_save_results.
+    '''
+    top_documents = matrix.rank(query, top_n=top_n)
+    if not top_documents:
+        print(f"No documents returned for query: {query}")
+    return top_documents
+
+def make_matrix_rank_function(matrix: BM25Matrix):
+    '''
+    Returns a ranking function with the signature of retrieve_and_rank.bm25_rank_documents_for_query that ranks with the matrices,
+    so it can be passed as the rank_function of process_and_save_results. The inverted index, document vectors, documents and
+    average document length it is called with are not used (the matrices already hold them), and the BM25+ hyperparameters must
+    be the ones the matrices were built with.
+    '''
+    def rank_function(query: Query, inverted_index, document_vectors, documents: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, top_n=100):
+        if (k1, b, delta) != (matrix.k1, matrix.b, matrix.delta):
+            raise ValueError(f"The matrices were built with k1={matrix.k1}, b={matrix.b}, delta={matrix.delta}, not k1={k1}, b={b}, delta={delta}")
+        return matrix_rank_documents_for_query(query, matrix, top_n=top_n)
+
+    return rank_function
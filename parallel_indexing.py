@@ -0,0 +1,156 @@
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from indexing import InvertedIndex, CompactInvertedIndex, MultiFieldInvertedIndex
+from preprocessing import Document, normalization_cache
+from doc_utils import iter_batches
+
+# Every worker holds the partial indexes of its batches and the parent holds the pending results, so the build is bound by memory
+# more than by the CPUs, and more workers than this rarely make it faster
+DEFAULT_WORKERS = 4
+
+def iter_corpus_lines(corpus_path):
+    '''
+    Yield the byte offset and the text of every non-empty line of a JSONL corpus file, without parsing them.
+    '''
+    with open(corpus_path, 'rb') as file:
+        offset = 0
+        for line in file:
+            if line.strip():
+                yield offset, line
+            offset += len(line)
+
+def read_corpus_lines(corpus_path, offsets):
+    '''
+    Returns the byte offset and the text of the lines of a JSONL corpus file that start at the given offsets (e.g. the documents
+    of one shard), reading only those lines.
+    '''
+    lines = []
+    with open(corpus_path, 'rb') as file:
+        for offset in offsets:
+            file.seek(offset)
+            lines.append((offset, file.readline()))
+    return lines
+
+def index_shard(lines, titles_only=False, index_class=InvertedIndex, keep_documents=False, discard_text=False, inv_index=None):
+    '''
+    Preprocess a shard of the corpus and build its partial inverted index (runs in a worker process).
+
+    Parameters:
+        lines (list): Byte offsets and lines of the corpus JSONL file.
+        titles_only (bool): If True, only the titles of the documents are indexed.
+        index_class (type): InvertedIndex, CompactInvertedIndex or MultiFieldInvertedIndex.
+        keep_documents (bool): If True, the Document objects are also returned.
+        discard_text (bool): If True, the title, text and metadata of the returned Document objects are dropped.
+        inv_index (InvertedIndex): Index to add the documents to (by default, a new one).
+    Returns:
+        inv_index (InvertedIndex), documents (list), offsets (list): The partial inverted index (with its document statistics), the documents (None if keep_documents is False) and the document IDs with their byte offsets.
+    '''
+    if inv_index is None:
+        inv_index = index_class()
+    documents = [] if keep_documents else None
+    offsets = []
+
+    # A multi-field index gets the index terms of every field, from the same preprocessing pass
+    keep_fields = isinstance(inv_index, MultiFieldInvertedIndex)
+
+    for offset, line in lines:
+        doc = json.loads(line)
+        document = Document(title=doc['title'], text="" if titles_only else doc['text'], _id=doc['_id'], metadata=doc['metadata'], keep_fields=keep_fields)
+        if keep_fields:
+            inv_index.add_fields(document.get_id(), document.field_index_terms)
+        else:
+            inv_index.add_documents(document.get_id(), document.get_index_terms())
+        offsets.append((document.get_id(), offset))
+        if keep_documents:
+            if discard_text:
+                document.discard_text()
+            documents.append(document)
+
+    # Building the index is not a change to track for incremental saves (and the partial indexes are sent back without it)
+    inv_index.mark_saved()
+    return inv_index, documents, offsets
+
+def index_shard_in_worker(lines, titles_only=False, index_class=InvertedIndex, keep_documents=False, discard_text=False):
+    '''
+    Same as index_shard, but also returns the tokens normalized for the first time by the worker process while indexing the shard,
+    so they can be added to the normalization cache of the parent process (the cache of a worker is lost when the pool shuts down).
+
+    Returns:
+        inv_index (InvertedIndex), documents (list), offsets (list), new_terms (dict): The results of index_shard and the new tokens of the normalization cache with their index terms.
+    '''
+    normalization_cache.record_new_terms()
+    try:
+        results = index_shard(lines, titles_only, index_class, keep_documents, discard_text)
+    finally:
+        new_terms = normalization_cache.pop_new_terms()
+    return results + (new_terms,)
+
+def build_index_parallel(corpus_path, workers=None, titles_only=False, index_class=InvertedIndex, keep_documents=False, discard_text=False, doc_store=None, batch_size=1000):
+    '''
+    Build the inverted index of a corpus with a process pool. The corpus is read as a stream of batches of lines, each batch is
+    indexed by a worker, and the partial indexes are merged in the order of the batches, so the result is identical to adding the
+    documents one by one to a single index. At most 2 batches per worker are in flight, so the raw text held in memory is bounded
+    by the batch size rather than by the size of the corpus.
+
+    Parameters:
+        corpus_path (str): Path of the corpus JSONL file.
+        workers (int): Number of worker processes (by default, the number of CPUs, at most DEFAULT_WORKERS). With 1 worker, no process pool is used.
+        titles_only (bool): If True, only the titles of the documents are indexed.
+        index_class (type): InvertedIndex, CompactInvertedIndex or MultiFieldInvertedIndex.
+        keep_documents (bool): If True, the Document objects are also returned.
+        discard_text (bool): If True, the title, text and metadata of the returned Document objects are dropped once their index terms are extracted.
+        doc_store (DocStore): If given, the byte offset of every document is added to it, so the documents can be read back later.
+        batch_size (int): Number of lines per batch.
+    Returns:
+        inv_index (InvertedIndex), documents (dict): The inverted index and a dictionary where the document ID is the key and the Document object is the value (None if keep_documents is False).
+
+    The tokens normalized by the workers are added to the shared normalization_cache, so it can be saved after the build.
+    '''
+    workers = workers or min(os.cpu_count() or 1, DEFAULT_WORKERS)
+    batches = iter_batches(iter_corpus_lines(corpus_path), batch_size)
+
+    inv_index = index_class()
+    documents = {} if keep_documents else None
+
+    def add_batch_results(batch_documents, offsets, new_terms=None):
+        # The merged postings are part of the build, not changes since the index was saved
+        inv_index.mark_saved()
+        if new_terms:
+            normalization_cache.update(new_terms)
+        if keep_documents:
+            for document in batch_documents:
+                documents[document.get_id()] = document
+        if doc_store is not None:
+            for doc_id, offset in offsets:
+                doc_store.add(doc_id, offset)
+
+    if workers == 1:
+        # Stream the batches straight into the index
+        for batch in batches:
+            _, batch_documents, offsets = index_shard(batch, titles_only, index_class, keep_documents, discard_text, inv_index=inv_index)
+            add_batch_results(batch_documents, offsets)
+        if isinstance(inv_index, CompactInvertedIndex):
+            inv_index.pack()
+        return inv_index, documents
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(index_shard_in_worker, batch, titles_only, index_class, keep_documents, discard_text))
+            # Merge the oldest batch before reading more of the corpus; results are merged in the order of the batches whatever order the workers finish in
+            while len(pending) >= 2 * workers:
+                shard_index, batch_documents, offsets, new_terms = pending.popleft().result()
+                inv_index.merge(shard_index)
+                add_batch_results(batch_documents, offsets, new_terms)
+
+        while pending:
+            shard_index, batch_documents, offsets, new_terms = pending.popleft().result()
+            inv_index.merge(shard_index)
+            add_batch_results(batch_documents, offsets, new_terms)
+
+    if isinstance(inv_index, CompactInvertedIndex):
+        inv_index.pack()
+    return inv_index, documents
@@ -0,0 +1,230 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from math import sqrt
+
+import numpy as np
+
+from preprocessing import Query
+from doc_utils import load_jsonl
+from parallel_indexing import build_index_parallel
+from retrieve_and_rank import get_bm25_document_vector
+from evaluation import Evaluator, QRELS_FILE, print_measures
+
+# BM25+ parameter sweep. Only the query weights of the BM25+ similarity depend on k1, b and delta (the document vectors are computed
+# once with fixed parameters), so everything else is gathered once: for every pair of a query term and a document that contains it
+# (walked in the same order as bm25_taat_rank_documents_for_query), the term frequency, IDF, document length and document weight, and
+# for every (query, document) pair its document norm and relevance. A point of the grid is then scored with a few numpy operations
+# over these arrays, ranked with one lexsort for all the queries and evaluated in memory, and the points are spread over processes.
+
+class ParameterSweep:
+    '''
+    Scores and evaluates the queries for any (k1, b, delta) with the same rankings as bm25_taat_rank_documents_for_query.
+    '''
+
+    def __init__(self, queries, inverted_index, documents: dict, document_vectors, avg_doc_length, evaluator: Evaluator, top_n=100):
+        '''
+        Parameters:
+            queries (list): The Query objects.
+            inverted_index (InvertedIndex): The index of the documents.
+            documents (dict): A dictionary where the document ID is the key and the Document object is the value.
+            document_vectors (dict): The BM25+ document vectors.
+            avg_doc_length (float): The average document length in index terms.
+            evaluator (Evaluator): Evaluates the rankings of every point.
+            top_n (int): Number of documents ranked for every query.
+        '''
+        self.query_ids = [query.get_id() for query in queries]
+        self.avg_doc_length = avg_doc_length
+        self.evaluator = evaluator
+        self.top_n = top_n
+        total_documents = len(documents)
+
+        term_freqs, idfs, doc_lengths, doc_weights, pair_groups = [], [], [], [], []
+        group_queries, group_docs, group_positions, group_norms, group_gains = [], [], [], [], []
+        doc_norms = {}
+        positions = {doc_id: position for position, doc_id in enumerate(documents)}
+
+        for query_number, query in enumerate(queries):
+            judgements = evaluator.qrels.get(query.get_id(), {})
+            groups = {} #doc_id -> (query, document) pair
+            for term in query.get_index_terms().keys():
+                postings = inverted_index.get_postings(term)
+                idf = inverted_index.get_idf(term, total_documents)
+
+                for doc_id in postings:
+                    document = documents.get(doc_id)
+                    if document is None:
+                        continue
+                    term_freq = document.get_index_terms().get(term, 0)
+                    if term_freq <= 0:
+                        continue
+
+                    group = groups.get(doc_id)
+                    if group is None:
+                        group = groups[doc_id] = len(group_queries)
+                        group_queries.append(query_number)
+                        group_docs.append(doc_id)
+                        group_positions.append(positions[doc_id])
+                        norm = doc_norms.get(doc_id)
+                        if norm is None:
+                            norm = doc_norms[doc_id] = sqrt(sum(value**2 for value in document_vectors[doc_id].values()))
+                        group_norms.append(norm)
+                        group_gains.append(max(judgements.get(doc_id, 0), 0))
+
+                    term_freqs.append(term_freq)
+                    idfs.append(idf)
+                    doc_lengths.append(len(document))
+                    doc_weights.append(document_vectors[doc_id].get(term, 0))
+                    pair_groups.append(group)
+
+        self.term_freqs = np.array(term_freqs, dtype=np.float64)
+        self.idfs = np.array(idfs, dtype=np.float64)
+        self.doc_lengths = np.array(doc_lengths, dtype=np.float64)
+        self.doc_weights = np.array(doc_weights, dtype=np.float64)
+        self.pair_groups = np.array(pair_groups, dtype=np.int64)
+        self.group_queries = np.array(group_queries, dtype=np.int64)
+        self.group_docs = group_docs
+        self.group_positions = np.array(group_positions, dtype=np.int64)
+        self.group_norms = np.array(group_norms, dtype=np.float64)
+        self.group_gains = np.array(group_gains, dtype=np.float64)
+        self.judged = np.array([query_id in evaluator.query_numbers for query_id in self.query_ids])
+
+    def score(self, k1=1.2, b=0.75, delta=1):
+        '''
+        Returns the BM25+ similarity of every (query, document) pair (NaN for the pairs the term-at-a-time scorer does not return).
+        '''
+        # Same operations, in the same order, as compute_bm25_plus and bm25_taat_rank_documents_for_query, so the scores are identical
+        weights = ((self.term_freqs + delta) * self.idfs) / ((k1 * ((1 - b) + (b * self.doc_lengths / self.avg_doc_length))) + self.term_freqs)
+        dot_products = np.bincount(self.pair_groups, weights=weights * self.doc_weights, minlength=len(self.group_queries))
+        query_magnitudes = np.sqrt(np.bincount(self.pair_groups, weights=weights**2, minlength=len(self.group_queries)))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarities = dot_products / (query_magnitudes * self.group_norms)
+        similarities[(query_magnitudes == 0) | (self.group_norms == 0) | ~(similarities > 0)] = np.nan
+        return similarities
+
+    def rank(self, similarities):
+        '''
+        Returns the (query, document) pairs of the top n documents of every query, sorted by query and rank, and their ranks.
+        '''
+        kept = np.flatnonzero(~np.isnan(similarities))
+        # Sorted by query, then by decreasing similarity, then in the order of the corpus (like the scorer sorts tied documents)
+        order = kept[np.lexsort((self.group_positions[kept], -similarities[kept], self.group_queries[kept]))]
+        queries = self.group_queries[order]
+        counts = np.bincount(queries, minlength=len(self.query_ids))
+        starts = np.cumsum(counts) - counts
+        ranks = np.arange(len(order)) - starts[queries]
+        top = ranks < self.top_n
+        return order[top], ranks[top], counts
+
+    def rankings(self, k1=1.2, b=0.75, delta=1):
+        '''
+        Returns the top n (doc_id, score) pairs of every query for a point (a dictionary where the query ID is the key).
+        '''
+        similarities = self.score(k1, b, delta)
+        groups, _, _ = self.rank(similarities)
+        rankings = {query_id: [] for query_id in self.query_ids}
+        for group in groups.tolist():
+            rankings[self.query_ids[self.group_queries[group]]].append((self.group_docs[group], float(similarities[group])))
+        return rankings
+
+    def evaluate(self, k1=1.2, b=0.75, delta=1):
+        '''
+        Returns the evaluation measures of a point.
+        '''
+        groups, ranks, counts = self.rank(self.score(k1, b, delta))
+        depth = max(self.top_n, self.evaluator.ndcg_cutoff, self.evaluator.precision_cutoff, self.evaluator.recall_cutoff)
+        gains = np.zeros((len(self.query_ids), depth))
+        gains[self.group_queries[groups], ranks] = self.group_gains[groups]
+
+        # Like trec_eval, only the queries with relevance judgements and at least one ranked document are evaluated
+        evaluated = np.flatnonzero(self.judged & (counts > 0))
+        return self.evaluator.compute_measures([self.query_ids[number] for number in evaluated], gains[evaluated])
+
+# Sweep of the worker processes, set once per process instead of being sent with every point
+worker_sweep = None
+
+def init_sweep_worker(sweep):
+    global worker_sweep
+    worker_sweep = sweep
+
+def evaluate_points(points):
+    '''Evaluate (k1, b, delta) points with the sweep of the worker process.'''
+    return [worker_sweep.evaluate(k1, b, delta) for k1, b, delta in points]
+
+def make_grid(k1_values, b_values, delta_values):
+    '''Returns every (k1, b, delta) combination of the given values.'''
+    return list(itertools.product(k1_values, b_values, delta_values))
+
+def run_sweep(sweep: ParameterSweep, grid, workers=None, chunk_size=None):
+    '''
+    Evaluate every point of a grid, in parallel across processes.
+
+    Parameters:
+        sweep (ParameterSweep): The precomputed sweep.
+        grid (list): The (k1, b, delta) points.
+        workers (int): Number of worker processes (by default, the number of CPUs). With 1 worker, no process pool is used.
+        chunk_size (int): Number of points evaluated per task (by default, the points are split evenly across the workers).
+    Returns:
+        results (list): For every point, in the order of the grid, a dictionary with k1, b, delta and the measures.
+    '''
+    workers = min(workers or os.cpu_count() or 1, max(len(grid), 1))
+    if workers == 1:
+        measures = [sweep.evaluate(k1, b, delta) for k1, b, delta in grid]
+    else:
+        chunk_size = chunk_size or -(-len(grid) // (4 * workers))
+        chunks = [grid[start:start + chunk_size] for start in range(0, len(grid), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_worker, initargs=(sweep,)) as executor:
+            measures = [point_measures for chunk_measures in executor.map(evaluate_points, chunks) for point_measures in chunk_measures]
+
+    return [dict(k1=k1, b=b, delta=delta, **point_measures) for (k1, b, delta), point_measures in zip(grid, measures)]
+
+def print_sweep_results(results, metric="map", top=10):
+    '''Print the best points of a sweep, sorted by a measure.'''
+    names = [name for name in results[0] if name not in ("k1", "b", "delta", "num_q")]
+    print(f"{'k1':>6} {'b':>6} {'delta':>6} " + " ".join(f"{name:>12}" for name in names))
+    for result in sorted(results, key=lambda result: result[metric], reverse=True)[:top]:
+        print(f"{result['k1']:>6.2f} {result['b']:>6.2f} {result['delta']:>6.2f} " + " ".join(f"{result[name]:>12.4f}" for name in names))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a grid of BM25+ parameters (k1, b, delta) with one index.")
+    parser.add_argument("--corpus", default="scifact/corpus.jsonl")
+    parser.add_argument("--queries", default="queries_for_test.jsonl")
+    parser.add_argument("--qrels", default=QRELS_FILE)
+    parser.add_argument("--titles-only", action="store_true", help="Only index the titles of the documents")
+    parser.add_argument("--k1", type=float, nargs="+", default=[0.6, 0.9, 1.2, 1.5, 1.8, 2.1])
+    parser.add_argument("--b", type=float, nargs="+", default=[0.25, 0.5, 0.75, 1.0])
+    parser.add_argument("--delta", type=float, nargs="+", default=[0.0, 0.5, 1.0])
+    parser.add_argument("--top-n", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--metric", default="map", help="Measure used to sort the points")
+    parser.add_argument("--output", default=None, help="Save the measures of every point to a JSONL file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    inv_index, documents = build_index_parallel(args.corpus, titles_only=args.titles_only, keep_documents=True, discard_text=True)
+    avg_doc_length = sum(len(document.get_index_terms()) for document in documents.values()) / len(documents)
+    # Same document vectors as main.py
+    document_vectors = {_id: get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=0.25) for _id, document in documents.items()}
+    queries = [Query(_id=query['_id'], query=query['text']) for query in load_jsonl(args.queries)]
+    sweep = ParameterSweep(queries, inv_index, documents, document_vectors, avg_doc_length, Evaluator.from_file(args.qrels), top_n=args.top_n)
+    print(f"Indexed the corpus and gathered {len(sweep.term_freqs)} term-document pairs in {time.perf_counter() - start:.1f}s")
+
+    grid = make_grid(args.k1, args.b, args.delta)
+    start = time.perf_counter()
+    results = run_sweep(sweep, grid, workers=args.workers)
+    print(f"Evaluated {len(grid)} points in {time.perf_counter() - start:.1f}s")
+
+    print_sweep_results(results, metric=args.metric)
+    best = max(results, key=lambda result: result[args.metric])
+    print(f"\nBest point: k1={best['k1']}, b={best['b']}, delta={best['delta']}")
+    print_measures({name: value for name, value in best.items() if name not in ("k1", "b", "delta")})
+
+    if args.output:
+        with open(args.output, "w") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
@@ -0,0 +1,366 @@
+import json
+import mmap
+import re
+from collections import OrderedDict
+
+from doc_utils import iter_jsonl
+from postings_codec import vbyte_encode, vbyte_decode
+from preprocessing import Query, extract_index_term_positions
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+
+# Positional postings. The inverted index only keeps how many times a term appears in a document; the positional index also keeps
+# where, so phrase queries ("insulin resistance") and the proximity of the query terms can be scored.
+#
+# The positional postings of a term are a single byte string: for every document that contains the term, the gap from the previous
+# internal document number, the number of positions and the gaps between the sorted positions, all variable-byte encoded (the same
+# encoding as postings_codec.py). An index saved under base_path is made of 2 files:
+#   base_path.pos:    the positional postings of every term, one after the other
+#   base_path.poslex: the lexicon (JSON), i.e. the document IDs in the order of their internal numbers and the offset and length
+#                     of the positional postings of every term
+# LazyPositionalIndex memory-maps the .pos file and only decodes the positional postings of a term the first time it is used, so
+# loading the positional index is cheap and queries that don't need positions never read them. The decoded positional postings are
+# kept in a least recently used cache bounded by their total number of documents.
+
+POSITIONS_EXTENSION = ".pos"
+LEXICON_EXTENSION = ".poslex"
+
+phrase_pattern = re.compile(r'"([^"]+)"')
+
+def encode_positions(doc_number, previous_doc_number, positions, output: bytearray):
+    '''
+    Append the positions of a term in a document to its encoded positional postings.
+
+    Parameters:
+        doc_number (int): Internal number of the document.
+        previous_doc_number (int): Internal number of the previous document of the positional postings (-1 if it is the first one).
+        positions (list): Sorted positions of the term in the document.
+        output (bytearray): The encoded positional postings of the term.
+    '''
+    gaps = [doc_number - previous_doc_number - 1, len(positions), positions[0]]
+    gaps.extend(positions[i] - positions[i - 1] for i in range(1, len(positions)))
+    vbyte_encode(gaps, output)
+
+def decode_positions(data, offset: int, end: int, doc_ids):
+    '''
+    Decode the positional postings of a term.
+
+    Parameters:
+        data (bytes): The encoded positional postings.
+        offset (int): Where they start.
+        end (int): Where they end.
+        doc_ids (list): Document IDs in the order of their internal numbers.
+    Returns:
+        doc_positions (dict): A dictionary where the document ID is the key and the sorted list of positions is the value.
+    '''
+    doc_positions = {}
+    doc_number = -1
+    while offset < end:
+        (gap, count), offset = vbyte_decode(data, offset, 2)
+        doc_number += gap + 1
+        positions, offset = vbyte_decode(data, offset, count)
+        for i in range(1, count):
+            positions[i] += positions[i - 1]
+        doc_positions[doc_ids[doc_number]] = positions
+    return doc_positions
+
+
+class DecodedPositions:
+    '''
+    Least recently used cache of decoded positional postings. The memory used is bounded by the total number of documents of the
+    cached positional postings: once it exceeds max_postings, the least recently used terms are evicted.
+    '''
+
+    def __init__(self, max_postings=1000000):
+        self.max_postings = max_postings
+        self.entries = OrderedDict() #term -> decoded positional postings
+        self.cached_postings = 0
+
+    def get(self, term: str):
+        doc_positions = self.entries.get(term)
+        if doc_positions is not None:
+            self.entries.move_to_end(term)
+        return doc_positions
+
+    def put(self, term: str, doc_positions: dict):
+        if len(doc_positions) > self.max_postings:
+            return
+        self.pop(term)
+        self.entries[term] = doc_positions
+        self.cached_postings += len(doc_positions)
+        while self.cached_postings > self.max_postings:
+            _, evicted = self.entries.popitem(last=False)
+            self.cached_postings -= len(evicted)
+
+    def pop(self, term: str):
+        doc_positions = self.entries.pop(term, None)
+        if doc_positions is not None:
+            self.cached_postings -= len(doc_positions)
+
+    def clear(self):
+        self.entries.clear()
+        self.cached_postings = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class PositionalIndex:
+    '''
+    In-memory positional index, built one document at a time. Documents must be added in the order of their internal numbers
+    (the order they are added in), which keeps the document gaps of the encoding positive.
+    '''
+
+    def __init__(self, max_decoded_postings=1000000):
+        '''
+        Parameters:
+            max_decoded_postings (int): Maximum total number of documents of the decoded positional postings kept in memory.
+        '''
+        self.doc_ids = []
+        self.postings = {} #term -> [encoded positional postings, internal number of the last document]
+        self.decoded = DecodedPositions(max_decoded_postings) #term -> decoded positional postings
+
+    def add_document(self, doc_id, term_positions: dict):
+        '''
+        Parameters:
+            doc_id (str): ID of the document.
+            term_positions (dict): The sorted positions of every index term of the document (see extract_index_term_positions).
+        '''
+        doc_number = len(self.doc_ids)
+        self.doc_ids.append(doc_id)
+        for term, positions in term_positions.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = [bytearray(), -1]
+            encode_positions(doc_number, entry[1], positions, entry[0])
+            entry[1] = doc_number
+            self.decoded.pop(term)
+
+    def get_doc_positions(self, term: str):
+        '''Get the positions of a term in every document that contains it (empty if the term is not in the index).'''
+        doc_positions = self.decoded.get(term)
+        if doc_positions is None:
+            entry = self.postings.get(term)
+            if entry is None:
+                return {}
+            doc_positions = decode_positions(entry[0], 0, len(entry[0]), self.doc_ids)
+            self.decoded.put(term, doc_positions)
+        return doc_positions
+
+    def get_positions(self, term: str, doc_id):
+        '''Get the sorted positions of a term in a document (empty if the term is not in the document).'''
+        return self.get_doc_positions(term).get(doc_id, [])
+
+    def save(self, base_path):
+        '''Save the positional index to base_path.pos and base_path.poslex.'''
+        terms = {}
+        offset = 0
+        with open(base_path + POSITIONS_EXTENSION, 'wb') as file:
+            for term in sorted(self.postings):
+                data = self.postings[term][0]
+                file.write(data)
+                terms[term] = [offset, len(data)]
+                offset += len(data)
+
+        with open(base_path + LEXICON_EXTENSION, 'w') as file:
+            json.dump({"doc_ids": self.doc_ids, "terms": terms}, file)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __repr__(self):
+        return f"PositionalIndex(documents={len(self.doc_ids)}, terms={len(self.postings)})"
+
+
+class LazyPositionalIndex:
+    '''
+    Positional index saved with PositionalIndex.save. The positions file is memory-mapped and the positional postings of a term
+    are decoded when the term is used, and kept until they are evicted from the cache of decoded positional postings.
+    '''
+
+    def __init__(self, base_path, max_decoded_postings=1000000):
+        '''
+        Parameters:
+            base_path (str): The path the positional index was saved to.
+            max_decoded_postings (int): Maximum total number of documents of the decoded positional postings kept in memory.
+        '''
+        with open(base_path + LEXICON_EXTENSION, 'r') as file:
+            lexicon = json.load(file)
+        self.doc_ids = lexicon["doc_ids"]
+        self.terms = lexicon["terms"]
+        self.decoded = DecodedPositions(max_decoded_postings) #term -> decoded positional postings
+
+        with open(base_path + POSITIONS_EXTENSION, 'rb') as file:
+            # mmap can't map an empty file
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if self.terms else b""
+
+    def get_doc_positions(self, term: str):
+        '''Get the positions of a term in every document that contains it (empty if the term is not in the index).'''
+        doc_positions = self.decoded.get(term)
+        if doc_positions is None:
+            location = self.terms.get(term)
+            if location is None:
+                return {}
+            offset, length = location
+            doc_positions = decode_positions(self.map, offset, offset + length, self.doc_ids)
+            self.decoded.put(term, doc_positions)
+        return doc_positions
+
+    def get_positions(self, term: str, doc_id):
+        '''Get the sorted positions of a term in a document (empty if the term is not in the document).'''
+        return self.get_doc_positions(term).get(doc_id, [])
+
+    def close(self):
+        self.decoded.clear()
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __repr__(self):
+        return f"LazyPositionalIndex(documents={len(self.doc_ids)}, terms={len(self.terms)}, decoded={len(self.decoded)})"
+
+
+def build_positional_index(corpus_path, titles_only=False):
+    '''
+    Build the positional index of a JSONL corpus, with the same index terms as the inverted index built from it.
+
+    Parameters:
+        corpus_path (str): Path to the corpus.
+        titles_only (bool): Only index the titles of the documents.
+    Returns:
+        positional_index (PositionalIndex): The positional index of the corpus.
+    '''
+    positional_index = PositionalIndex()
+    for record in iter_jsonl(corpus_path):
+        text = record["title"] if titles_only else record["title"] + " " + record["text"]
+        positional_index.add_document(record["_id"], extract_index_term_positions(text))
+    return positional_index
+
+def intersect_sorted(first, second):
+    '''Returns the values found in both sorted lists, merging them in a single pass.'''
+    common = []
+    i = j = 0
+    while i < len(first) and j < len(second):
+        if first[i] < second[j]:
+            i += 1
+        elif first[i] > second[j]:
+            j += 1
+        else:
+            common.append(first[i])
+            i += 1
+            j += 1
+    return common
+
+def get_phrase_terms(text):
+    '''
+    Returns the index terms of a phrase with their offsets from the start of the phrase (the stopwords of the phrase are not
+    index terms but still take a position).
+    '''
+    phrase_terms = []
+    for term, positions in extract_index_term_positions(text).items():
+        phrase_terms.extend((position, term) for position in positions)
+    phrase_terms.sort()
+    return [(term, position) for position, term in phrase_terms]
+
+def find_phrase(phrase_terms, positional_index):
+    '''
+    Find the documents that contain a phrase.
+
+    Parameters:
+        phrase_terms (list): The index terms of the phrase and their offsets (see get_phrase_terms).
+        positional_index (PositionalIndex): The positional index.
+    Returns:
+        phrase_freqs (dict): A dictionary where the document ID is the key and the number of times it contains the phrase is the value.
+    '''
+    if not phrase_terms:
+        return {}
+
+    term_positions = [(positional_index.get_doc_positions(term), offset) for term, offset in phrase_terms]
+    # Candidates are the documents that contain every term of the phrase, starting from the rarest one
+    term_positions.sort(key=lambda item: len(item[0]))
+    rarest = term_positions[0][0]
+    candidates = [doc_id for doc_id in rarest if all(doc_id in doc_positions for doc_positions, _ in term_positions[1:])]
+
+    phrase_freqs = {}
+    for doc_id in candidates:
+        # Positions where the phrase would start according to each term, intersected term after term
+        doc_positions, offset = term_positions[0]
+        starts = [position - offset for position in doc_positions[doc_id]]
+        for doc_positions, offset in term_positions[1:]:
+            starts = intersect_sorted(starts, [position - offset for position in doc_positions[doc_id]])
+            if not starts:
+                break
+        if starts:
+            phrase_freqs[doc_id] = len(starts)
+    return phrase_freqs
+
+def compute_proximity(first, second, window=5):
+    '''
+    Proximity of two terms in a document: the sum of 1/d^2 over every pair of neighbouring occurrences of the two terms that are
+    at most window positions apart, found by merging their sorted positions.
+    '''
+    proximity = 0.0
+    i = j = 0
+    previous_position, previous_term = None, None
+    while i < len(first) or j < len(second):
+        if j >= len(second) or (i < len(first) and first[i] < second[j]):
+            position, term = first[i], 0
+            i += 1
+        else:
+            position, term = second[j], 1
+            j += 1
+        if previous_term is not None and term != previous_term and 0 < position - previous_position <= window:
+            proximity += 1 / (position - previous_position)**2
+        previous_position, previous_term = position, term
+    return proximity
+
+def positional_rank_documents_for_query(query: Query, inverted_index, document_vectors, documents: dict, avg_doc_length, positional_index, k1=1.2, b=0.75, delta=1, top_n=100, phrase=False, proximity_weight=0, window=5):
+    """
+    Rank the documents for a query with BM25+ (bm25_taat_rank_documents_for_query), keep only the documents that contain the
+    phrases of the query and add a proximity boost to the score of the documents where the query terms appear close together.
+
+    The phrases of a query are the parts of its text between double quotes; if phrase is True, the whole query is a phrase.
+    The boost of a document is proximity_weight * p / (1 + p), where p is the sum of compute_proximity over every pair of query
+    terms, so it is below proximity_weight (the BM25+ similarity is at most 1).
+
+    Parameters:
+        - positional_index: PositionalIndex or LazyPositionalIndex with the same documents as the inverted index.
+        - phrase: Whether the whole query is a phrase (default is False)
+        - proximity_weight: Maximum proximity boost, e.g. 0.1 (default is 0: no boost, so the positions are only read for the phrases)
+        - window: Maximum distance between two terms for the proximity boost (default is 5)
+        The other parameters are the ones of bm25_taat_rank_documents_for_query.
+
+    Returns:
+        - top_documents: List of tuples with document ID and score
+    """
+    text = query.get_query()
+    phrases = [text] if phrase else phrase_pattern.findall(text)
+
+    # Positions are only read if the query has phrases or the proximity boost is enabled
+    if not phrases and proximity_weight <= 0:
+        return bm25_taat_rank_documents_for_query(query, inverted_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
+
+    similarities = dict(bm25_taat_rank_documents_for_query(query, inverted_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=None))
+
+    for phrase_text in phrases:
+        phrase_freqs = find_phrase(get_phrase_terms(phrase_text), positional_index)
+        similarities = {doc_id: similarity for doc_id, similarity in similarities.items() if doc_id in phrase_freqs}
+
+    query_terms = list(query.get_index_terms())
+    if proximity_weight > 0 and len(query_terms) > 1:
+        term_positions = [positional_index.get_doc_positions(term) for term in query_terms]
+        for doc_id in similarities:
+            proximity = 0.0
+            for i in range(len(query_terms)):
+                first = term_positions[i].get(doc_id)
+                if not first:
+                    continue
+                for j in range(i + 1, len(query_terms)):
+                    second = term_positions[j].get(doc_id)
+                    if second:
+                        proximity += compute_proximity(first, second, window)
+            similarities[doc_id] += proximity_weight * proximity / (1 + proximity)
+
+    sorted_documents = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
+    return sorted_documents[:top_n]
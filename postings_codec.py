@@ -0,0 +1,236 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+# Compressed postings lists. The sorted internal document numbers of a postings list are split into blocks of BLOCK_SIZE postings.
+# In every block the document numbers are delta-encoded (each one is stored as the gap from the previous one) and the gaps and
+# term frequencies are written with variable-byte encoding (7 bits per byte, the high bit is set on every byte but the last).
+# A skip table holds the last document number and the byte offset of every block, so a document can be found by decoding a single block.
+
+BLOCK_SIZE = 128
+
+def vbyte_encode(numbers, output: bytearray):
+    '''
+    Append the variable-byte encoding of non-negative integers to a bytearray.
+
+    Parameters:
+        numbers (iterable): Integers to encode.
+        output (bytearray): Where the encoded bytes are appended.
+    '''
+    for number in numbers:
+        while number >= 0x80:
+            output.append((number & 0x7F) | 0x80)
+            number >>= 7
+        output.append(number)
+
+def vbyte_decode(data, offset: int, count: int):
+    '''
+    Decode count variable-byte encoded integers.
+
+    Parameters:
+        data (bytes): The encoded bytes.
+        offset (int): Where to start decoding.
+        count (int): Number of integers to decode.
+    Returns:
+        numbers (list), offset (int): The decoded integers and the offset right after them.
+    '''
+    numbers = []
+    append = numbers.append
+    number = 0
+    shift = 0
+    while count:
+        byte = data[offset]
+        offset += 1
+        if byte & 0x80:
+            number |= (byte & 0x7F) << shift
+            shift += 7
+        else:
+            append(number | (byte << shift))
+            number = 0
+            shift = 0
+            count -= 1
+    return numbers, offset
+
+def encode_postings(doc_numbers, frequencies, block_size=BLOCK_SIZE):
+    '''
+    Compress a postings list.
+
+    Parameters:
+        doc_numbers (sequence): Sorted internal document numbers.
+        frequencies (sequence): Term frequencies, in the same order as doc_numbers.
+        block_size (int): Number of postings per block.
+    Returns:
+        skip_docs (array), skip_offsets (array), data (bytes): The last document number and the byte offset of every block, and the encoded blocks.
+    '''
+    skip_docs = array("I")
+    skip_offsets = array("I")
+    data = bytearray()
+
+    previous = 0
+    for start in range(0, len(doc_numbers), block_size):
+        block_docs = doc_numbers[start:start + block_size]
+        skip_offsets.append(len(data))
+        skip_docs.append(block_docs[-1])
+
+        gaps = []
+        for doc_number in block_docs:
+            gaps.append(doc_number - previous)
+            previous = doc_number
+        vbyte_encode(gaps, data)
+        vbyte_encode(frequencies[start:start + block_size], data)
+
+    return skip_docs, skip_offsets, bytes(data)
+
+
+class CompressedPostings(Mapping):
+    '''
+    Postings list of one term stored compressed (see encode_postings). Blocks are only decoded when they are needed and the last
+    decoded block is kept. Behaves like the dictionary of document IDs and term frequencies returned by InvertedIndex.get_postings.
+
+    The index must provide find_doc_number(doc_id) and get_doc_id(doc_number) to translate between document IDs and internal numbers.
+    '''
+
+    __slots__ = ("length", "block_size", "skip_docs", "skip_offsets", "data", "index", "cached_block", "cached_docs", "cached_freqs")
+
+    def __init__(self, index, length, skip_docs, skip_offsets, data, block_size=BLOCK_SIZE):
+        self.index = index
+        self.length = length
+        self.block_size = block_size
+        self.skip_docs = skip_docs
+        self.skip_offsets = skip_offsets
+        self.data = data
+        self.cached_block = -1
+        self.cached_docs = None
+        self.cached_freqs = None
+
+    @classmethod
+    def from_postings(cls, index, doc_numbers, frequencies, block_size=BLOCK_SIZE):
+        skip_docs, skip_offsets, data = encode_postings(doc_numbers, frequencies, block_size)
+        return cls(index, len(doc_numbers), skip_docs, skip_offsets, data, block_size)
+
+    def to_bytes(self):
+        '''
+        Serialize the postings list as its skip table followed by its encoded blocks (the length and block size are stored by the caller).
+        '''
+        return self.skip_docs.tobytes() + self.skip_offsets.tobytes() + self.data
+
+    @classmethod
+    def from_bytes(cls, index, length, buffer, block_size=BLOCK_SIZE):
+        '''
+        Read a postings list serialized with to_bytes. Only the skip table is decoded.
+        '''
+        block_count = -(-length // block_size)
+        skip_docs = array("I", buffer[:4 * block_count])
+        skip_offsets = array("I", buffer[4 * block_count:8 * block_count])
+        return cls(index, length, skip_docs, skip_offsets, bytes(buffer[8 * block_count:]), block_size)
+
+    def read_block(self, block: int):
+        '''Decode the document numbers and term frequencies of a block.'''
+        count = min(self.block_size, self.length - block * self.block_size)
+        gaps, offset = vbyte_decode(self.data, self.skip_offsets[block], count)
+        freqs, _ = vbyte_decode(self.data, offset, count)
+
+        doc_number = self.skip_docs[block - 1] if block > 0 else 0
+        docs = []
+        for gap in gaps:
+            doc_number += gap
+            docs.append(doc_number)
+        return docs, freqs
+
+    def decode_block(self, block: int):
+        '''Returns the document numbers and term frequencies of a block, keeping the last decoded block.'''
+        if block != self.cached_block:
+            self.cached_docs, self.cached_freqs = self.read_block(block)
+            self.cached_block = block
+        return self.cached_docs, self.cached_freqs
+
+    def seek(self, doc_number: int):
+        '''
+        Find the first posting with a document number greater than or equal to doc_number, only decoding the block it is in.
+
+        Returns:
+            (doc_number, freq): The posting found, or None if every document number of the postings list is smaller.
+        '''
+        block = bisect_left(self.skip_docs, doc_number)
+        if block >= len(self.skip_docs):
+            return None
+        docs, freqs = self.decode_block(block)
+        position = bisect_left(docs, doc_number)
+        return docs[position], freqs[position]
+
+    def get_frequency(self, doc_number: int):
+        '''Returns the term frequency of an internal document number, or 0 if it is not in the postings list.'''
+        posting = self.seek(doc_number)
+        if posting is None or posting[0] != doc_number:
+            return 0
+        return posting[1]
+
+    def blocks(self):
+        '''Yield the document numbers and term frequencies of every block in order.'''
+        for block in range(len(self.skip_docs)):
+            yield self.read_block(block)
+
+    def doc_numbers(self):
+        '''Returns the sorted internal document numbers of the postings list.'''
+        return array("I", (doc_number for docs, _ in self.blocks() for doc_number in docs))
+
+    def frequencies(self):
+        '''Returns the term frequencies of the postings list, in the same order as doc_numbers.'''
+        return array("I", (freq for _, freqs in self.blocks() for freq in freqs))
+
+    def __getitem__(self, doc_id):
+        doc_number = self.index.find_doc_number(doc_id)
+        freq = 0 if doc_number is None else self.get_frequency(doc_number)
+        if not freq:
+            raise KeyError(doc_id)
+        return freq
+
+    def __contains__(self, doc_id):
+        doc_number = self.index.find_doc_number(doc_id)
+        return doc_number is not None and self.get_frequency(doc_number) > 0
+
+    def __iter__(self):
+        get_doc_id = self.index.get_doc_id
+        return (get_doc_id(doc_number) for docs, _ in self.blocks() for doc_number in docs)
+
+    def __len__(self):
+        return self.length
+
+    def items(self):
+        get_doc_id = self.index.get_doc_id
+        return [(get_doc_id(doc_number), freq) for docs, freqs in self.blocks() for doc_number, freq in zip(docs, freqs)]
+
+    def __getstate__(self):
+        return (self.index, self.length, self.skip_docs, self.skip_offsets, self.data, self.block_size)
+
+    def __setstate__(self, state):
+        self.index, self.length, self.skip_docs, self.skip_offsets, self.data, self.block_size = state
+        self.cached_block = -1
+        self.cached_docs = None
+        self.cached_freqs = None
+
+def intersect_postings(postings_lists):
+    '''
+    Returns the sorted internal document numbers that appear in every compressed postings list. The shortest list drives the
+    intersection and the others are advanced with seek, so only the blocks that may contain a common document are decoded.
+
+    Parameters:
+        postings_lists (list): CompressedPostings objects.
+    '''
+    if not postings_lists:
+        return []
+
+    postings_lists = sorted(postings_lists, key=len)
+    common = []
+    for docs, _ in postings_lists[0].blocks():
+        for doc_number in docs:
+            for postings in postings_lists[1:]:
+                posting = postings.seek(doc_number)
+                if posting is None:
+                    # No document after this one is in every list
+                    return common
+                if posting[0] != doc_number:
+                    break
+            else:
+                common.append(doc_number)
+    return common
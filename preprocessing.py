@@ -1,17 +1,23 @@
-import pandas as pd
-import nltk
+import argparse
 import string
 import re
-from collections import Counter
-from spellchecker import SpellChecker
-from nltk.corpus import stopwords, wordnet
-from nltk.tokenize import RegexpTokenizer
-from nltk.stem import WordNetLemmatizer
-
-nltk.download('stopwords')
-nltk.download('wordnet')
-
-stop_words = set(stopwords.words('english'))
+import os
+import json
+from collections import Counter, OrderedDict
+
+# NLTK, its corpora and the spellchecker dictionary take seconds to load, so they are only loaded the first time a token is normalized
+# (see get_stop_words, get_spell_checker and get_lemmatizer), and never downloaded at run time: run "python preprocessing.py --download"
+# once to download the NLTK data. "python preprocessing.py --build-resources --corpus scifact/corpus.jsonl" saves the stopwords, the
+# words of the spellchecker dictionary and the root word of every word of the dictionary and of the corpus to resources_path, which is
+# then read instead of NLTK and pyspellchecker (a JSON file loads much faster): lemmatizing a known word is a dictionary lookup and
+# WordNet is only loaded for the words that are not in the table.
+resources_path = os.environ.get("PREPROCESSING_RESOURCES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "preprocessing_resources.json"))
+
+stop_words = None
+spell = None
+lemmatizer = None
+lemmas = None #word -> root word, prebuilt by build_preprocessing_resources
+resources_checked = False
 
 additional_stop_words = {
     "a", "about", "above", "ac", "according", "accordingly", "across", "actually", "ad", "adj", 
@@ -82,17 +88,130 @@ additional_stop_words = {
     "yipee", "you", "your", "yours", "yourself", "yourselves", "yu", "z", "za", "ze", "zu", "zum"
 }
 
-# Merge the 2 lists together to create a larger stop word corpus
-stop_words = stop_words.union(additional_stop_words)
-
 # Used to split text into words without separating the punctuation (terms with hyphens remain intact because of words like "pre-diabetes" and "body-mass"). The punctuation is also maintained for each word in the case there is no space between sentences which results in cases like "I like to read.I like hats." where "read" and "I" should be 2 separate words.
-word_splitter = RegexpTokenizer(pattern=r"\w+[-]\w+|\w+['.,!?]*|\w+|\S+")
+# Same tokens as nltk's RegexpTokenizer with the pattern r"\w+[-]\w+|\w+['.,!?]*|\w+|\S+" (its tokenize is a findall), without importing
+# NLTK. The alternatives that start with \w+ are factored so a word is not matched again by every alternative: the first two always
+# match the longest run of word characters, and the third one could only match when the second one does.
+word_splitter = re.compile(r"\w+(?:-\w+|['.,!?]*)|\S+", re.UNICODE | re.MULTILINE | re.DOTALL)
+
+def load_preprocessing_resources(file_path:str=None) -> bool:
+    '''
+    Load the stopwords, the words known to the spellchecker and the root words saved with build_preprocessing_resources.
+
+    Parameters:
+        file_path (str): Path of the resources (by default, resources_path)
+    Returns:
+        True if the resources were loaded, False if the file does not exist
+    '''
+    global stop_words, spell, lemmas
+    file_path = file_path or resources_path
+    if not os.path.exists(file_path):
+        return False
+    with open(file_path, "r") as file:
+        resources = json.load(file)
+    stop_words = set(resources["stop_words"])
+    # Membership is all the spellchecker is used for, and a set of its words answers it the same way
+    spell = frozenset(resources["spell_words"])
+    lemmas = resources.get("lemmas")
+    return True
+
+def check_preprocessing_resources():
+    '''
+    Load the resources saved at resources_path the first time one of them is needed (nothing is loaded if the file does not exist).
+    '''
+    global resources_checked
+    if not resources_checked:
+        resources_checked = True
+        load_preprocessing_resources()
+
+def get_stop_words() -> set:
+    '''
+    Returns the stopwords: the NLTK English stopwords merged with additional_stop_words (loaded on first use).
+    '''
+    global stop_words
+    if stop_words is None:
+        check_preprocessing_resources()
+    if stop_words is None:
+        from nltk.corpus import stopwords
+        # Merge the 2 lists together to create a larger stop word corpus
+        stop_words = set(stopwords.words('english')).union(additional_stop_words)
+    return stop_words
+
+def get_spell_checker():
+    '''
+    Returns the spellchecker used to check if a string is valid word (when splitting hyphenated words), loaded on first use.
+    '''
+    global spell
+    if spell is None:
+        check_preprocessing_resources()
+    if spell is None:
+        from spellchecker import SpellChecker
+        spell = SpellChecker()
+    return spell
+
+def get_lemmatizer():
+    '''
+    Returns the lemmatizer used to lemmatize (a form of stemming) words (better performance than the Porter and Lancaster stemmer), created on first use.
+    '''
+    global lemmatizer
+    if lemmatizer is None:
+        from nltk.stem import WordNetLemmatizer
+        lemmatizer = WordNetLemmatizer()
+    return lemmatizer
 
-# To check if a string is valid word (when splitting hyphenated words), use a spellchecker
-spell = SpellChecker()
+def download_nltk_data():
+    '''
+    Download the NLTK corpora used by the preprocessing (the only function that accesses the network).
+    '''
+    import nltk
+    nltk.download('stopwords')
+    nltk.download('wordnet')
 
-# Used to lemmatize (a form of stemming) words (better performance than the Porter and Lancaster stemmer)
-lemmatizer = WordNetLemmatizer()
+def get_corpus_words(corpus_path:str) -> set:
+    '''
+    Returns every word of a JSONL corpus (titles and texts) that normalize_token would lemmatize.
+    '''
+    tokens = set()
+    with open(corpus_path, "r") as file:
+        for line in file:
+            if line.strip():
+                doc = json.loads(line)
+                tokens.update(word_splitter.findall((doc["title"] + " " + doc["text"]).lower()))
+    return {word for token in tokens for word in split_token(token)}
+
+def build_preprocessing_resources(file_path:str=None, corpus_path:str=None):
+    '''
+    Save the stopwords, the words known to the spellchecker and the root words of the words of the spellchecker dictionary (a general
+    English word list) and of a corpus, so later processes load them from a single local file.
+
+    Parameters:
+        file_path (str): Where the resources are saved (by default, resources_path)
+        corpus_path (str): JSONL corpus whose words are added to the root words (optional)
+    Returns:
+        resources (dict): The saved resources
+    '''
+    global stop_words, spell, lemmas
+    from nltk.corpus import stopwords
+    from spellchecker import SpellChecker
+    stop_words = set(stopwords.words('english')).union(additional_stop_words)
+    spell = SpellChecker()
+
+    words = {word for word in spell.word_frequency.dictionary if only_letters.fullmatch(word)}
+    if corpus_path:
+        words.update(get_corpus_words(corpus_path))
+    # Stopwords are removed before lemmatizing, so they are never looked up
+    lemmas = {word: lemmatize_with_wordnet(word) for word in sorted(words) if word not in stop_words}
+
+    resources = {"stop_words": sorted(stop_words), "spell_words": sorted(spell.word_frequency.dictionary), "lemmas": lemmas}
+    with open(file_path or resources_path, "w") as file:
+        json.dump(resources, file)
+    return resources
+
+# Used to remove all non-letters from a word (except for hyphens)
+non_letters = re.compile(r'[^\x61-\x7A-]')
+
+# Words made only of the letters kept by non_letters
+only_letters = re.compile(r'[\x61-\x7A]+')
 
 def is_hyphenated_compound_word(word:str) -> bool:
     '''
@@ -108,78 +227,274 @@ def is_hyphenated_compound_word(word:str) -> bool:
     # For hyphenated words, check if they are the combination of multiple "real" words together or just a prefix and/or suffix. If they are a combination of "real" words, split them into multiple words. Otherwise, remove the hyphen and make them into a single word.
     if "-" in word:
         terms = word.split("-")
-        check_terms = [True if term in spell else False for term in terms]
+        spell_checker = get_spell_checker()
+        check_terms = [True if term in spell_checker else False for term in terms]
         if all(check_terms):
             return True
     return False
 
-def extract_index_terms(text:str) -> dict[str: int]:
+def lemmatize_with_wordnet(word:str) -> str:
+    '''
+    Returns the root word of a word, found with the WordNet lemmatizer.
+
+    Parameters:
+        word (str): Word to lemmatize
+    Returns:
+        root_word (str): The root word
+    '''
+    # Lemmatization works best if a POS tag is passed, so to get the root word, lemmatize on each POS tag and take the shortest length string as the root word
+    word_lemmatizer = get_lemmatizer()
+    return min(word_lemmatizer.lemmatize(word, pos="n"), word_lemmatizer.lemmatize(word, pos="v"), word_lemmatizer.lemmatize(word, pos="a"), key=len)
+
+def lemmatize(word:str) -> str:
+    '''
+    Returns the root word of a word, from the prebuilt root words if the word is in them, otherwise with the WordNet lemmatizer.
+
+    Parameters:
+        word (str): Word to lemmatize
+    Returns:
+        root_word (str): The root word
+    '''
+    if lemmas is None:
+        check_preprocessing_resources()
+    if lemmas is not None:
+        root_word = lemmas.get(word)
+        if root_word is not None:
+            return root_word
+    return lemmatize_with_wordnet(word)
+
+def split_token(token:str) -> list:
+    '''
+    Turns a token produced by the word splitter into the words to lemmatize: removes non-letters, splits compound words and removes stopwords.
+
+    Parameters:
+        token (str): Token to split
+    Returns:
+        words (list): The words of the token (empty if it is a stopword or contains no letters)
+    '''
+    # Remove all non-letters from the string entirely (maintain hyphens)
+    word = non_letters.sub("", token)
+    # If a hyphenated word is a compound word, split the word. If not, remove the hyphen.
+    words = word.split("-") if is_hyphenated_compound_word(word) else [word.replace("-", "")]
+    # Remove any empty strings and stopwords
+    stop_words = get_stop_words()
+    return [word for word in words if word and word not in stop_words]
+
+def normalize_token(token:str) -> tuple:
+    '''
+    Turns a token produced by the word splitter into its index terms: removes non-letters, splits compound words, removes stopwords and lemmatizes.
+
+    Parameters:
+        token (str): Token to normalize
+    Returns:
+        terms (tuple): The index terms of the token (empty if it is a stopword or contains no letters)
+    '''
+    return tuple(lemmatize(word) for word in split_token(token))
+
+class NormalizationCache:
+    '''
+    Bounded cache of the index terms of the tokens already normalized, so the spellchecker and lemmatizer are only called once per distinct token.
+    The least recently used tokens are evicted first once the cache is full (extract_index_terms only starts tracking the use of the
+    tokens once the cache is full, so tokens are evicted in the order they were added until then). The cache can be shared by every Document and Query and saved to disk.
+    '''
+
+    def __init__(self, maxsize=200000):
+        self.maxsize = maxsize
+        self.terms = OrderedDict() #token -> tuple of index terms
+        self.hits = 0
+        self.misses = 0
+        self.new_terms = None #token -> tuple of index terms normalized since record_new_terms was called (None when not recording)
+
+    def get(self, token:str) -> tuple:
+        '''
+        Returns the index terms of a token, normalizing it only if it is not in the cache.
+        '''
+        terms = self.terms.get(token)
+        if terms is not None:
+            self.hits += 1
+            self.terms.move_to_end(token)
+            return terms
+
+        self.misses += 1
+        terms = normalize_token(token)
+        if self.maxsize > 0:
+            self.terms[token] = terms
+            if len(self.terms) > self.maxsize:
+                self.terms.popitem(last=False)
+            if self.new_terms is not None:
+                self.new_terms[token] = terms
+        return terms
+
+    def record_new_terms(self):
+        '''
+        Start recording the tokens normalized from now on (e.g. by a worker process, whose cache is not the one that is saved).
+        '''
+        self.new_terms = {}
+
+    def pop_new_terms(self) -> dict:
+        '''
+        Stop recording and return the tokens normalized since record_new_terms was called, with their index terms.
+        '''
+        new_terms, self.new_terms = self.new_terms or {}, None
+        return new_terms
+
+    def update(self, terms:dict):
+        '''
+        Add tokens and their index terms (e.g. the ones returned by pop_new_terms in another process) to the cache.
+        '''
+        if self.maxsize <= 0:
+            return
+        for token, token_terms in terms.items():
+            self.terms[token] = tuple(token_terms)
+            self.terms.move_to_end(token)
+        while len(self.terms) > self.maxsize:
+            self.terms.popitem(last=False)
+
+    def clear(self):
+        self.terms.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def save(self, file_path:str):
+        '''
+        Save the cached tokens and their index terms as JSON.
+        '''
+        with open(file_path, "w") as file:
+            json.dump(self.terms, file)
+
+    def load(self, file_path:str):
+        '''
+        Add the tokens saved with save to the cache (does nothing if the file does not exist).
+        '''
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, "r") as file:
+            for token, terms in json.load(file).items():
+                self.terms[token] = tuple(terms)
+        while len(self.terms) > self.maxsize:
+            self.terms.popitem(last=False)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __repr__(self):
+        return f"NormalizationCache(size={len(self.terms)}, maxsize={self.maxsize}, hits={self.hits}, misses={self.misses})"
+
+# Cache shared by every Document and Query unless another one is passed
+normalization_cache = NormalizationCache()
+
+def extract_index_terms(text:str, cache:NormalizationCache=None) -> dict[str: int]:
     '''
     Given a string, extracts all of the relevant index terms along with their term frequencies, ignoring numbers, punctuation, and stopwords.
 
     Parameters:
         text (str): String to extract index terms
+        cache (NormalizationCache): Cache of the normalized tokens (by default, the shared normalization_cache)
     Returns:
         index_terms (dict): A dictionary containing index terms as keys and its term frequency within the document as values.
     '''
 
     if not text:
         return {}
-    
-    text = text.lower().strip()
-    # If there are any unicode characters in the text, decode them into their proper representations
-    text = text.encode('unicode_escape').decode('unicode_escape')
-    # Splits the given text into words
-    words = word_splitter.tokenize(text)
-    # Remove all non-letters from the string entirely (maintain hyphens)
-    words = [re.sub(pattern=r'[^\x61-\x7A-]', string=word, repl="") for word in words]
-    # If a hyphenated word is a compound word, split the word. If not, remove the hyphen.
-    words = [word.split("-") if is_hyphenated_compound_word(word) else [word.replace("-", "")] for word in words]
-    words = [word for list_of_words in words for word in list_of_words] # Flatten the list of lists into a single list
-    # Remove any empty strings
-    words = [word for word in words if word]
-    # # Remove any numbers
-    # words = [word for word in words if not is_number(word)]
-
-    # Count the occurences of each word within the document
-    term_freq = Counter(words)
+
+    if cache is None:
+        cache = normalization_cache
+
+    # Single pass over the text. Words never contain whitespace, so the lowercased text is split on whitespace and the chunks are
+    # counted in C (str.split and Counter), then every distinct chunk is split into words (a chunk of letters and digits is a single
+    # word) and every word is normalized (cleaning, compound word splitting, stopword removal and lemmatization, cached), adding the
+    # count of the chunk to its root words. The chunks are in the order of their first occurrence, so the root words are added in
+    # the same order as when the words are normalized one by one.
+    # (The encode('unicode_escape').decode('unicode_escape') round trip that was applied to the text returns any string unchanged, so it is not needed.)
     index_terms = dict()
+    get_term_freq = index_terms.get
+    find_words = word_splitter.findall
+    cached_terms = cache.terms
+    get_cached_terms = cached_terms.get
+    # Nothing is evicted until the cache is full, so until then a hit does not need to update the order of the tokens
+    track_recency = len(cached_terms) >= cache.maxsize
+    hits = 0
+
+    for chunk, count in Counter(text.lower().split()).items():
+        for word in ((chunk,) if chunk.isalnum() else find_words(chunk)):
+            root_words = get_cached_terms(word)
+            if root_words is None or track_recency:
+                root_words = cache.get(word)
+            else:
+                hits += 1
+            for root_word in root_words:
+                index_terms[root_word] = get_term_freq(root_word, 0) + count
 
-    # Using set difference, remove all the stopwords
-    words = set(term_freq.keys())
-    words = words.difference(stop_words)
+    cache.hits += hits
+    return index_terms
 
-    # For each word, lemmatize and then combine the counts for words that, after lemmatization, match with an existing word in the index
-    for key in term_freq.keys():
-        if key not in words:
+
+def extract_index_term_positions(text:str, cache:NormalizationCache=None) -> dict:
+    '''
+    Same as extract_index_terms, but returns the positions of every index term instead of its frequency. Every word of the text
+    takes a position, including the stopwords (so "insulin of resistance" does not match the phrase "insulin resistance"), and the
+    parts of a compound word take consecutive positions. Tokens without any letters (punctuation) do not take a position.
+
+    Parameters:
+        text (str): String to extract index terms
+        cache (NormalizationCache): Cache of the normalized tokens (by default, the shared normalization_cache)
+    Returns:
+        term_positions (dict): A dictionary containing index terms as keys and the sorted list of their positions as values.
+    '''
+    if not text:
+        return {}
+
+    if cache is None:
+        cache = normalization_cache
+
+    words = word_splitter.findall(text.lower())
+
+    term_positions = dict()
+    position = 0
+    for word in words:
+        root_words = cache.get(word)
+        if not root_words:
+            if non_letters.sub("", word).replace("-", ""):
+                position += 1
             continue
-        
-        # Lemmatization works best if a POS tag is passed, so to get the root word, lemmatize on each POS tag and take the shortest length string as the root word
-        root_word = min(lemmatizer.lemmatize(key, pos="n"), lemmatizer.lemmatize(key, pos="v"), lemmatizer.lemmatize(key, pos="a"), key=len)
-        if root_word == key:
-            if key in index_terms.keys():
-                index_terms[key] += term_freq[key]
+        for root_word in root_words:
+            if root_word in term_positions:
+                term_positions[root_word].append(position)
             else:
-                index_terms[key] = term_freq[key]
-        else:
-            if root_word in index_terms.keys():
-                index_terms[root_word] += term_freq[key]
-            else:
-                index_terms[root_word] = term_freq[key]
+                term_positions[root_word] = [position]
+            position += 1
 
-    return index_terms
+    return term_positions
+
+def extract_field_index_terms(fields:dict, cache:NormalizationCache=None) -> tuple:
+    '''
+    Extract the index terms of every field of a document in one pass.
+
+    Parameters:
+        fields (dict): The text of every field (e.g. {"title": ..., "text": ...}), in the order they appear in the document.
+        cache (NormalizationCache): Cache of the normalized tokens (by default, the shared normalization_cache)
+    Returns:
+        field_index_terms (dict), index_terms (dict): The index terms and term frequencies of every field and of the whole document.
+    '''
+    field_index_terms = {}
+    index_terms = {}
+    for field, text in fields.items():
+        field_index_terms[field] = extract_index_terms(text, cache=cache)
+        for term, freq in field_index_terms[field].items():
+            index_terms[term] = index_terms.get(term, 0) + freq
+    return field_index_terms, index_terms
 
 
 class RetrievalItem:
     _id = -1
 
-    def __init__(self, text, _id=None):        
+    def __init__(self, text, _id=None, cache=None):        
         if _id is None:
             self._id = Document.increment_id()
         else:
             self._id = _id #use the id passed to the doc
 
-        self.index_terms = extract_index_terms(text)
+        self.index_terms = extract_index_terms(text, cache=cache)
 
     @classmethod
     def increment_id(cls):
@@ -222,17 +537,61 @@ class RetrievalItem:
         """
         return len(self.index_terms)
 
+class StoredDocument:
+    '''The index terms of a document without its text (behaves like a Document for the ranking functions).'''
+
+    __slots__ = ("_id", "index_terms")
+
+    def __init__(self, _id, index_terms: dict):
+        self._id = _id
+        self.index_terms = index_terms
+
+    def get_id(self):
+        return self._id
+
+    def get_index_terms(self):
+        return self.index_terms
+
+    def __len__(self):
+        return len(self.index_terms)
+
 class Document(RetrievalItem):
     _id = -1
 
-    def __init__(self, title, text, _id=None, metadata={}):
+    def __init__(self, title, text, _id=None, metadata={}, cache=None, keep_fields=False):
         self.title = title.strip()
         self.text = text.strip()
         
-        super().__init__(self.title + " " + self.text, _id)
+        super().__init__("" if keep_fields else self.title + " " + self.text, _id, cache=cache)
+
+        # The title and the text are preprocessed separately and their index terms added up, which gives the same index terms
+        # as preprocessing them together
+        self.field_index_terms = None
+        if keep_fields:
+            self.field_index_terms, self.index_terms = extract_field_index_terms({"title": self.title, "text": self.text}, cache=cache)
 
         self.metadata = metadata
 
+    def get_field_terms(self, field):
+        '''
+        Returns the index terms and term frequencies of one field ("title" or "text") of a document created with keep_fields=True.
+        '''
+        return self.field_index_terms[field]
+
+    def get_field_document(self, field):
+        '''
+        Returns a StoredDocument with the index terms of one field only (e.g. to rank the documents by their titles).
+        '''
+        return StoredDocument(self._id, self.field_index_terms[field])
+
+    def discard_text(self):
+        '''
+        Drop the title, text and metadata once the index terms are extracted, to save memory (they can be read back from a DocStore).
+        '''
+        self.title = ""
+        self.text = ""
+        self.metadata = {}
+
     def get_title(self):
         return self.title
     
@@ -244,13 +603,27 @@ class Document(RetrievalItem):
 
 class Query(RetrievalItem):
 
-    def __init__(self, query, _id=None):
+    def __init__(self, query, _id=None, cache=None):
         self.query = query.strip()
 
-        super().__init__(self.query, _id)
+        super().__init__(self.query, _id, cache=cache)
 
     def get_query(self):
         return self.query
 
     def __repr__(self):
-        return f"Query(id={self._id}, query={self.query}, index={self.index_terms}, synonyms={self.index_synonyms})"
\ No newline at end of file
+        return f"Query(id={self._id}, query={self.query}, index={self.index_terms})"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare the resources of the preprocessing.")
+    parser.add_argument("--download", action="store_true", help="Download the NLTK corpora (stopwords and WordNet)")
+    parser.add_argument("--build-resources", nargs="?", const=resources_path, default=None, metavar="PATH", help="Save the stopwords, the spellchecker words and the root words to a local file")
+    parser.add_argument("--corpus", default=None, help="JSONL corpus whose words are added to the root words")
+    args = parser.parse_args()
+
+    if args.download:
+        download_nltk_data()
+    if args.build_resources:
+        resources = build_preprocessing_resources(args.build_resources, args.corpus)
+        print(f"Saved {len(resources['stop_words'])} stopwords, {len(resources['spell_words'])} spellchecker words and {len(resources['lemmas'])} root words to {args.build_resources}")
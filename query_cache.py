@@ -0,0 +1,164 @@
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from preprocessing import Query
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+
+# Cache of the rankings of queries. Queries that only differ in surface form ("Cells of cancer" and "cancer cell") have the same index
+# terms and therefore the same ranking, so the cache is keyed on the index terms of the query, the scoring parameters, the ranking
+# function and the document vectors, and on the inverted index the ranking was computed from.
+
+class IdentityKey:
+    '''
+    Hashable reference to an object (e.g. the dictionary of document vectors, which cannot be hashed) that is only equal to the
+    references to the same object. The cache keys hold the object, so its id cannot be reused by another object while rankings
+    computed with it are cached.
+    '''
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, IdentityKey) and other.value is self.value
+
+class QueryResultCache:
+    '''
+    Bounded cache of query rankings. The least recently used rankings are evicted first once the cache is full and rankings older
+    than ttl seconds are not returned. The rankings of several inverted indexes can be cached together: when an index changes (its
+    version is incremented whenever documents are added or deleted), only the rankings computed from that index are removed.
+    '''
+
+    def __init__(self, maxsize=10000, ttl=None):
+        '''
+        Parameters:
+            maxsize (int): Maximum number of rankings kept.
+            ttl (float): Number of seconds a ranking is kept (by default, until it is evicted).
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.results = OrderedDict() #key -> (time the ranking was added, ranking)
+        self.index_versions = {} #generation of an index -> version of the index its cached rankings were computed from (removed when the index is garbage collected)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(query: Query, k1, b, delta, top_n, rank_function=None, document_vectors=None):
+        '''
+        Returns the cache key of a query: its index terms with their frequencies, in canonical order, the scoring parameters, the
+        ranking function and the document vectors it is ranked with (so the rankings of different ranking functions are never mixed up).
+        '''
+        return (rank_function, IdentityKey(document_vectors), tuple(sorted(query.get_index_terms().items())), k1, b, delta, top_n)
+
+    def check_index(self, inverted_index):
+        '''
+        Remove the rankings computed from an older version of an index (the rankings of the other indexes are kept).
+        Returns the key under which the rankings of the index are cached: its generation, which no other index has (the rankings
+        of an index that was garbage collected are never returned for another one, and are evicted like any other).
+        '''
+        generation = inverted_index.generation
+        version = self.index_versions.get(generation)
+        if version != inverted_index.version:
+            if version is None:
+                # Forget the version of the index once it is garbage collected, so the versions do not pile up
+                weakref.finalize(inverted_index, self.index_versions.pop, generation, None)
+            stale = [key for key in self.results if key[0] == generation]
+            if stale:
+                self.invalidations += 1
+                for key in stale:
+                    del self.results[key]
+            self.index_versions[generation] = inverted_index.version
+        return generation
+
+    def get(self, key, inverted_index):
+        '''
+        Returns the cached ranking of a key, or None if it is not in the cache.
+        '''
+        with self.lock:
+            key = (self.check_index(inverted_index), key)
+            entry = self.results.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                self.expirations += 1
+                del self.results[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.results.move_to_end(key)
+            return list(entry[1])
+
+    def put(self, key, inverted_index, top_documents, version=None):
+        '''
+        Add the ranking of a key. If version is given, the ranking is only added if the index still has this version (the one it was computed from).
+        '''
+        with self.lock:
+            key = (self.check_index(inverted_index), key)
+            if self.maxsize <= 0 or (version is not None and version != inverted_index.version):
+                return
+            self.results[key] = (time.monotonic(), list(top_documents))
+            self.results.move_to_end(key)
+            if len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.index_versions.clear()
+            self.hits = 0
+            self.misses = 0
+            self.expirations = 0
+            self.invalidations = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.results),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return f"QueryResultCache(size={len(self.results)}, maxsize={self.maxsize}, ttl={self.ttl}, hits={self.hits}, misses={self.misses})"
+
+# Cache shared by the ranking functions unless another one is passed
+query_result_cache = QueryResultCache()
+
+def cached_rank_documents_for_query(query: Query, inverted_index, document_vectors, documents: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, top_n=100, cache=None, rank_function=bm25_taat_rank_documents_for_query):
+    """
+    Rank the documents for a query, reusing the ranking of a previous query with the same index terms and parameters.
+    Takes the same arguments as bm25_rank_documents_for_query, so it can be passed as the rank_function of process_and_save_results.
+
+    Parameters:
+        - cache: The QueryResultCache (by default, the shared query_result_cache)
+        - rank_function: The ranking function called on a cache miss
+
+    Returns:
+        - top_documents: List of tuples with document ID and similarity score
+    """
+    if cache is None:
+        cache = query_result_cache
+
+    key = cache.make_key(query, k1, b, delta, top_n, rank_function, document_vectors)
+    top_documents = cache.get(key, inverted_index)
+    if top_documents is None:
+        version = inverted_index.version
+        top_documents = rank_function(query, inverted_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
+        cache.put(key, inverted_index, top_documents, version)
+    return top_documents
@@ -1,4 +1,6 @@
+import heapq
 from math import log, sqrt
+import numpy as np
 from indexing import InvertedIndex
 from preprocessing import Document, Query
 
@@ -38,7 +40,26 @@ def compute_bm25_plus(total_documents, term_freq, doc_freq, doc_length, avg_doc_
     Returns:
         - weight: The BM25+ weighting of the given term
     """
-    weight = ((term_freq + delta) * (log((total_documents - doc_freq + 0.5) / (doc_freq + 0.5)))) / ((k1 * ((1 - b) + (b * doc_length / avg_doc_length))) + term_freq)
+    return compute_bm25_plus_from_idf(log((total_documents - doc_freq + 0.5) / (doc_freq + 0.5)), term_freq, doc_length, avg_doc_length, k1=k1, b=b, delta=delta)
+
+def compute_bm25_plus_from_idf(idf, term_freq, doc_length, avg_doc_length, k1=1.2, b=0.75, delta=1):
+    """
+    Computes the BM25+ weighting for a given term from its inverse document frequency (see InvertedIndex.get_idf), so the IDF of a
+    term is computed once rather than for every document that contains it.
+
+    Parameters:
+        - idf: The inverse document frequency of the term, log((N - df + 0.5) / (df + 0.5))
+        - term_freq: The term frequency within the document
+        - doc_length: The length of the document
+        - avg_doc_length: The average length of all documents in the corpus
+        - k1: BM25+ hyperparameter (default is 1.2)
+        - b: BM25+ hyperparameter (default is 0.75)
+        - delta: BM25+ hyperparameter (default is 1)
+
+    Returns:
+        - weight: The BM25+ weighting of the given term
+    """
+    weight = ((term_freq + delta) * idf) / ((k1 * ((1 - b) + (b * doc_length / avg_doc_length))) + term_freq)
     return weight
 
 def get_bm25_document_vector(document: Document, inverted_index: InvertedIndex, total_documents, avg_doc_length, k1=1.2, b=0.75, delta=1):
@@ -64,9 +85,9 @@ def get_bm25_document_vector(document: Document, inverted_index: InvertedIndex,
     doc_length = len(index_terms)
 
     for term, term_freq in index_terms.items():
-        doc_freq = len(inverted_index.get_postings(term))
+        idf = inverted_index.get_idf(term, total_documents)
 
-        weight = compute_bm25_plus(total_documents, term_freq, doc_freq, doc_length, avg_doc_length, k1=k1, b=b, delta=delta)
+        weight = compute_bm25_plus_from_idf(idf, term_freq, doc_length, avg_doc_length, k1=k1, b=b, delta=delta)
 
         doc_vector[term] = weight
     
@@ -98,13 +119,13 @@ def get_bm25_query_vector(query: Query, document: Document, inverted_index, tota
 
     query_vector = {}
     for term in query_terms.keys():
-        # Get document frequency from the inverted index
-        doc_freq = len(inverted_index.get_postings(term))
         # Get the query term frequency in the given document
         term_freq = index_terms.get(term, 0)
 
         if term_freq > 0:
-            weight = compute_bm25_plus(total_documents, term_freq, doc_freq, doc_length, avg_doc_length, k1=k1, b=b, delta=delta)
+            # Get the inverse document frequency from the inverted index
+            idf = inverted_index.get_idf(term, total_documents)
+            weight = compute_bm25_plus_from_idf(idf, term_freq, doc_length, avg_doc_length, k1=k1, b=b, delta=delta)
             query_vector[term] = weight
         else:
             query_vector[term] = 0
@@ -183,6 +204,459 @@ def bm25_rank_documents_for_query(query: Query, inverted_index, document_vectors
 
     return top_documents
 
+def get_document_magnitudes(document_vectors):
+    """
+    Compute the magnitude of every document vector once, so the ranking functions do not compute it again for every query.
+
+    Parameters:
+        - document_vectors: Precomputed document vectors for similarity calculation.
+
+    Returns:
+        - doc_magnitudes: A dictionary where the key is the document ID and the value is the magnitude of its vector
+    """
+    return {doc_id: sqrt(sum(value**2 for value in doc_vector.values())) for doc_id, doc_vector in document_vectors.items()}
+
+def sort_by_similarity(similarities: dict, documents: dict):
+    """
+    Sort documents by similarity score in descending order, documents with tied scores in the order of the corpus (the order in
+    which bm25_rank_documents_for_query scores them).
+
+    Parameters:
+        - similarities: A dictionary where the key is the document ID and the value is the similarity score
+        - documents: All the documents of the corpus, in the order of the corpus.
+
+    Returns:
+        - sorted_documents: The list of (doc_id, similarity) pairs sorted by similarity.
+    """
+    sorted_documents = sorted(similarities.items(), key=lambda item: item[1], reverse=True)
+
+    tied = set()
+    for (doc_id, similarity), (next_doc_id, next_similarity) in zip(sorted_documents, sorted_documents[1:]):
+        if similarity == next_similarity:
+            tied.add(doc_id)
+            tied.add(next_doc_id)
+    if not tied:
+        return sorted_documents
+
+    # Only the queries with tied scores need the positions of (some of) their documents in the corpus
+    positions = {}
+    for position, doc_id in enumerate(documents):
+        if doc_id in tied:
+            positions[doc_id] = position
+            if len(positions) == len(tied):
+                break
+    sorted_documents.sort(key=lambda item: (-item[1], positions.get(item[0], 0)))
+    return sorted_documents
+
+def bm25_taat_rank_documents_for_query(query: Query, inverted_index, document_vectors, documents: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, top_n=100, doc_magnitudes=None, total_documents=None):
+    """
+    Using BM25 scores, rank the documents for each query term-at-a-time. Only the postings lists of the query terms are walked,
+    so the cost of a query depends on the number of postings of its terms rather than on the size of the corpus.
+    Produces the same rankings as bm25_rank_documents_for_query (same scores, and documents with tied scores in the order of the corpus).
+
+    Parameters:
+        - query: A Query object
+        - inverted_index: Inverted index used for retrieving relevant documents.
+        - document_vectors: Precomputed document vectors for similarity calculation.
+        - documents: List of all documents in the corpus.
+        - avg_doc_length: The average document length in index terms.
+        - k1: BM25+ hyperparameter (default is 1.2)
+        - b: BM25+ hyperparameter (default is 0.75)
+        - delta: BM25+ hyperparameter (default is 1)
+        - top_n: Maximum number of top documents to retrieve for each query (default is 100).
+        - doc_magnitudes: The magnitude of every document vector (see get_document_magnitudes). If not given, the magnitudes of the
+                          documents that contain a query term are computed for every query.
+        - total_documents: The number of documents N used for the IDFs (default is len(documents); a shard of a sharded index
+                           passes the number of documents of the whole corpus).
+
+    Returns:
+        - top_documents: The top n documents retrieved from the corpus that match the given query.
+    """
+    if total_documents is None:
+        total_documents = len(documents)
+
+    # Score accumulators for every document that contains at least one query term
+    dot_products = {}
+    query_magnitudes = {}
+
+    for term in query.get_index_terms().keys():
+        postings = inverted_index.get_postings(term)
+        if not postings:
+            continue
+        idf = inverted_index.get_idf(term, total_documents)
+
+        for doc_id in postings:
+            document = documents.get(doc_id)
+            if document is None:
+                continue
+
+            # The document's own term frequency is used (not the postings) so the weights match get_bm25_query_vector
+            term_freq = document.get_index_terms().get(term, 0)
+            if term_freq <= 0:
+                continue
+
+            weight = compute_bm25_plus_from_idf(idf, term_freq, len(document), avg_doc_length, k1=k1, b=b, delta=delta)
+
+            dot_products[doc_id] = dot_products.get(doc_id, 0) + weight * document_vectors[doc_id].get(term, 0)
+            query_magnitudes[doc_id] = query_magnitudes.get(doc_id, 0) + weight**2
+
+    similarities = {}
+    for doc_id, dot_product in dot_products.items():
+        query_magnitude = sqrt(query_magnitudes[doc_id])
+        if doc_magnitudes is None:
+            doc_magnitude = sqrt(sum(value**2 for value in document_vectors[doc_id].values()))
+        else:
+            doc_magnitude = doc_magnitudes[doc_id]
+
+        if query_magnitude == 0 or doc_magnitude == 0:
+            continue
+
+        similarity = dot_product / (query_magnitude * doc_magnitude)
+        if similarity > 0:  # Only consider documents with a non-zero similarity
+            similarities[doc_id] = similarity
+
+    sorted_documents = sort_by_similarity(similarities, documents)
+    if not sorted_documents:
+        print(f"No documents returned for query: {query}")
+    top_documents = sorted_documents[:top_n]
+
+    return top_documents
+
+def compute_bm25_similarity(query_terms, document: Document, doc_vector, idfs, avg_doc_length, k1=1.2, b=0.75, delta=1):
+    """
+    Compute the cosine similarity between the BM25+ query vector of a query for a document and the document vector.
+    Equivalent to compute_cosine_similarity(get_bm25_query_vector(...), doc_vector) but reuses the inverse document frequencies of the query terms.
+
+    Parameters:
+        - query_terms: The index terms of the query.
+        - document: The Document object to score.
+        - doc_vector: The BM25+ document vector of the document.
+        - idfs: A dictionary of the inverse document frequency of each query term.
+        - avg_doc_length: The average document length in index terms.
+        - k1: BM25+ hyperparameter (default is 1.2)
+        - b: BM25+ hyperparameter (default is 0.75)
+        - delta: BM25+ hyperparameter (default is 1)
+
+    Returns:
+        - float: The cosine similarity score between the query and the document.
+    """
+    index_terms = document.get_index_terms()
+    doc_length = len(document)
+
+    dot_product = 0
+    query_magnitude = 0
+    for term in query_terms:
+        term_freq = index_terms.get(term, 0)
+        if term_freq > 0:
+            weight = compute_bm25_plus_from_idf(idfs[term], term_freq, doc_length, avg_doc_length, k1=k1, b=b, delta=delta)
+            dot_product += weight * doc_vector.get(term, 0)
+            query_magnitude += weight**2
+
+    query_magnitude = sqrt(query_magnitude)
+    doc_magnitude = sqrt(sum(value**2 for value in doc_vector.values()))
+
+    if query_magnitude == 0 or doc_magnitude == 0:
+        return 0.0
+
+    return dot_product / (query_magnitude * doc_magnitude)
+
+class CorpusPositions:
+    """
+    Positions of documents in the corpus (the order of the documents dictionary), found lazily: the documents are only enumerated
+    as far as the furthest document asked for, so queries without tied scores never walk the corpus.
+    """
+
+    def __init__(self, documents: dict):
+        self.documents = enumerate(documents)
+        self.positions = {}
+
+    def get(self, doc_id):
+        positions = self.positions
+        while doc_id not in positions:
+            position, next_doc_id = next(self.documents)
+            positions[next_doc_id] = position
+        return positions[doc_id]
+
+
+class RankedDocument:
+    """
+    Entry of the top n heap of bm25_maxscore_rank_documents_for_query. Entries are ordered from the worst to the best: by score,
+    then tied documents from the last to the first in the order of the corpus.
+    """
+
+    __slots__ = ("similarity", "doc_id", "positions")
+
+    def __init__(self, similarity, doc_id, positions: CorpusPositions):
+        self.similarity = similarity
+        self.doc_id = doc_id
+        self.positions = positions
+
+    def __lt__(self, other):
+        if self.similarity != other.similarity:
+            return self.similarity < other.similarity
+        return self.positions.get(self.doc_id) > self.positions.get(other.doc_id)
+
+def bm25_maxscore_rank_documents_for_query(query: Query, inverted_index, document_vectors, documents: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, top_n=100, stats=None):
+    """
+    Using BM25 scores, retrieve the top n documents for a query with MaxScore dynamic pruning.
+
+    The query terms are processed from the largest to the smallest upper bound (see InvertedIndex.compute_max_scores). By the
+    Cauchy-Schwarz inequality, the score of a document is at most the square root of the sum of the squared upper bounds of the
+    query terms it contains. A document that is first seen in the postings of a term can only contain that term and the terms
+    with smaller upper bounds, so once those bounds cannot beat the current top n threshold, the remaining postings are skipped.
+
+    Parameters:
+        - query: A Query object
+        - inverted_index: Inverted index used for retrieving relevant documents.
+        - document_vectors: Precomputed document vectors for similarity calculation.
+        - documents: List of all documents in the corpus.
+        - avg_doc_length: The average document length in index terms.
+        - k1: BM25+ hyperparameter (default is 1.2)
+        - b: BM25+ hyperparameter (default is 0.75)
+        - delta: BM25+ hyperparameter (default is 1)
+        - top_n: Maximum number of top documents to retrieve for each query (default is 100).
+        - stats: An optional dictionary where the number of postings evaluated and skipped and the number of documents scored are added.
+
+    Returns:
+        - top_documents: The top n documents retrieved from the corpus that match the given query.
+    """
+    total_documents = len(documents)
+    query_terms = list(query.get_index_terms().keys())
+
+    postings = {term: inverted_index.get_postings(term) for term in query_terms}
+    idfs = {term: inverted_index.get_idf(term, total_documents) for term in query_terms}
+
+    # Order the terms by upper bound, largest first, and compute the bound of a document that only contains the terms from i onwards
+    ordered_terms = sorted((term for term in query_terms if postings[term]), key=inverted_index.get_max_score, reverse=True)
+    max_scores = [inverted_index.get_max_score(term) for term in ordered_terms]
+    remaining_bounds = [0] * (len(ordered_terms) + 1)
+    for i in range(len(ordered_terms) - 1, -1, -1):
+        remaining_bounds[i] = remaining_bounds[i + 1] + max_scores[i]**2
+
+    postings_evaluated = 0
+    postings_skipped = 0
+    documents_scored = 0
+
+    # Min-heap of the top n documents; its smallest score is the threshold a document must reach. A document with the same score
+    # as the threshold replaces the worst document if it comes first in the corpus, like the exhaustive ranker orders tied documents
+    top_heap = []
+    seen = set()
+    positions = CorpusPositions(documents)
+
+    def threshold():
+        return top_heap[0].similarity if len(top_heap) >= top_n else 0
+
+    pruned = False
+    for i, term in enumerate(ordered_terms):
+        for position, doc_id in enumerate(postings[term]):
+            if doc_id in seen:
+                postings_evaluated += 1
+                continue
+
+            # Every document that has not been seen yet can only contain the terms from i onwards
+            if sqrt(remaining_bounds[i]) * (1 + 1e-9) < threshold():
+                postings_skipped += len(postings[term]) - position + sum(len(postings[later_term]) for later_term in ordered_terms[i + 1:])
+                pruned = True
+                break
+
+            postings_evaluated += 1
+            seen.add(doc_id)
+
+            document = documents.get(doc_id)
+            if document is None:
+                continue
+
+            # Probe the postings of the terms with smaller upper bounds to bound the document's score before computing it
+            bound = max_scores[i]**2
+            for j in range(i + 1, len(ordered_terms)):
+                postings_evaluated += 1
+                if doc_id in postings[ordered_terms[j]]:
+                    bound += max_scores[j]**2
+            if sqrt(bound) * (1 + 1e-9) < threshold():
+                continue
+
+            similarity = compute_bm25_similarity(query_terms, document, document_vectors[doc_id], idfs, avg_doc_length, k1=k1, b=b, delta=delta)
+            documents_scored += 1
+            if similarity <= 0:
+                continue
+
+            entry = RankedDocument(similarity, doc_id, positions)
+            if len(top_heap) < top_n:
+                heapq.heappush(top_heap, entry)
+            elif top_heap[0] < entry:
+                heapq.heapreplace(top_heap, entry)
+
+        if pruned:
+            break
+
+    if stats is not None:
+        stats["postings_evaluated"] = stats.get("postings_evaluated", 0) + postings_evaluated
+        stats["postings_skipped"] = stats.get("postings_skipped", 0) + postings_skipped
+        stats["documents_scored"] = stats.get("documents_scored", 0) + documents_scored
+
+    top_documents = [(entry.doc_id, entry.similarity) for entry in sorted(top_heap, reverse=True)]
+    if not top_documents:
+        print(f"No documents returned for query: {query}")
+
+    return top_documents
+
+def bm25_batch_rank_documents_for_queries(queries, inverted_index, document_vectors, documents: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, top_n=100, batch_size=256, doc_magnitudes=None):
+    """
+    Using BM25 scores, rank the documents for many queries at once. Gives exactly the same rankings as calling
+    bm25_rank_documents_for_query (or bm25_taat_rank_documents_for_query) for every query.
+
+    The BM25+ weight of a query term for a document does not depend on the query (only on the term and the document), so the
+    postings list of every term of the union of the query terms is fetched and weighted once with vectorized NumPy operations.
+    The scores of a batch of queries are then the product of the sparse query x term matrix with the term x document weight matrix:
+    the weighted postings of the terms of every query are concatenated and added up per (query, document) pair, so memory grows
+    with the number of postings of the batch rather than with the size of the corpus. The contributions of every pair are added
+    in the order of the terms of the query, so the floating-point sums are the same as with the other scorers.
+
+    Parameters:
+        - queries: A list of Query objects
+        - inverted_index: Inverted index used for retrieving relevant documents.
+        - document_vectors: Precomputed document vectors for similarity calculation.
+        - documents: List of all documents in the corpus.
+        - avg_doc_length: The average document length in index terms.
+        - k1: BM25+ hyperparameter (default is 1.2)
+        - b: BM25+ hyperparameter (default is 0.75)
+        - delta: BM25+ hyperparameter (default is 1)
+        - top_n: Maximum number of top documents to retrieve for each query (default is 100).
+        - batch_size: Number of queries scored together.
+        - doc_magnitudes: The magnitude of every document vector (see get_document_magnitudes), computed if not given.
+
+    Returns:
+        - rankings: The top n documents retrieved for each query, in the order of the queries.
+    """
+    total_documents = len(documents)
+    doc_ids = list(documents.keys())
+    doc_numbers = {doc_id: doc_number for doc_number, doc_id in enumerate(doc_ids)}
+    if doc_magnitudes is None:
+        doc_magnitudes = get_document_magnitudes(document_vectors)
+    doc_magnitudes = np.array([doc_magnitudes[doc_id] for doc_id in doc_ids])
+
+    query_terms = [list(query.get_index_terms().keys()) for query in queries]
+
+    # Fetch and weight the postings list of every term of the union of the query terms once
+    term_postings = {}
+    for term in dict.fromkeys(term for terms in query_terms for term in terms):
+        postings = inverted_index.get_postings(term)
+        idf = inverted_index.get_idf(term, total_documents)
+
+        postings_docs = []
+        term_freqs = []
+        doc_lengths = []
+        doc_weights = []
+        for doc_id in postings:
+            document = documents.get(doc_id)
+            if document is None:
+                continue
+            term_freq = document.get_index_terms().get(term, 0)
+            if term_freq <= 0:
+                continue
+            postings_docs.append(doc_numbers[doc_id])
+            term_freqs.append(term_freq)
+            doc_lengths.append(len(document))
+            doc_weights.append(document_vectors[doc_id].get(term, 0))
+
+        # Same operations, in the same order, as compute_bm25_plus
+        term_freqs = np.array(term_freqs, dtype=np.float64)
+        doc_lengths = np.array(doc_lengths, dtype=np.float64)
+        weights = ((term_freqs + delta) * idf) / ((k1 * ((1 - b) + (b * doc_lengths / avg_doc_length))) + term_freqs)
+
+        term_postings[term] = (np.array(postings_docs, dtype=np.int64), weights * np.array(doc_weights, dtype=np.float64), np.square(weights))
+
+    rankings = []
+    for batch_start in range(0, len(queries), batch_size):
+        batch_terms = query_terms[batch_start:batch_start + batch_size]
+
+        # One entry per (query, posting of a query term), the terms of every query in order
+        keys = [np.zeros(0, dtype=np.int64)]
+        contributions = [np.zeros(0)]
+        squared_weights = [np.zeros(0)]
+        for row, terms in enumerate(batch_terms):
+            for term in terms:
+                postings_docs, term_contributions, term_squared_weights = term_postings[term]
+                keys.append(row * total_documents + postings_docs)
+                contributions.append(term_contributions)
+                squared_weights.append(term_squared_weights)
+
+        # Add up the entries of every (query, document) pair. np.unique sorts the pairs by query, then by document number (the order
+        # of the corpus), and np.bincount adds the entries of a pair in the order they appear, i.e. in the order of the query terms
+        pairs, pair_numbers = np.unique(np.concatenate(keys), return_inverse=True)
+        dot_products = np.bincount(pair_numbers, weights=np.concatenate(contributions), minlength=len(pairs))
+        query_magnitudes = np.bincount(pair_numbers, weights=np.concatenate(squared_weights), minlength=len(pairs))
+        rows = pairs // total_documents if total_documents else pairs
+        columns = pairs - rows * total_documents
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            similarities = dot_products / (np.sqrt(query_magnitudes) * doc_magnitudes[columns])
+        kept = np.flatnonzero((query_magnitudes > 0) & (doc_magnitudes[columns] > 0) & (similarities > 0))
+        # Sort by query, then by similarity score in descending order, then documents with tied scores in the order of the corpus
+        kept = kept[np.lexsort((columns[kept], -similarities[kept], rows[kept]))]
+        bounds = np.searchsorted(rows[kept], np.arange(len(batch_terms) + 1))
+
+        for row in range(len(batch_terms)):
+            ranked = kept[bounds[row]:bounds[row + 1]][:top_n]
+            top_documents = [(doc_ids[doc_number], similarity) for doc_number, similarity in zip(columns[ranked].tolist(), similarities[ranked].tolist())]
+            if not top_documents:
+                print(f"No documents returned for query: {queries[batch_start + row]}")
+            rankings.append(top_documents)
+
+    return rankings
+
+def bm25f_rank_documents_for_query(query: Query, inverted_index, field_weights: dict, k1=1.2, b=0.75, delta=1, top_n=100):
+    """
+    Using BM25F scores, rank the documents for a query with a MultiFieldInvertedIndex. The term frequencies of the fields are
+    length-normalized per field, weighted and added up into one pseudo term frequency, which is saturated once per term:
+        tf = sum over the fields of weight * field_tf / ((1 - b) + b * field_length / average_field_length)
+        score = sum over the query terms of ((tf + delta) * idf) / (k1 + tf)
+    where the idf uses the document frequency of the term in the whole documents. Field lengths are in index terms, like the
+    document lengths of the other ranking functions.
+
+    Parameters:
+        - query: A Query object
+        - inverted_index: A MultiFieldInvertedIndex.
+        - field_weights: The weight of every field, e.g. {"title": 2.0, "text": 1.0} (fields with a weight of 0 are ignored).
+        - k1: BM25+ hyperparameter (default is 1.2)
+        - b: BM25+ hyperparameter, or a dictionary of b for every field (default is 0.75)
+        - delta: BM25+ hyperparameter (default is 1)
+        - top_n: Maximum number of top documents to retrieve for each query (default is 100).
+
+    Returns:
+        - top_documents: The top n documents retrieved from the corpus that match the given query.
+    """
+    total_documents = inverted_index.get_document_count()
+
+    fields = []
+    for field, weight in field_weights.items():
+        field_index = inverted_index.get_field_index(field)
+        avg_field_length = field_index.get_avg_unique_terms()
+        if weight and avg_field_length > 0:
+            fields.append((field_index, weight, b[field] if isinstance(b, dict) else b, avg_field_length))
+
+    scores = {}
+    for term in query.get_index_terms().keys():
+        if inverted_index.get_doc_freq(term) == 0:
+            continue
+        idf = inverted_index.get_idf(term, total_documents)
+
+        # Weighted, length-normalized term frequency of every document that has the term in one of the fields
+        term_freqs = {}
+        for field_index, weight, field_b, avg_field_length in fields:
+            for doc_id, field_freq in field_index.get_postings(term).items():
+                field_length = field_index.get_unique_terms_in_doc(doc_id)
+                term_freqs[doc_id] = term_freqs.get(doc_id, 0) + weight * field_freq / ((1 - field_b) + (field_b * field_length / avg_field_length))
+
+        for doc_id, term_freq in term_freqs.items():
+            scores[doc_id] = scores.get(doc_id, 0) + ((term_freq + delta) * idf) / (k1 + term_freq)
+
+    # Only consider documents with a score greater than 0, sorted by score in descending order
+    sorted_documents = sorted(((doc_id, score) for doc_id, score in scores.items() if score > 0), key=lambda item: item[1], reverse=True)
+    if not sorted_documents:
+        print(f"No documents returned for query: {query}")
+    return sorted_documents[:top_n]
+
 # def pseudo_relevance_loop(query: Query, documents:dict[int, Document], top_documents:list, n=2, k=3):
 #     """
 #     Take the top n terms of the top k documents returned by the first pass of the IR and add them to the end of the query.
@@ -215,7 +689,7 @@ def bm25_rank_documents_for_query(query: Query, inverted_index, document_vectors
 #     query = query.strip()
 #     return query
   
-def process_and_save_results(queries, inv_index, document_vectors, documents, avg_doc_length, output_file_name="results.txt", k1=1.2, b=0.75, delta=1, top_n=100, run_tag="run1"):
+def process_and_save_results(queries, inv_index, document_vectors, documents, avg_doc_length, output_file_name="results.txt", k1=1.2, b=0.75, delta=1, top_n=100, run_tag="run1", rank_function=bm25_rank_documents_for_query):
     """
     Process queries, rank documents, and save the top results in the required format.
 
@@ -234,6 +708,7 @@ def process_and_save_results(queries, inv_index, document_vectors, documents, av
     - delta: BM25+ hyperparameter (default is 1)
     - top_n: Maximum number of top documents to retrieve for each query (default is 100).
     - run_tag: A unique identifier for this run.
+    - rank_function: The function used to rank the documents for each query (default is bm25_rank_documents_for_query).
     """
     
     with open(output_file_name, "w") as output_file:
@@ -241,15 +716,55 @@ def process_and_save_results(queries, inv_index, document_vectors, documents, av
             query = Query(_id=query['_id'], query=query['text'])
 
             # Perform a ranking again of the documents
-            top_documents = bm25_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
+            top_documents = rank_function(query, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n)
 
-            # Write results in the required format
-            for rank, (doc_id, score) in enumerate(top_documents, start=1):
-                output_file.write(f"{query.get_id()} Q0 {doc_id} {rank} {score:.6f} {run_tag}\n")
+            write_results(output_file, query, top_documents, run_tag)
 
-            print(f"Top results for Query {query.get_id()}:")
-            for rank, (doc_id, score) in enumerate(top_documents[:5], start=1):  # Display top 5 for debugging
-                print(f"Rank {rank}: Document ID {doc_id}, Score {score:.6f}")
-            print("")
+    print(f"Results have been saved to {output_file_name}.")
+
+def write_results(output_file, query: Query, top_documents, run_tag):
+    """
+    Write the ranked documents of a query in the required format and print the top 5 for debugging.
+
+    Parameters:
+    - output_file: The open results file.
+    - query: The Query object.
+    - top_documents: The ranked (doc_id, score) pairs of the query.
+    - run_tag: A unique identifier for this run.
+    """
+    # Write results in the required format
+    for rank, (doc_id, score) in enumerate(top_documents, start=1):
+        output_file.write(f"{query.get_id()} Q0 {doc_id} {rank} {score:.6f} {run_tag}\n")
+
+    print(f"Top results for Query {query.get_id()}:")
+    for rank, (doc_id, score) in enumerate(top_documents[:5], start=1):  # Display top 5 for debugging
+        print(f"Rank {rank}: Document ID {doc_id}, Score {score:.6f}")
+    print("")
+
+def process_and_save_results_batch(queries, inv_index, document_vectors, documents, avg_doc_length, output_file_name="results.txt", k1=1.2, b=0.75, delta=1, top_n=100, run_tag="run1", batch_size=256):
+    """
+    Same as process_and_save_results, but all the queries are ranked at once with bm25_batch_rank_documents_for_queries.
+    Writes the same results file as process_and_save_results.
+
+    Parameters:
+    - queries: List of query dictionaries containing '_id' and 'text'.
+    - inv_index: Inverted index used for retrieving relevant documents.
+    - document_vectors: Precomputed document vectors for similarity calculation.
+    - documents: List of all documents in the corpus.
+    - avg_doc_length: The average document length in index terms.
+    - output_file_name: Name of the file to save results (default is 'results.txt').
+    - k1: BM25+ hyperparameter (default is 1.2)
+    - b: BM25+ hyperparameter (default is 0.75)
+    - delta: BM25+ hyperparameter (default is 1)
+    - top_n: Maximum number of top documents to retrieve for each query (default is 100).
+    - run_tag: A unique identifier for this run.
+    - batch_size: Number of queries scored together.
+    """
+    queries = [Query(_id=query['_id'], query=query['text']) for query in queries]
+    rankings = bm25_batch_rank_documents_for_queries(queries, inv_index, document_vectors, documents, avg_doc_length, k1=k1, b=b, delta=delta, top_n=top_n, batch_size=batch_size)
+
+    with open(output_file_name, "w") as output_file:
+        for query, top_documents in zip(queries, rankings):
+            write_results(output_file, query, top_documents, run_tag)
 
     print(f"Results have been saved to {output_file_name}.")
@@ -0,0 +1,408 @@
+import json
+import os
+import threading
+from collections.abc import Mapping
+from math import log
+
+from indexing import InvertedIndex
+from doc_utils import iter_jsonl
+from preprocessing import Query, StoredDocument
+from retrieve_and_rank import get_bm25_document_vector, bm25_taat_rank_documents_for_query
+
+# Segmented inverted index. Documents are first added to an in-memory buffer, which is flushed into a new immutable segment on disk
+# once it is full. Deleting a document only tombstones it in its segment. A background thread merges segments of similar size
+# (tiered merge policy), dropping the deleted documents, so the number of segments stays logarithmic in the size of the corpus.
+#
+# The directory of the index holds one JSONL file per segment (the index terms of its documents, in the order they were added) and
+# a manifest (segments.json) listing the live segments and their tombstones. The manifest is replaced atomically, so the index on
+# disk is always the one of the last flush or merge.
+#
+# Queries are answered from a snapshot: the segments and tombstones at the time the snapshot was taken. A snapshot never changes,
+# so a reader keeps consistent results while documents are added and segments are merged, and the BM25+ statistics (N, average
+# document length and document frequencies) are computed across all the live segments of the snapshot.
+
+MANIFEST_FILE = "segments.json"
+
+class Segment:
+    '''
+    Immutable part of a segmented index: documents and the inverted index of their terms.
+    '''
+
+    def __init__(self, name, documents: dict):
+        '''
+        Parameters:
+            name (str): Name of the segment (None for the buffer, which is not saved).
+            documents (dict): A dictionary where the document ID is the key and its index terms are the value.
+        '''
+        self.name = name
+        self.documents = documents
+        self.index = InvertedIndex()
+        for doc_id, terms in documents.items():
+            self.index.add_documents(doc_id, terms)
+        # A segment is saved with its documents and never changed, so its index does not track changes
+        self.index.mark_saved()
+
+    def get_path(self, directory):
+        return os.path.join(directory, self.name + ".jsonl")
+
+    def save(self, directory):
+        with open(self.get_path(directory), 'w') as file:
+            for doc_id, terms in self.documents.items():
+                file.write(json.dumps({"_id": doc_id, "index_terms": terms}) + "\n")
+
+    @classmethod
+    def load(cls, directory, name):
+        return cls(name, {record["_id"]: record["index_terms"] for record in iter_jsonl(os.path.join(directory, name + ".jsonl"))})
+
+    def __len__(self):
+        return len(self.documents)
+
+
+class LazyDocumentVectors(Mapping):
+    '''BM25+ document vectors of a snapshot, computed the first time they are needed.'''
+
+    def __init__(self, snapshot, k1=1.2, b=0.75, delta=0.25):
+        self.snapshot = snapshot
+        self.k1 = k1
+        self.b = b
+        self.delta = delta
+        self.vectors = {}
+
+    def __getitem__(self, doc_id):
+        vector = self.vectors.get(doc_id)
+        if vector is None:
+            snapshot = self.snapshot
+            vector = get_bm25_document_vector(snapshot.documents[doc_id], snapshot, snapshot.get_document_count(), snapshot.get_avg_unique_terms(),
+                                              k1=self.k1, b=self.b, delta=self.delta)
+            self.vectors[doc_id] = vector
+        return vector
+
+    def __iter__(self):
+        return iter(self.snapshot.documents)
+
+    def __len__(self):
+        return len(self.snapshot.documents)
+
+
+class IndexSnapshot:
+    '''
+    Read-only view of the live documents of a segmented index at one point in time. It has the methods of InvertedIndex used by the
+    ranking functions, with statistics computed across all of its segments.
+    '''
+
+    def __init__(self, segments, tombstones: dict, doc_delta=0.25):
+        '''
+        Parameters:
+            segments (list): The Segment objects, oldest first.
+            tombstones (dict): The deleted document IDs (frozenset) of each segment.
+            doc_delta (float): The BM25+ delta used for the document vectors.
+        '''
+        self.segments = [(segment, tombstones.get(segment.name, frozenset())) for segment in segments]
+        self.documents = {}
+        for segment, deleted in self.segments:
+            for doc_id, terms in segment.documents.items():
+                if doc_id not in deleted:
+                    self.documents[doc_id] = StoredDocument(doc_id, terms)
+        self.total_unique_terms = sum(len(document) for document in self.documents.values())
+        self.postings = {} #term -> live postings across the segments, merged the first time they are needed
+        self.document_vectors = LazyDocumentVectors(self, delta=doc_delta)
+
+    def get_postings(self, term: str):
+        '''Get the postings list of a term across the live documents of every segment.'''
+        postings = self.postings.get(term)
+        if postings is None:
+            postings = {}
+            for segment, deleted in self.segments:
+                for doc_id, freq in segment.index.get_postings(term).items():
+                    if doc_id not in deleted:
+                        postings[doc_id] = freq
+            self.postings[term] = postings
+        return postings
+
+    def get_doc_freq(self, term: str):
+        return len(self.get_postings(term))
+
+    def get_idf(self, term: str, total_documents=None):
+        if total_documents is None:
+            total_documents = len(self.documents)
+        doc_freq = self.get_doc_freq(term)
+        return log((total_documents - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def get_document_count(self):
+        return len(self.documents)
+
+    def get_avg_unique_terms(self):
+        return self.total_unique_terms / len(self.documents) if self.documents else 0
+
+    def search(self, query: Query, k1=1.2, b=0.75, delta=1, top_n=100):
+        '''
+        Rank the live documents for a query with the term-at-a-time scorer.
+
+        Returns:
+            top_documents (list): The top n (doc_id, score) pairs.
+        '''
+        return bm25_taat_rank_documents_for_query(query, self, self.document_vectors, self.documents, self.get_avg_unique_terms(), k1=k1, b=b, delta=delta, top_n=top_n)
+
+
+class SegmentedIndex:
+    '''
+    Inverted index made of immutable segments saved in a directory, with an in-memory buffer and a tiered merge policy.
+    '''
+
+    def __init__(self, directory, buffer_size=1000, merge_factor=4, background_merge=True, doc_delta=0.25):
+        '''
+        Parameters:
+            directory (str): Where the segments and the manifest are saved (an existing index is opened).
+            buffer_size (int): Number of documents added before the buffer is flushed into a new segment.
+            merge_factor (int): Number of segments of the same tier merged together. Segments are in tier t when they have between
+                                buffer_size * merge_factor^t and buffer_size * merge_factor^(t+1) live documents.
+            background_merge (bool): If True, merges run in a background thread, otherwise they run when the buffer is flushed.
+            doc_delta (float): The BM25+ delta used for the document vectors.
+        '''
+        self.directory = directory
+        self.buffer_size = buffer_size
+        self.merge_factor = merge_factor
+        self.doc_delta = doc_delta
+        os.makedirs(directory, exist_ok=True)
+
+        self.lock = threading.RLock()
+        self.segments = () #replaced (never modified) so snapshots can keep the old tuple
+        self.tombstones = {} #segment name -> frozenset of deleted document IDs
+        self.buffer = {} #document ID -> index terms of the documents not flushed yet
+        self.doc_locations = {} #document ID -> name of its segment (None for the buffer)
+        self.next_segment = 1
+        self.current_snapshot = None
+        self.load_manifest()
+
+        self.merges = 0
+        self.merging = False
+        self.merge_error = None #exception that stopped the background thread, raised by wait_for_merges and close
+        self.closed = False
+        self.merge_needed = threading.Condition(self.lock)
+        self.merge_thread = None
+        if background_merge:
+            self.merge_thread = threading.Thread(target=self.merge_in_background, daemon=True)
+            self.merge_thread.start()
+
+    def get_manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def load_manifest(self):
+        if not os.path.exists(self.get_manifest_path()):
+            return
+        with open(self.get_manifest_path(), 'r') as file:
+            manifest = json.load(file)
+        self.next_segment = manifest["next_segment"]
+        self.segments = tuple(Segment.load(self.directory, name) for name in manifest["segments"])
+        self.tombstones = {name: frozenset(deleted) for name, deleted in manifest["deleted"].items()}
+        for segment in self.segments:
+            deleted = self.tombstones.get(segment.name, frozenset())
+            for doc_id in segment.documents:
+                if doc_id not in deleted:
+                    self.doc_locations[doc_id] = segment.name
+
+    def save_manifest(self):
+        '''Write the manifest to a temporary file and replace the old one with it, so a crash never leaves a partial manifest.'''
+        manifest = {
+            "next_segment": self.next_segment,
+            "segments": [segment.name for segment in self.segments],
+            "deleted": {name: list(deleted) for name, deleted in self.tombstones.items() if deleted},
+        }
+        temporary_path = self.get_manifest_path() + ".tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, self.get_manifest_path())
+
+    def new_segment_name(self):
+        name = f"segment_{self.next_segment}"
+        self.next_segment += 1
+        return name
+
+    def add_document(self, doc_id, terms: dict):
+        '''
+        Add a document to the buffer (a document with the same ID is replaced).
+
+        Parameters:
+            doc_id: ID of the document
+            terms (dict): the dictionary of index terms with their frequencies
+        '''
+        with self.lock:
+            if doc_id in self.doc_locations:
+                self.delete_document(doc_id)
+            self.buffer[doc_id] = terms
+            self.doc_locations[doc_id] = None
+            self.current_snapshot = None
+            if len(self.buffer) >= self.buffer_size:
+                self.flush()
+
+    def delete_document(self, doc_id):
+        '''
+        Delete a document. Returns True if it was in the index.
+        '''
+        with self.lock:
+            if doc_id not in self.doc_locations:
+                return False
+            name = self.doc_locations.pop(doc_id)
+            if name is None:
+                del self.buffer[doc_id]
+            else:
+                self.tombstones[name] = self.tombstones.get(name, frozenset()) | {doc_id}
+            self.current_snapshot = None
+            return True
+
+    def flush(self):
+        '''
+        Save the buffered documents as a new segment and the deletions in the manifest.
+        '''
+        with self.lock:
+            if self.buffer:
+                segment = Segment(self.new_segment_name(), self.buffer)
+                segment.save(self.directory)
+                self.segments = self.segments + (segment,)
+                for doc_id in segment.documents:
+                    self.doc_locations[doc_id] = segment.name
+                self.buffer = {}
+                self.current_snapshot = None
+            self.save_manifest()
+
+            if self.merge_thread is None:
+                self.run_merges()
+            else:
+                self.merge_needed.notify_all()
+
+    def snapshot(self):
+        '''
+        Returns an IndexSnapshot of the live documents, including the buffered ones. The same snapshot is returned until the index changes.
+        '''
+        with self.lock:
+            if self.current_snapshot is None:
+                segments = self.segments + ((Segment(None, dict(self.buffer)),) if self.buffer else ())
+                self.current_snapshot = IndexSnapshot(segments, dict(self.tombstones), doc_delta=self.doc_delta)
+            return self.current_snapshot
+
+    def search(self, query: Query, k1=1.2, b=0.75, delta=1, top_n=100):
+        return self.snapshot().search(query, k1=k1, b=b, delta=delta, top_n=top_n)
+
+    def get_live_documents(self, segment: Segment):
+        return len(segment) - len(self.tombstones.get(segment.name, ()))
+
+    def get_tier(self, segment: Segment):
+        live_documents = self.get_live_documents(segment)
+        if live_documents <= self.buffer_size:
+            return 0
+        return int(log(live_documents / self.buffer_size, self.merge_factor))
+
+    def find_merge(self):
+        '''
+        Returns the segments to merge next (an empty list if no merge is needed): merge_factor segments of the same tier, or a
+        segment more than half of whose documents are deleted.
+        '''
+        with self.lock:
+            tiers = {}
+            for segment in self.segments:
+                if len(self.tombstones.get(segment.name, ())) * 2 > len(segment):
+                    return [segment]
+                tiers.setdefault(self.get_tier(segment), []).append(segment)
+            for tier in sorted(tiers):
+                if len(tiers[tier]) >= self.merge_factor:
+                    return tiers[tier][:self.merge_factor]
+            return []
+
+    def merge_segments(self, segments):
+        '''
+        Merge segments into a new one without their deleted documents. The new segment is written without holding the lock, so
+        documents can be added and queries answered during the merge; documents deleted meanwhile stay tombstoned in the new segment.
+        '''
+        with self.lock:
+            deleted = {segment.name: self.tombstones.get(segment.name, frozenset()) for segment in segments}
+            name = self.new_segment_name()
+
+        documents = {}
+        for segment in segments:
+            for doc_id, terms in segment.documents.items():
+                if doc_id not in deleted[segment.name]:
+                    documents[doc_id] = terms
+        merged = Segment(name, documents)
+        merged.save(self.directory)
+
+        with self.lock:
+            merged_names = {segment.name for segment in segments}
+            # The merged segment takes the place of the first segment merged
+            position = next(i for i, segment in enumerate(self.segments) if segment.name in merged_names)
+            remaining = tuple(segment for segment in self.segments if segment.name not in merged_names)
+            self.segments = remaining[:position] + (merged,) + remaining[position:]
+
+            deleted_during_merge = frozenset()
+            for segment in segments:
+                deleted_during_merge |= self.tombstones.pop(segment.name, frozenset()) - deleted[segment.name]
+            if deleted_during_merge:
+                self.tombstones[name] = deleted_during_merge
+            for doc_id in documents:
+                if self.doc_locations.get(doc_id) in merged_names:
+                    self.doc_locations[doc_id] = name
+
+            self.save_manifest()
+            self.current_snapshot = None
+            self.merges += 1
+
+        # Snapshots taken before the merge keep the merged segments in memory, so their files can be removed
+        for segment in segments:
+            os.remove(segment.get_path(self.directory))
+
+    def run_merges(self):
+        while True:
+            segments = self.find_merge()
+            if not segments:
+                return
+            self.merge_segments(segments)
+
+    def merge_in_background(self):
+        while True:
+            with self.lock:
+                while not self.closed and not self.find_merge():
+                    self.merge_needed.wait()
+                if self.closed:
+                    return
+                self.merging = True
+            try:
+                self.run_merges()
+            except Exception as error:
+                # The thread stops: the error is kept for wait_for_merges and close, which would otherwise wait for it forever
+                with self.lock:
+                    self.merge_error = error
+                return
+            finally:
+                with self.lock:
+                    self.merging = False
+                    self.merge_needed.notify_all()
+
+    def raise_merge_error(self):
+        '''Raise the exception that stopped the background thread, if any.'''
+        if self.merge_error is not None:
+            raise self.merge_error
+
+    def wait_for_merges(self):
+        '''Block until the background thread has no merge left to do. Raises the exception of a failed background merge.'''
+        with self.lock:
+            while self.merge_thread is not None and self.merge_error is None and (self.merging or self.find_merge()):
+                self.merge_needed.wait()
+            self.raise_merge_error()
+
+    def close(self):
+        '''Flush the buffer, finish the running merge and stop the background thread. Raises the exception of a failed background merge.'''
+        self.flush()
+        with self.lock:
+            self.closed = True
+            self.merge_needed.notify_all()
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+        self.raise_merge_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.doc_locations)
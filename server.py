@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from preprocessing import Query
+from doc_utils import load_inverted_index_jsonl, save_inverted_index_jsonl, get_stored_documents
+from parallel_indexing import build_index_parallel
+from retrieve_and_rank import get_bm25_document_vector, get_document_magnitudes, bm25_taat_rank_documents_for_query, bm25_batch_rank_documents_for_queries
+from query_cache import QueryResultCache, cached_rank_documents_for_query
+
+# Resident retrieval service. The corpus, the inverted index and the document vectors are loaded once and queries are then answered
+# over HTTP with JSON, so the startup cost of main.py is only paid once.
+#
+#   GET  /search?q=<query>&k=<top n>                         -> {"query", "results": [{"rank", "doc_id", "score"}], "latency_ms"}
+#   POST /search  {"queries": [{"_id", "text"}], "k": <top n>}  -> {"results": [{"query_id", "results": [...]}], "latency_ms"}
+#   GET  /health                                             -> {"status", "documents", "terms", "uptime_s", "requests", "result_cache"}
+#
+# Run with: python server.py [--port 8000] [--workers 4] [--titles-only]
+
+class RetrievalService:
+    '''
+    Everything needed to rank documents for a query, loaded once and shared by the request handlers.
+    '''
+
+    def __init__(self, inv_index, documents: dict, document_vectors: dict, avg_doc_length, k1=1.2, b=0.75, delta=1, result_cache: QueryResultCache=None):
+        '''
+        Parameters:
+            inv_index (InvertedIndex): The inverted index of the corpus.
+            documents (dict): A dictionary where the document ID is the key and the Document object is the value.
+            document_vectors (dict): The BM25+ document vectors.
+            avg_doc_length (float): The average document length in index terms.
+            k1, b, delta: BM25+ hyperparameters used to rank the documents.
+            result_cache (QueryResultCache): Cache of the rankings (by default, rankings are not cached).
+        '''
+        self.inv_index = inv_index
+        self.documents = documents
+        self.document_vectors = document_vectors
+        self.doc_magnitudes = get_document_magnitudes(document_vectors)
+        self.avg_doc_length = avg_doc_length
+        self.k1 = k1
+        self.b = b
+        self.delta = delta
+        self.result_cache = result_cache
+        self.started = time.time()
+        self.requests = 0
+        self.requests_lock = threading.Lock() #the requests are counted by the worker threads of the server
+        # The normalization cache shared by the queries is not thread-safe
+        self.preprocessing_lock = threading.Lock()
+        self.rank_function = partial(bm25_taat_rank_documents_for_query, doc_magnitudes=self.doc_magnitudes)
+
+    @classmethod
+    def load(cls, corpus_path, index_file_path=None, titles_only=False, k1=1.2, b=0.75, delta=1, doc_delta=0.25, result_cache: QueryResultCache=None):
+        '''
+        Build the documents, the inverted index and the document vectors the same way main.py does.
+
+        Parameters:
+            corpus_path (str): Path of the corpus JSONL file.
+            index_file_path (str): Inverted index JSONL file, loaded if it exists (the corpus is then not preprocessed) and saved otherwise.
+            titles_only (bool): If True, only the titles of the documents are indexed.
+            k1, b, delta: BM25+ hyperparameters used to rank the documents.
+            doc_delta (float): The BM25+ delta used for the document vectors.
+            result_cache (QueryResultCache): Cache of the rankings (by default, rankings are not cached).
+        '''
+        if index_file_path is not None and os.path.exists(index_file_path):
+            # The index terms of the documents are read back from the postings of the saved index
+            inv_index = load_inverted_index_jsonl(index_file_path)
+            documents = get_stored_documents(inv_index)
+        else:
+            inv_index, documents = build_index_parallel(corpus_path, titles_only=titles_only, keep_documents=True, discard_text=True)
+            if index_file_path is not None:
+                save_inverted_index_jsonl(inv_index, index_file_path)
+
+        avg_doc_length = sum(len(document.get_index_terms()) for document in documents.values()) / len(documents)
+
+        document_vectors = {}
+        for _id, document in documents.items():
+            document_vectors[_id] = get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=doc_delta)
+
+        return cls(inv_index, documents, document_vectors, avg_doc_length, k1=k1, b=b, delta=delta, result_cache=result_cache)
+
+    def make_query(self, text, _id=None):
+        if not isinstance(text, str):
+            raise TypeError(f"The text of a query must be a string, not {type(text).__name__}")
+        with self.preprocessing_lock:
+            return Query(_id=text if _id is None else _id, query=text)
+
+    def search(self, text, top_n=100):
+        '''
+        Returns the top n (doc_id, score) pairs for a query string.
+        '''
+        query = self.make_query(text)
+        if self.result_cache is not None:
+            return cached_rank_documents_for_query(query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                                   k1=self.k1, b=self.b, delta=self.delta, top_n=top_n, cache=self.result_cache, rank_function=self.rank_function)
+        return self.rank_function(query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                  k1=self.k1, b=self.b, delta=self.delta, top_n=top_n)
+
+    def search_batch(self, queries, top_n=100):
+        '''
+        Returns the top n (doc_id, score) pairs of every query, ranked together with the batch engine.
+
+        Parameters:
+            queries (list): (query ID, query string) pairs.
+        '''
+        queries = [self.make_query(text, _id) for _id, text in queries]
+        if self.result_cache is None:
+            return bm25_batch_rank_documents_for_queries(queries, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                                         k1=self.k1, b=self.b, delta=self.delta, top_n=top_n, doc_magnitudes=self.doc_magnitudes)
+
+        # Only the queries that are not in the cache are ranked. The batch engine gives the same rankings as the rank function of search,
+        # so both share the cached rankings
+        keys = [self.result_cache.make_key(query, self.k1, self.b, self.delta, top_n, self.rank_function, self.document_vectors) for query in queries]
+        rankings = [self.result_cache.get(key, self.inv_index) for key in keys]
+        misses = [position for position, top_documents in enumerate(rankings) if top_documents is None]
+        if misses:
+            version = self.inv_index.version
+            ranked = bm25_batch_rank_documents_for_queries([queries[position] for position in misses], self.inv_index, self.document_vectors, self.documents,
+                                                           self.avg_doc_length, k1=self.k1, b=self.b, delta=self.delta, top_n=top_n, doc_magnitudes=self.doc_magnitudes)
+            for position, top_documents in zip(misses, ranked):
+                rankings[position] = top_documents
+                self.result_cache.put(keys[position], self.inv_index, top_documents, version)
+        return rankings
+
+    def count_request(self):
+        with self.requests_lock:
+            self.requests += 1
+
+    def health(self):
+        health = {
+            "status": "ok",
+            "documents": len(self.documents),
+            "terms": len(self.inv_index.index),
+            "uptime_s": round(time.time() - self.started, 3),
+            "requests": self.requests,
+        }
+        if self.result_cache is not None:
+            health["result_cache"] = self.result_cache.stats()
+        return health
+
+def format_results(top_documents):
+    return [{"rank": rank, "doc_id": doc_id, "score": score} for rank, (doc_id, score) in enumerate(top_documents, start=1)]
+
+class RetrievalRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Answers the search and health requests with JSON. The service is the one of the server the handler belongs to.
+    '''
+
+    def send_json(self, status, body, started=None):
+        if started is not None:
+            body["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if started is not None:
+            self.send_header("X-Latency-Ms", str(body["latency_ms"]))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def get_top_n(self, value):
+        top_n = int(value)
+        if top_n <= 0:
+            raise ValueError("k must be positive")
+        return top_n
+
+    def get_batch_query(self, query):
+        _id, text = query["_id"], query["text"]
+        if not isinstance(text, str):
+            raise TypeError(f"The text of query {_id!r} must be a string")
+        if not isinstance(_id, (str, int)) or isinstance(_id, bool):
+            raise TypeError(f"The _id of a query must be a string or an integer, not {type(_id).__name__}")
+        return _id, text
+
+    def do_GET(self):
+        started = time.perf_counter()
+        service = self.server.service
+        url = urlparse(self.path)
+
+        if url.path == "/health":
+            self.send_json(200, service.health())
+            return
+        if url.path != "/search":
+            self.send_json(404, {"error": f"Unknown path: {url.path}"})
+            return
+
+        params = parse_qs(url.query)
+        if not params.get("q"):
+            self.send_json(400, {"error": "Missing query parameter q"})
+            return
+        try:
+            top_n = self.get_top_n(params.get("k", [100])[0])
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+            return
+
+        service.count_request()
+        text = params["q"][0]
+        top_documents = service.search(text, top_n)
+        self.send_json(200, {"query": text, "results": format_results(top_documents)}, started)
+
+    def do_POST(self):
+        started = time.perf_counter()
+        service = self.server.service
+        if urlparse(self.path).path != "/search":
+            self.send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            queries = [self.get_batch_query(query) for query in body["queries"]]
+            top_n = self.get_top_n(body.get("k", 100))
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {"error": f"Invalid batch request: {error}"})
+            return
+
+        service.count_request()
+        rankings = service.search_batch(queries, top_n)
+        results = [{"query_id": _id, "results": format_results(top_documents)} for (_id, _), top_documents in zip(queries, rankings)]
+        self.send_json(200, {"results": results}, started)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class RetrievalServer(HTTPServer):
+    '''
+    HTTP server that handles every connection in a bounded pool of worker threads.
+    '''
+
+    def __init__(self, address, service: RetrievalService, workers=4, verbose=True):
+        super().__init__(address, RetrievalRequestHandler)
+        self.service = service
+        self.verbose = verbose
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self.process_request_in_worker, request, client_address)
+
+    def process_request_in_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve BM25+ rankings over HTTP.")
+    parser.add_argument("--corpus", default="scifact/corpus.jsonl")
+    parser.add_argument("--index", default=None, help="Inverted index JSONL file (loaded if it exists, saved otherwise)")
+    parser.add_argument("--titles-only", action="store_true")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--k1", type=float, default=1.8)
+    parser.add_argument("--b", type=float, default=1.0)
+    parser.add_argument("--delta", type=float, default=1.0)
+    parser.add_argument("--cache-size", type=int, default=10000, help="Number of rankings cached (0 disables the cache)")
+    parser.add_argument("--cache-ttl", type=float, default=None, help="Number of seconds a cached ranking is kept")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result_cache = QueryResultCache(args.cache_size, args.cache_ttl) if args.cache_size > 0 else None
+    service = RetrievalService.load(args.corpus, args.index, titles_only=args.titles_only, k1=args.k1, b=args.b, delta=args.delta, result_cache=result_cache)
+    print(f"Loaded {len(service.documents)} documents in {time.perf_counter() - start:.2f}s")
+
+    server = RetrievalServer((args.host, args.port), service, workers=args.workers)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
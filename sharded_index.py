@@ -0,0 +1,292 @@
+import contextlib
+import heapq
+import io
+import json
+import multiprocessing
+import threading
+import zlib
+
+from indexing import InvertedIndex
+from preprocessing import Query
+from parallel_indexing import iter_corpus_lines, read_corpus_lines, index_shard
+from retrieve_and_rank import get_bm25_document_vector, get_document_magnitudes, bm25_taat_rank_documents_for_query
+
+# Sharded index with scatter-gather query execution. The documents of the corpus are partitioned across shards by a hash of their
+# ID, and every shard is indexed and served by its own worker process, which only holds the postings and documents of its shard.
+# The coordinator reads the corpus once to partition the byte offsets of its lines, and every shard only reads its own lines.
+#
+# BM25+ needs corpus-wide statistics (the number of documents N, the average document length and the document frequency of every
+# term), so the coordinator gathers the local statistics of every shard, adds them up and sends the global values back before the
+# shards compute their document vectors. Every shard then scores its documents with get_bm25_document_vector and
+# bm25_taat_rank_documents_for_query over a GlobalStatsIndex, which gives the same scores as over an unsharded index, and the
+# coordinator merges the top n documents of every shard into the global top n.
+
+def get_shard_number(doc_id, shards):
+    '''Returns the shard of a document (a stable hash of its ID, so it does not change between runs).'''
+    return zlib.crc32(str(doc_id).encode("utf-8")) % shards
+
+
+class GlobalStatsIndex:
+    '''
+    The postings of a shard with the corpus-wide document frequencies and number of documents, so the ranking functions give the
+    same IDFs as over an index of the whole corpus.
+    '''
+
+    def __init__(self, inverted_index, doc_freqs: dict, total_documents):
+        '''
+        Parameters:
+            inverted_index (InvertedIndex): The index of the shard.
+            doc_freqs (dict): Global document frequency of every term of the shard.
+            total_documents (int): Number of documents across all the shards.
+        '''
+        self.inverted_index = inverted_index
+        self.doc_freqs = doc_freqs
+        self.total_documents = total_documents
+
+    def get_postings(self, term: str):
+        return self.inverted_index.get_postings(term)
+
+    def get_doc_freq(self, term: str):
+        return self.doc_freqs.get(term, 0)
+
+    def get_document_count(self):
+        return self.total_documents
+
+    get_idf = InvertedIndex.get_idf
+
+
+class IndexShard:
+    '''
+    One shard of a sharded index: the inverted index, documents and document vectors of the documents routed to it.
+    '''
+
+    def __init__(self, corpus_path, offsets, titles_only=False):
+        '''
+        Parameters:
+            corpus_path (str): Path of the corpus JSONL file.
+            offsets (list): Byte offsets of the lines of the documents of this shard, in the order of the corpus.
+            titles_only (bool): If True, only the titles of the documents are indexed.
+        '''
+        self.inv_index, documents, _ = index_shard(read_corpus_lines(corpus_path, offsets), titles_only, keep_documents=True, discard_text=True)
+        self.documents = {document.get_id(): document for document in documents}
+        self.global_index = None
+        self.avg_doc_length = 0
+        self.document_vectors = {}
+        self.doc_magnitudes = {}
+
+    def get_local_stats(self):
+        '''
+        Returns:
+            document_count (int), total_unique_terms (int), doc_freqs (dict): The number of documents of the shard, the sum of their
+            lengths in unique index terms and the local document frequency of every term of the shard.
+        '''
+        total_unique_terms = sum(len(document.get_index_terms()) for document in self.documents.values())
+        doc_freqs = {term: len(postings) for term, postings in self.inv_index.index.items()}
+        return len(self.documents), total_unique_terms, doc_freqs
+
+    def set_global_stats(self, total_documents, avg_doc_length, doc_freqs, doc_delta=0.25):
+        '''
+        Set the corpus-wide statistics and compute the BM25+ document vectors with them (the same vectors as get_bm25_document_vector
+        over an unsharded index).
+
+        Parameters:
+            total_documents (int): Number of documents across all the shards.
+            avg_doc_length (float): Average document length in unique index terms across all the shards.
+            doc_freqs (dict): Global document frequency of every term of the shard.
+            doc_delta (float): The BM25+ delta used for the document vectors.
+        '''
+        self.global_index = GlobalStatsIndex(self.inv_index, doc_freqs, total_documents)
+        self.avg_doc_length = avg_doc_length
+        self.document_vectors = {doc_id: get_bm25_document_vector(document, self.global_index, total_documents, avg_doc_length, delta=doc_delta) for doc_id, document in self.documents.items()}
+        self.doc_magnitudes = get_document_magnitudes(self.document_vectors)
+
+    def search(self, query: Query, k1=1.2, b=0.75, delta=1, top_n=100):
+        '''
+        Rank the documents of the shard for a query with bm25_taat_rank_documents_for_query and the global statistics.
+
+        Returns:
+            top_documents (list): The top n (doc_id, score) pairs of the shard, tied documents in the order of the corpus.
+        '''
+        # A shard without any document for the query is not a query without results, so the message of the scorer is not printed
+        with contextlib.redirect_stdout(io.StringIO()):
+            return bm25_taat_rank_documents_for_query(query, self.global_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                                      k1=k1, b=b, delta=delta, top_n=top_n, doc_magnitudes=self.doc_magnitudes,
+                                                      total_documents=self.global_index.total_documents)
+
+def serve_shard(connection, corpus_path, offsets, titles_only=False):
+    '''
+    Main loop of a shard worker process: build the shard, then answer the requests of the coordinator until it is closed.
+    Every request is a (command, arguments) pair and every reply an ("ok", result) or ("error", message) pair.
+    '''
+    try:
+        shard = IndexShard(corpus_path, offsets, titles_only)
+        connection.send(("ok", shard.get_local_stats()))
+    except Exception as error:
+        connection.send(("error", repr(error)))
+        return
+
+    while True:
+        try:
+            command, arguments = connection.recv()
+        except EOFError:
+            return
+        if command == "close":
+            return
+        try:
+            if command == "set_global_stats":
+                result = shard.set_global_stats(*arguments)
+            elif command == "search":
+                queries, k1, b, delta, top_n = arguments
+                result = [shard.search(query, k1=k1, b=b, delta=delta, top_n=top_n) for query in queries]
+            else:
+                raise ValueError(f"Unknown command {command}")
+            connection.send(("ok", result))
+        except Exception as error:
+            connection.send(("error", repr(error)))
+
+
+class ShardedIndex:
+    '''
+    Coordinator of a sharded index served by local worker processes (one per shard). It has the search and search_batch methods of
+    RetrievalService, so it can be used in its place, and it gives the same scores as the term-at-a-time scorer over one index of
+    the whole corpus.
+    '''
+
+    def __init__(self, corpus_path, shards=None, titles_only=False, k1=1.2, b=0.75, delta=1, doc_delta=0.25):
+        '''
+        Parameters:
+            corpus_path (str): Path of the corpus JSONL file.
+            shards (int): Number of shards, i.e. of worker processes (by default, the number of CPUs).
+            titles_only (bool): If True, only the titles of the documents are indexed.
+            k1, b, delta: BM25+ hyperparameters of the queries.
+            doc_delta (float): The BM25+ delta used for the document vectors.
+        '''
+        self.shards = shards or multiprocessing.cpu_count()
+        self.k1 = k1
+        self.b = b
+        self.delta = delta
+        self.lock = threading.Lock() #a connection carries one request at a time
+        self.connections = []
+        self.processes = []
+
+        # The corpus is read once here to route the offset of every document to its shard
+        shard_offsets = [[] for _ in range(self.shards)]
+        self.doc_positions = {} #doc_id -> position of the document in the corpus, the order of tied documents
+        for position, (offset, line) in enumerate(iter_corpus_lines(corpus_path)):
+            doc_id = json.loads(line)["_id"]
+            self.doc_positions[doc_id] = position
+            shard_offsets[get_shard_number(doc_id, self.shards)].append(offset)
+
+        for offsets in shard_offsets:
+            connection, worker_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=serve_shard, args=(worker_connection, corpus_path, offsets, titles_only), daemon=True)
+            process.start()
+            worker_connection.close()
+            self.connections.append(connection)
+            self.processes.append(process)
+
+        try:
+            # The shards are built in parallel, their local statistics are gathered and the global ones sent back
+            local_stats = self.gather()
+            self.total_documents = sum(document_count for document_count, _, _ in local_stats)
+            total_unique_terms = sum(unique_terms for _, unique_terms, _ in local_stats)
+            self.avg_doc_length = total_unique_terms / self.total_documents if self.total_documents else 0
+            self.doc_freqs = {}
+            for _, _, doc_freqs in local_stats:
+                for term, doc_freq in doc_freqs.items():
+                    self.doc_freqs[term] = self.doc_freqs.get(term, 0) + doc_freq
+
+            for connection, (_, _, doc_freqs) in zip(self.connections, local_stats):
+                # A shard only needs the global document frequencies of its own terms
+                connection.send(("set_global_stats", (self.total_documents, self.avg_doc_length, {term: self.doc_freqs[term] for term in doc_freqs}, doc_delta)))
+            self.gather()
+            self.shard_sizes = [document_count for document_count, _, _ in local_stats]
+        except Exception:
+            self.close()
+            raise
+
+    def gather(self):
+        '''Wait for the reply of every shard and return their results, in the order of the shards.'''
+        results = []
+        errors = []
+        for shard_number, connection in enumerate(self.connections):
+            try:
+                status, result = connection.recv()
+            except EOFError:
+                status, result = "error", "the worker process exited"
+            if status == "ok":
+                results.append(result)
+            else:
+                errors.append(f"shard {shard_number}: {result}")
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        return results
+
+    def search_terms(self, queries, top_n=100):
+        '''
+        Scatter a batch of queries to every shard and merge the top n documents of every shard.
+
+        Parameters:
+            queries (list): The Query objects.
+            top_n (int): Number of documents returned for every query.
+        Returns:
+            rankings (list): The top n (doc_id, score) pairs of every query.
+        '''
+        with self.lock:
+            for connection in self.connections:
+                connection.send(("search", (queries, self.k1, self.b, self.delta, top_n)))
+            shard_rankings = self.gather()
+
+        # Every shard returns its rankings sorted by decreasing score and then in the order of the corpus, so they are merged
+        # without sorting them again, and tied documents stay in the order of the corpus like with one index
+        doc_positions = self.doc_positions
+        rankings = []
+        for query_rankings in zip(*shard_rankings):
+            merged = heapq.merge(*query_rankings, key=lambda item: (-item[1], doc_positions[item[0]]))
+            rankings.append(list(merged)[:top_n] if top_n is not None else list(merged))
+        return rankings
+
+    def search(self, text, top_n=100):
+        '''
+        Returns the top n (doc_id, score) pairs for a query string.
+        '''
+        return self.search_terms([Query(text)], top_n)[0]
+
+    def search_batch(self, queries, top_n=100):
+        '''
+        Rank a batch of queries with a single round trip to every shard.
+
+        Parameters:
+            queries (list): (query_id, query string) pairs.
+        Returns:
+            rankings (list): The top n (doc_id, score) pairs of every query, in the same order.
+        '''
+        return self.search_terms([Query(text, _id=query_id) for query_id, text in queries], top_n)
+
+    def close(self):
+        '''Stop the worker processes.'''
+        for connection in self.connections:
+            try:
+                connection.send(("close", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.total_documents
+
+    def __repr__(self):
+        return f"ShardedIndex(shards={self.shards}, documents={self.total_documents}, terms={len(self.doc_freqs)})"
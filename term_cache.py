@@ -0,0 +1,154 @@
+import threading
+from collections import OrderedDict
+from math import log
+
+# Term-level cache in front of an inverted index. The ranking functions call get_postings for the same terms over and over (if only
+# to get their document frequency), which means decoding the postings list every time with a BinaryInvertedIndex or compressed postings.
+# The cache keeps the decoded postings lists and the IDF of the most recently used terms.
+
+class TermCacheEntry:
+    __slots__ = ("postings", "doc_freq", "idf", "total_documents")
+
+    def __init__(self, postings, doc_freq, idf, total_documents):
+        self.postings = postings #dictionary of document IDs and term frequencies
+        self.doc_freq = doc_freq
+        self.idf = idf
+        self.total_documents = total_documents #N the IDF was computed with
+
+
+class CachedInvertedIndex:
+    '''
+    Wraps an inverted index (InvertedIndex, CompactInvertedIndex or BinaryInvertedIndex) and caches the decoded postings lists of the
+    terms it is asked for. It can be passed to the ranking functions instead of the index it wraps: every other attribute and method
+    is the one of the wrapped index.
+
+    The memory used is bounded by the total number of cached postings: once it exceeds max_postings, the least recently used terms
+    are evicted. The cache is cleared when the version of the wrapped index changes.
+
+    The working set of the queries is estimated per window of working_set_window lookups (the number of distinct terms looked up
+    in the last complete window), so tracking it takes bounded memory however many lookups the cache serves.
+    '''
+
+    def __init__(self, inverted_index, max_postings=1000000, working_set_window=10000):
+        '''
+        Parameters:
+            inverted_index (InvertedIndex): The index to cache.
+            max_postings (int): Maximum total length of the cached postings lists.
+            working_set_window (int): Number of lookups over which the distinct terms are counted.
+        '''
+        self.inverted_index = inverted_index
+        self.max_postings = max_postings
+        self.entries = OrderedDict() #term -> TermCacheEntry
+        self.cached_postings = 0
+        self.cached_version = inverted_index.version
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.peak_postings = 0
+        self.working_set_window = working_set_window
+        self.window_terms = set() #distinct terms looked up in the current window (at most working_set_window terms)
+        self.window_lookups = 0
+        self.working_set = 0 #distinct terms looked up in the last complete window
+
+    def __getattr__(self, name):
+        # Only called for the attributes the cache does not have itself
+        if name == "inverted_index":
+            raise AttributeError(name)
+        return getattr(self.inverted_index, name)
+
+    def get_entry(self, term: str):
+        '''
+        Returns the cache entry of a term, decoding its postings list and computing its IDF on a miss.
+        '''
+        with self.lock:
+            if self.inverted_index.version != self.cached_version:
+                self.entries.clear()
+                self.cached_postings = 0
+                self.cached_version = self.inverted_index.version
+
+            self.count_lookup(term)
+            entry = self.entries.get(term)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(term)
+                return entry
+
+            self.misses += 1
+            postings = self.inverted_index.get_postings(term)
+            if not isinstance(postings, dict):
+                # Compact, compressed and memory-mapped postings are decoded once
+                postings = dict(postings.items())
+            doc_freq = len(postings)
+            total_documents = self.inverted_index.get_document_count()
+            entry = TermCacheEntry(postings, doc_freq, log((total_documents - doc_freq + 0.5) / (doc_freq + 0.5)), total_documents)
+
+            if doc_freq <= self.max_postings:
+                self.entries[term] = entry
+                self.cached_postings += doc_freq
+                self.peak_postings = max(self.peak_postings, self.cached_postings)
+                while self.cached_postings > self.max_postings:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.cached_postings -= evicted.doc_freq
+                    self.evictions += 1
+            return entry
+
+    def count_lookup(self, term: str):
+        '''Add a lookup to the working set estimate (called with the lock held).'''
+        self.window_terms.add(term)
+        self.window_lookups += 1
+        if self.window_lookups >= self.working_set_window:
+            self.working_set = len(self.window_terms)
+            self.window_terms.clear()
+            self.window_lookups = 0
+
+    def get_postings(self, term: str):
+        '''Get the postings list of a term as a dictionary of document IDs and term frequencies (empty if the term is not in the index).'''
+        return self.get_entry(term).postings
+
+    def get_doc_freq(self, term: str):
+        '''Get the number of documents a term appears in.'''
+        return self.get_entry(term).doc_freq
+
+    def get_idf(self, term: str, total_documents=None):
+        '''
+        Get the BM25 inverse document frequency of a term, log((N - df + 0.5) / (df + 0.5)). N is the number of documents in the
+        index unless total_documents is given, in which case the cached IDF is only used if it was computed with the same N.
+        '''
+        entry = self.get_entry(term)
+        if total_documents is None or total_documents == entry.total_documents:
+            return entry.idf
+        return log((total_documents - entry.doc_freq + 0.5) / (entry.doc_freq + 0.5))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.cached_postings = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.peak_postings = 0
+            self.window_terms.clear()
+            self.window_lookups = 0
+            self.working_set = 0
+
+    def stats(self):
+        '''
+        Returns the hit and miss counts, the number of cached terms and postings, and the size of the working set (the number of
+        distinct terms looked up in the last complete window of lookups, or so far in the current one before the first is complete).
+        '''
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "cached_terms": len(self.entries),
+            "cached_postings": self.cached_postings,
+            "peak_postings": self.peak_postings,
+            "working_set_terms": self.working_set or len(self.window_terms),
+        }
+
+    def __repr__(self):
+        return f"CachedInvertedIndex(terms={len(self.entries)}, postings={self.cached_postings}, max_postings={self.max_postings}, hits={self.hits}, misses={self.misses})"
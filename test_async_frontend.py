@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from async_frontend import AsyncQueryFrontend
+
+# Checks the micro-batching, the coalescing of identical queries and the shutdown of the asyncio front end, with a service that
+# records the batches it is asked to rank.
+# Run with: python -m unittest test_async_frontend
+
+class RecordingService:
+    '''Ranks every query as the single document named after its text, and records the batches.'''
+
+    def __init__(self, ranking_started=None, release=None):
+        self.batches = []
+        self.ranking_started = ranking_started #set when a batch starts being ranked
+        self.release = release #if given, a batch is only ranked once it is set
+        self.lock = threading.Lock()
+
+    def search_batch(self, queries, top_n=100):
+        with self.lock:
+            self.batches.append([text for _, text in queries])
+        if self.ranking_started is not None:
+            self.ranking_started.set()
+        if self.release is not None and not self.release.wait(5):
+            raise TimeoutError("The batch was never released")
+        if any(text == "error" for _, text in queries):
+            raise ValueError("Cannot rank the query")
+        return [[(text, 1.0)][:top_n] for _, text in queries]
+
+
+class AsyncQueryFrontendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def run_frontend(self, service, scenario, **kwargs):
+        async def run():
+            frontend = AsyncQueryFrontend(service, executor=self.executor, **kwargs)
+            try:
+                return await scenario(frontend)
+            finally:
+                await frontend.close()
+        return asyncio.run(run())
+
+    def test_batching(self):
+        service = RecordingService()
+
+        async def scenario(frontend):
+            return await asyncio.gather(*(frontend.search(text, 10) for text in ("a", "b", "c", "d", "e")))
+
+        rankings = self.run_frontend(service, scenario, max_batch_size=3, max_wait=0.05)
+        self.assertEqual(rankings, [[(text, 1.0)] for text in ("a", "b", "c", "d", "e")])
+        self.assertEqual(service.batches, [["a", "b", "c"], ["d", "e"]])
+
+    def test_coalescing(self):
+        service = RecordingService()
+
+        async def scenario(frontend):
+            rankings = await asyncio.gather(*(frontend.search("a", 10) for _ in range(3)), frontend.search("a", 5))
+            return rankings, frontend.stats()
+
+        rankings, stats = self.run_frontend(service, scenario, max_wait=0.05)
+        self.assertEqual(service.batches, [["a"], ["a"]]) #one batch per top n
+        self.assertEqual(stats["coalesced"], 2)
+        self.assertEqual(rankings[0], rankings[1])
+        # Every request gets its own list
+        self.assertIsNot(rankings[0], rankings[1])
+        rankings[0].clear()
+        self.assertEqual(rankings[1], [("a", 1.0)])
+
+    def test_batches_ranked_concurrently(self):
+        # The batch of "a" is only ranked once the batch of "b" is being ranked, which cannot happen if the batches are ranked one after the other
+        second_started = threading.Event()
+
+        class WaitingService:
+            def search_batch(self, queries, top_n=100):
+                text = queries[0][1]
+                if text == "a" and not second_started.wait(5):
+                    raise TimeoutError("The second batch was not ranked while the first one was")
+                second_started.set()
+                return [[(text, 1.0)]]
+
+        async def scenario(frontend):
+            first = asyncio.ensure_future(frontend.search("a", 10))
+            await asyncio.sleep(0.02)
+            return await asyncio.gather(first, frontend.search("b", 10))
+
+        rankings = self.run_frontend(WaitingService(), scenario, max_batch_size=1, max_wait=0)
+        self.assertEqual(rankings, [[("a", 1.0)], [("b", 1.0)]])
+
+    def test_errors(self):
+        service = RecordingService()
+
+        async def scenario(frontend):
+            results = await asyncio.gather(frontend.search("error", 10), frontend.search("a", 10), return_exceptions=True)
+            # The front end keeps ranking after a failed batch
+            results.append(await frontend.search("b", 10))
+            return results
+
+        results = self.run_frontend(service, scenario, max_batch_size=1, max_wait=0)
+        self.assertIsInstance(results[0], ValueError)
+        self.assertEqual(results[1:], [[("a", 1.0)], [("b", 1.0)]])
+
+    def test_close(self):
+        ranking_started = threading.Event()
+        release = threading.Event()
+        service = RecordingService(ranking_started=ranking_started, release=release)
+
+        async def scenario(frontend):
+            request = asyncio.ensure_future(frontend.search("a", 10))
+            await asyncio.get_running_loop().run_in_executor(None, ranking_started.wait, 5)
+            await frontend.close()
+            release.set()
+            with self.assertRaises(asyncio.CancelledError):
+                await request
+            self.assertIsNone(frontend.batcher)
+            self.assertEqual(frontend.in_flight, {})
+            self.assertEqual(frontend.batch_tasks, set())
+
+            # A closed front end starts a new batcher for the next query
+            return await frontend.search("b", 10)
+
+        self.assertEqual(self.run_frontend(service, scenario), [("b", 1.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+
+from indexing import InvertedIndex, CompactInvertedIndex
+from binary_index import save_inverted_index_binary, load_inverted_index_binary, RAW_CODEC, VBYTE_CODEC
+
+# Checks that an index saved in the binary format has the same postings and statistics as the index it was saved from.
+# Run with: python -m unittest test_binary_index
+
+DOCUMENTS = [
+    ("a", {"insulin": 1, "resistance": 2}),
+    ("b", {"insulin": 1}),
+    ("c", {"resistance": 1, "obesity": 3}),
+    ("e", {}),
+]
+
+def build_index(index_class):
+    inv_index = index_class()
+    for doc_id, terms in DOCUMENTS:
+        inv_index.add_documents(doc_id, terms)
+    return inv_index
+
+
+class BinaryIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.base_path = os.path.join(self.directory.name, "index")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def assertSameIndex(self, inv_index, binary_index):
+        self.assertEqual(binary_index.get_document_count(), inv_index.get_document_count())
+        self.assertEqual(binary_index.get_avg_unique_terms(), inv_index.get_avg_unique_terms())
+        self.assertEqual(binary_index.get_avg_doc_length(), inv_index.get_avg_doc_length())
+        for term in ("insulin", "resistance", "obesity", "missing"):
+            self.assertEqual(dict(binary_index.get_postings(term).items()), dict(inv_index.get_postings(term).items()), term)
+            self.assertEqual(binary_index.get_idf(term), inv_index.get_idf(term), term)
+        for doc_id in inv_index.doc_stats:
+            self.assertEqual(binary_index.get_unique_terms_in_doc(doc_id), inv_index.get_unique_terms_in_doc(doc_id))
+            self.assertEqual(binary_index.get_max_term_frequency_in_doc(doc_id), inv_index.get_max_term_frequency_in_doc(doc_id))
+            self.assertEqual(binary_index.get_doc_norm(doc_id), inv_index.get_doc_norm(doc_id))
+
+    def test_same_index_after_saving(self):
+        for index_class in (InvertedIndex, CompactInvertedIndex):
+            for codec in (RAW_CODEC, VBYTE_CODEC):
+                inv_index = build_index(index_class)
+                save_inverted_index_binary(inv_index, self.base_path, codec=codec)
+                with load_inverted_index_binary(self.base_path) as binary_index:
+                    self.assertSameIndex(inv_index, binary_index)
+
+    def test_tombstoned_documents_not_saved(self):
+        for index_class in (InvertedIndex, CompactInvertedIndex):
+            inv_index = build_index(index_class)
+            inv_index.delete_document("b")
+            save_inverted_index_binary(inv_index, self.base_path)
+            with load_inverted_index_binary(self.base_path) as binary_index:
+                self.assertEqual(binary_index.get_document_count(), 3)
+                self.assertSameIndex(inv_index, binary_index)
+                self.assertNotIn("b", binary_index.get_postings("insulin"))
+
+    def test_read_only_views(self):
+        inv_index = build_index(CompactInvertedIndex)
+        save_inverted_index_binary(inv_index, self.base_path, codec=VBYTE_CODEC)
+        with load_inverted_index_binary(self.base_path) as binary_index:
+            self.assertEqual(list(binary_index.doc_stats), list(inv_index.doc_stats))
+            self.assertEqual(binary_index.doc_stats["c"].to_dict(), inv_index.doc_stats["c"].to_dict())
+            self.assertEqual(binary_index.get_doc_freq("resistance"), 2)
+            self.assertEqual(sorted(binary_index.index), sorted(inv_index.index))
+
+            # A binary index can be merged into an in-memory index and saved again
+            merged = InvertedIndex()
+            merged.merge(binary_index)
+            self.assertSameIndex(merged, binary_index)
+            with self.assertRaises(TypeError):
+                binary_index.add_documents("f", {"insulin": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
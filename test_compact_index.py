@@ -0,0 +1,86 @@
+import pickle
+import unittest
+
+from indexing import InvertedIndex, CompactInvertedIndex, PackedPostings
+
+# Checks that a CompactInvertedIndex has the same postings and statistics as an InvertedIndex, packed or not, after updates and
+# after pickling, and that it pickles smaller.
+# Run with: python -m unittest test_compact_index
+
+def make_documents(count=300):
+    # Deterministic documents with overlapping terms and repeated term frequencies
+    documents = {}
+    for number in range(count):
+        terms = {f"term{(number * step) % 97}": 1 + (number + step) % 3 for step in range(1, 8)}
+        documents[f"doc{number}"] = terms
+    return documents
+
+def build_index(index_class, documents):
+    inv_index = index_class()
+    for doc_id, terms in documents.items():
+        inv_index.add_documents(doc_id, terms)
+    return inv_index
+
+
+class CompactInvertedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.documents = make_documents()
+
+    def assertSameIndex(self, inv_index, compact_index):
+        self.assertEqual(list(compact_index.doc_stats), list(inv_index.doc_stats))
+        self.assertEqual(list(compact_index.index), list(inv_index.index))
+        self.assertEqual(compact_index.get_avg_doc_length(), inv_index.get_avg_doc_length())
+        for term in inv_index.index:
+            self.assertEqual(compact_index.get_postings(term).items(), list(inv_index.get_postings(term).items()), term)
+            self.assertEqual(compact_index.get_idf(term), inv_index.get_idf(term), term)
+        for doc_id in inv_index.doc_stats:
+            self.assertEqual(compact_index.get_doc_norm(doc_id), inv_index.get_doc_norm(doc_id))
+
+    def test_packed_same_as_inverted_index(self):
+        inv_index = build_index(InvertedIndex, self.documents)
+        compact_index = build_index(CompactInvertedIndex, self.documents)
+        compact_index.pack()
+        self.assertTrue(all(isinstance(postings, PackedPostings) for postings in compact_index.index.values()))
+        self.assertEqual(len(compact_index.packed_entries), sum(len(terms) for terms in self.documents.values()))
+        self.assertSameIndex(inv_index, compact_index)
+
+        postings = compact_index.get_postings("term1")
+        self.assertIn("doc1", postings)
+        self.assertNotIn("doc2", postings)
+        self.assertNotIn("missing", postings)
+        self.assertEqual(postings["doc1"], inv_index.get_postings("term1")["doc1"])
+        self.assertEqual(list(postings.doc_numbers()), sorted(postings.doc_numbers()))
+
+    def test_updates_after_packing(self):
+        inv_index = build_index(InvertedIndex, self.documents)
+        compact_index = build_index(CompactInvertedIndex, self.documents)
+        compact_index.pack()
+        for index in (inv_index, compact_index):
+            index.add_documents("doc1", {"term1": 2, "new": 1})
+            index.add_documents("extra", {"term2": 1})
+            index.delete_document("doc5", self.documents["doc5"])
+            index.delete_document("doc6")
+            index.purge_deleted()
+        self.assertSameIndex(inv_index, compact_index)
+
+    def test_pickle(self):
+        inv_index = build_index(InvertedIndex, self.documents)
+        compact_index = build_index(CompactInvertedIndex, self.documents)
+        compact_index.add_documents("extra", {"term2": 1})
+        compact_index.pack()
+        compact_index.add_documents("doc1", {"term3": 1})
+        inv_index.add_documents("extra", {"term2": 1})
+        inv_index.add_documents("doc1", {"term3": 1})
+
+        loaded = pickle.loads(pickle.dumps(compact_index))
+        self.assertSameIndex(inv_index, loaded)
+        self.assertEqual(loaded.doc_numbers, compact_index.doc_numbers)
+        self.assertLess(len(pickle.dumps(compact_index)), len(pickle.dumps(inv_index)))
+
+        compact_index.compress()
+        self.assertSameIndex(inv_index, pickle.loads(pickle.dumps(compact_index)))
+
+
+if __name__ == "__main__":
+    unittest.main()
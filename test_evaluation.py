@@ -0,0 +1,103 @@
+import os
+import tempfile
+import unittest
+
+from evaluation import Evaluator, load_qrels, load_run
+
+# Checks the measures of a small fixed run against the values trec_eval gives for it (map, ndcg_cut_10, P_10, recall_100).
+# The reference values were worked out by hand from the definitions of trec_eval 9 and are given as the fractions they come from.
+# Run with: python -m unittest test_evaluation
+
+QRELS = """query-id\tcorpus-id\tscore
+q1\td1\t1
+q1\td3\t2
+q1\td7\t1
+q1\td9\t1
+q2\td2\t1
+q2\td5\t0
+q3\td4\t1
+"""
+
+# The rank column is ignored by trec_eval: the documents are sorted by decreasing score, then by decreasing document ID.
+# d1 and d2 (q1) and d2 and d5 (q2) have the same score, and the rank column gives them the opposite order.
+# q3 has no ranked documents and q4 has no relevance judgements, so neither is evaluated.
+RUN = """q1 Q0 d3 1 9.0 test
+q1 Q0 d1 2 7.5 test
+q1 Q0 d2 3 7.5 test
+q1 Q0 d4 4 6.0 test
+q1 Q0 d5 5 5.0 test
+q1 Q0 d6 6 4.0 test
+q1 Q0 d8 7 3.5 test
+q1 Q0 d11 8 3.0 test
+q1 Q0 d12 9 2.5 test
+q1 Q0 d13 10 2.0 test
+q1 Q0 d7 11 1.0 test
+q2 Q0 d2 1 4.0 test
+q2 Q0 d5 2 4.0 test
+q2 Q0 d9 3 1.0 test
+q4 Q0 d1 1 1.0 test
+"""
+
+LOG2_3 = 1.584962500721156
+LOG2_5 = 2.321928094887362
+
+# q1 is ranked d3 (relevance 2), d2, d1 (1), 7 non-relevant documents, d7 (1); d9 (1) is not retrieved
+# q2 is ranked d5 (judged non-relevant), d2 (1), d9
+EXPECTED_PER_QUERY = {
+    "map": {"q1": (1 / 1 + 2 / 3 + 3 / 11) / 4, "q2": (1 / 2) / 1},
+    "ndcg_cut_10": {"q1": (2 + 1 / 2) / (2 + 1 / LOG2_3 + 1 / 2 + 1 / LOG2_5), "q2": (1 / LOG2_3) / 1},
+    "P_10": {"q1": 2 / 10, "q2": 1 / 10},
+    "recall_100": {"q1": 3 / 4, "q2": 1 / 1},
+}
+
+# The means over q1 and q2, rounded to 4 decimals like the output of trec_eval -m map -m ndcg_cut.10 -m P.10 -m recall.100
+EXPECTED = {"map": 0.4924, "ndcg_cut_10": 0.6664, "P_10": 0.1500, "recall_100": 0.8750, "num_q": 2}
+
+
+class EvaluationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.qrels_path = os.path.join(self.directory.name, "qrels.tsv")
+        self.run_path = os.path.join(self.directory.name, "run.txt")
+        with open(self.qrels_path, "w") as file:
+            file.write(QRELS)
+        with open(self.run_path, "w") as file:
+            file.write(RUN)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_load_run_ties(self):
+        rankings = load_run(self.run_path)
+        self.assertEqual([doc_id for doc_id, _ in rankings["q1"][:4]], ["d3", "d2", "d1", "d4"])
+        self.assertEqual([doc_id for doc_id, _ in rankings["q2"]], ["d5", "d2", "d9"])
+        self.assertEqual(rankings["q1"][-1], ("d7", 1.0))
+
+    def test_load_qrels(self):
+        qrels = load_qrels(self.qrels_path)
+        self.assertEqual(qrels["q1"], {"d1": 1, "d3": 2, "d7": 1, "d9": 1})
+        self.assertEqual(qrels["q2"], {"d2": 1, "d5": 0})
+
+    def test_same_measures_as_trec_eval(self):
+        evaluator = Evaluator.from_file(self.qrels_path)
+        measures = evaluator.evaluate(load_run(self.run_path), per_query=True)
+
+        self.assertEqual(measures["num_q"], EXPECTED["num_q"])
+        for name, value in EXPECTED.items():
+            if name != "num_q":
+                self.assertAlmostEqual(measures[name], value, places=4, msg=name)
+        for name, values in EXPECTED_PER_QUERY.items():
+            self.assertEqual(set(measures["per_query"][name]), set(values), name)
+            for query_id, value in values.items():
+                self.assertAlmostEqual(measures["per_query"][name][query_id], value, places=12, msg=f"{name} {query_id}")
+
+    def test_document_ids_only(self):
+        # A ranking can also be a list of document IDs
+        evaluator = Evaluator.from_file(self.qrels_path)
+        rankings = {query_id: [doc_id for doc_id, _ in ranking] for query_id, ranking in load_run(self.run_path).items()}
+        self.assertAlmostEqual(evaluator.evaluate(rankings)["map"], EXPECTED["map"], places=4)
+
+
+if __name__ == "__main__":
+    unittest.main()
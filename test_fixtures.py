@@ -0,0 +1,129 @@
+import ast
+import glob
+import json
+import os
+
+import preprocessing
+from preprocessing import Document, normalization_cache
+from indexing import InvertedIndex
+from retrieve_and_rank import get_bm25_document_vector
+
+# Shared fixtures of the tests. The tests load the preprocessing resources of TEST_RESOURCES_FILE (in the format written by
+# preprocessing.build_preprocessing_resources) instead of the NLTK data, so they run without downloading anything: the NLTK English
+# stopwords with additional_stop_words, the words of the pyspellchecker dictionary found in the texts of the tests, and the root
+# word of every word of those texts. The root word of a word is the word itself (the tests compare the rankers with each other,
+# not the quality of the lemmatization); a word missing from the table would be lemmatized with WordNet.
+# Run "python test_fixtures.py" to rebuild the file after adding texts to the tests (needs the NLTK stopwords and pyspellchecker).
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+TEST_RESOURCES_FILE = os.path.join(DIRECTORY, "test_preprocessing_resources.json")
+CORPUS_FILE = os.path.join(DIRECTORY, "corpus_first_5.jsonl")
+TEST_QUERIES_FILE = os.path.join(DIRECTORY, "queries_for_test.jsonl")
+TITLES_INDEX_FILE = os.path.join(DIRECTORY, "inverted_index_titles.jsonl")
+
+# Words of the synthetic corpus (none of them is a stopword)
+VOCABULARY = ["insulin", "resistance", "obesity", "diabetes", "mice", "protein", "expression", "gene", "cells", "blood",
+              "tumor", "growth", "receptor", "signaling", "brain", "development", "vitamin", "deficiency", "risk", "treatment"]
+
+saved_resources = []
+
+def use_test_resources():
+    '''
+    Load the test resources instead of the NLTK data until restore_resources is called (e.g. as the setUpModule of a test module).
+    The normalization cache is emptied, since its tokens may have been normalized with other resources.
+    '''
+    saved_resources.append((preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas, preprocessing.resources_checked, dict(normalization_cache.terms)))
+    preprocessing.load_preprocessing_resources(TEST_RESOURCES_FILE)
+    preprocessing.resources_checked = True
+    normalization_cache.clear()
+
+def restore_resources():
+    '''Restore the resources and the normalization cache saved by the last call to use_test_resources.'''
+    preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas, preprocessing.resources_checked, terms = saved_resources.pop()
+    normalization_cache.clear()
+    normalization_cache.update(terms)
+
+def make_corpus(size=60):
+    '''
+    Returns a synthetic corpus of size documents made of the words of VOCABULARY, with repeated words and documents of
+    different lengths (so the rankings have both distinct and tied scores), as records of the corpus JSONL format.
+    '''
+    corpus = []
+    for number in range(size):
+        words = [VOCABULARY[(number * 7 + position * position) % len(VOCABULARY)] for position in range(2 + number % 9)]
+        corpus.append({"_id": str(1000 + number), "title": " ".join(words[:2]), "text": " ".join(words[2:]) + ".", "metadata": {}})
+    return corpus
+
+def write_corpus(file_path, corpus):
+    with open(file_path, "w") as file:
+        for record in corpus:
+            file.write(json.dumps(record) + "\n")
+
+def build_collection(documents: dict, delta=0.25):
+    '''
+    Index the documents and compute their BM25+ document vectors the same way main.py does.
+
+    Returns:
+        inv_index (InvertedIndex), avg_doc_length (float), document_vectors (dict)
+    '''
+    inv_index = InvertedIndex()
+    for _id, document in documents.items():
+        inv_index.add_documents(_id, document.get_index_terms())
+
+    avg_doc_length = sum(len(document.get_index_terms()) for document in documents.values()) / len(documents)
+    document_vectors = {_id: get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=delta) for _id, document in documents.items()}
+    return inv_index, avg_doc_length, document_vectors
+
+def make_documents(corpus):
+    '''Returns the Document objects of the records of a corpus, in the same order.'''
+    return {record["_id"]: Document(title=record["title"], text=record["text"], _id=record["_id"]) for record in corpus}
+
+def get_test_texts():
+    '''Returns the texts preprocessed by the tests: the corpus and queries files and every string of the test modules.'''
+    texts = []
+    with open(CORPUS_FILE) as file:
+        for line in file:
+            doc = json.loads(line)
+            texts += [doc["title"], doc["text"]]
+    with open(TEST_QUERIES_FILE) as file:
+        texts += [json.loads(line)["text"] for line in file]
+    for path in sorted(glob.glob(os.path.join(DIRECTORY, "test_*.py"))):
+        with open(path) as file:
+            tree = ast.parse(file.read())
+        texts += [node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str)]
+    return texts
+
+def build_test_resources(file_path=TEST_RESOURCES_FILE):
+    '''
+    Build the test resources from the texts of the tests.
+
+    Returns:
+        resources (dict): The saved resources
+    '''
+    from nltk.corpus import stopwords
+    from spellchecker import SpellChecker
+    stop_words = set(stopwords.words('english')).union(preprocessing.additional_stop_words)
+    spell = SpellChecker()
+
+    # The words split_token can return: the parts of the hyphenated words and the words without their hyphens
+    words = set()
+    for text in get_test_texts():
+        for token in preprocessing.word_splitter.findall(text.lower()):
+            word = preprocessing.non_letters.sub("", token)
+            words.update(word.split("-"))
+            words.add(word.replace("-", ""))
+    words.discard("")
+
+    resources = {
+        "stop_words": sorted(stop_words),
+        "spell_words": sorted(word for word in words if word in spell),
+        "lemmas": {word: word for word in sorted(words) if word not in stop_words},
+    }
+    with open(file_path, "w") as file:
+        json.dump(resources, file, indent=0)
+    return resources
+
+
+if __name__ == "__main__":
+    resources = build_test_resources()
+    print(f"Saved {len(resources['lemmas'])} root words and {len(resources['spell_words'])} spellchecker words to {TEST_RESOURCES_FILE}")
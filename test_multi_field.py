@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+
+from indexing import InvertedIndex, MultiFieldInvertedIndex
+from parallel_indexing import build_index_parallel
+from preprocessing import Document, Query
+from retrieve_and_rank import bm25f_rank_documents_for_query
+from test_fixtures import use_test_resources, restore_resources, make_corpus, write_corpus
+
+# Checks that a multi-field index has the postings of an index of the whole documents and of an index of every field, and the
+# BM25F scores against their definition.
+# Run with: python -m unittest test_multi_field
+
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+QUERIES = ["insulin resistance", "obesity diabetes mice", "protein expression of the gene", "vitamin deficiency risk", "brain"]
+
+def build_index(documents, index_class=InvertedIndex, get_terms=Document.get_index_terms):
+    inv_index = index_class()
+    for doc_id, document in documents.items():
+        inv_index.add_documents(doc_id, get_terms(document))
+    return inv_index
+
+
+class MultiFieldIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus = make_corpus(60)
+        self.documents = {record["_id"]: Document(title=record["title"], text=record["text"], _id=record["_id"], keep_fields=True) for record in self.corpus}
+        self.inv_index = MultiFieldInvertedIndex()
+        for doc_id, document in self.documents.items():
+            self.inv_index.add_fields(doc_id, document.field_index_terms)
+        self.queries = [Query(_id=str(number), query=text) for number, text in enumerate(QUERIES)]
+
+    def assertSamePostings(self, inv_index, expected):
+        self.assertEqual(sorted(term for term, postings in inv_index.index.items() if postings), sorted(term for term, postings in expected.index.items() if postings))
+        for term in expected.index:
+            self.assertEqual(dict(inv_index.get_postings(term)), dict(expected.get_postings(term)), term)
+        self.assertEqual(inv_index.get_document_count(), expected.get_document_count())
+        self.assertEqual(inv_index.get_avg_unique_terms(), expected.get_avg_unique_terms())
+
+    def test_fields_and_whole_documents(self):
+        # The index terms of the fields add up to the ones of the whole document
+        for record in self.corpus:
+            self.assertEqual(self.documents[record["_id"]].get_index_terms(), Document(title=record["title"], text=record["text"], _id=record["_id"]).get_index_terms())
+        self.assertSamePostings(self.inv_index, build_index(self.documents))
+        for field in ("title", "text"):
+            self.assertSamePostings(self.inv_index.get_field_index(field), build_index(self.documents, get_terms=lambda document: document.get_field_terms(field)))
+
+    def test_updates(self):
+        doc_id = next(iter(self.documents))
+        self.inv_index.update_document(doc_id, {"title": {"brain": 2}, "text": {"insulin": 1}})
+        self.assertEqual(self.inv_index.get_field_index("title").get_postings("brain")[doc_id], 2)
+        self.assertEqual(self.inv_index.get_postings("insulin")[doc_id], 1)
+        self.assertNotIn(doc_id, self.inv_index.get_field_index("title").get_postings("insulin"))
+        with self.assertRaises(ValueError):
+            self.inv_index.update_document(doc_id, {"abstract": {"brain": 1}})
+
+        self.inv_index.delete_document(doc_id)
+        self.assertNotIn(doc_id, self.inv_index.get_postings("brain"))
+        for field in ("title", "text"):
+            self.assertEqual(self.inv_index.get_field_index(field).get_document_count(), len(self.documents) - 1)
+
+    def test_parallel_build(self):
+        with tempfile.TemporaryDirectory() as directory:
+            corpus_path = os.path.join(directory, "corpus.jsonl")
+            write_corpus(corpus_path, self.corpus)
+            parallel_index, _ = build_index_parallel(corpus_path, workers=2, batch_size=7, index_class=MultiFieldInvertedIndex)
+        self.assertSamePostings(parallel_index, self.inv_index)
+        for field in ("title", "text"):
+            self.assertSamePostings(parallel_index.get_field_index(field), self.inv_index.get_field_index(field))
+
+    def test_bm25f_scores(self):
+        k1, delta = 1.8, 1.0
+        total_documents = len(self.documents)
+        for query in self.queries:
+            # Without length normalization and with the same weight for every field, the pseudo term frequency is the term
+            # frequency of the whole document
+            expected = {}
+            for doc_id, document in self.documents.items():
+                for term in query.get_index_terms():
+                    term_freq = document.get_index_terms().get(term, 0)
+                    if term_freq:
+                        idf = self.inv_index.get_idf(term, total_documents)
+                        expected[doc_id] = expected.get(doc_id, 0) + ((term_freq + delta) * idf) / (k1 + term_freq)
+            expected = {doc_id: score for doc_id, score in expected.items() if score > 0}
+
+            actual = bm25f_rank_documents_for_query(query, self.inv_index, {"title": 1.0, "text": 1.0}, k1=k1, b=0, delta=delta, top_n=None)
+            self.assertEqual(dict(actual), expected, query.get_query())
+            self.assertEqual([score for _, score in actual], sorted(expected.values(), reverse=True))
+
+            # A field with a weight of 0 does not contribute
+            titles = bm25f_rank_documents_for_query(query, self.inv_index, {"title": 1.0, "text": 0}, k1=k1, b={"title": 0.5, "text": 0.75}, delta=delta, top_n=None)
+            title_documents = {doc_id for term in query.get_index_terms() for doc_id in self.inv_index.get_field_index("title").get_postings(term)}
+            self.assertEqual({doc_id for doc_id, _ in titles}, {doc_id for doc_id in title_documents if doc_id in expected})
+
+
+if __name__ == "__main__":
+    unittest.main()
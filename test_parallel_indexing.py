@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import unittest
+
+import preprocessing
+from indexing import MultiFieldInvertedIndex
+from preprocessing import normalization_cache
+from parallel_indexing import build_index_parallel
+
+# Checks that the parallel index builder gives the same index as a single process, and that the tokens normalized by the worker
+# processes end up in the normalization cache of the parent process. A built index only tracks the changes made after the build.
+# Run with: python -m unittest test_parallel_indexing
+
+CORPUS = [
+    {"_id": "1", "title": "Insulin resistance", "text": "Insulin resistance in obese mice.", "metadata": {}},
+    {"_id": "2", "title": "Obesity", "text": "Obesity and the risk of diabetes.", "metadata": {}},
+    {"_id": "3", "title": "Diabetes", "text": "Insulin treatment of diabetes.", "metadata": {}},
+    {"_id": "4", "title": "Mice", "text": "Body-mass of obese mice.", "metadata": {}},
+]
+
+RESOURCES = {
+    "stop_words": sorted(preprocessing.additional_stop_words),
+    "spell_words": ["body", "mass"],
+    "lemmas": {"insulin": "insulin", "resistance": "resistance", "obese": "obese", "mice": "mouse", "obesity": "obesity",
+               "risk": "risk", "diabetes": "diabetes", "treatment": "treatment", "body": "body", "mass": "mass"},
+}
+
+
+class ParallelIndexingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.corpus_path = os.path.join(self.directory.name, "corpus.jsonl")
+        with open(self.corpus_path, "w") as file:
+            for doc in CORPUS:
+                file.write(json.dumps(doc) + "\n")
+
+        # The worker processes are forked from this one, so they get the same resources without NLTK
+        resources_path = os.path.join(self.directory.name, "resources.json")
+        with open(resources_path, "w") as file:
+            json.dump(RESOURCES, file)
+        self.saved_resources = (preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas)
+        preprocessing.load_preprocessing_resources(resources_path)
+        self.saved_terms = dict(normalization_cache.terms)
+        normalization_cache.clear()
+
+    def tearDown(self):
+        preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas = self.saved_resources
+        normalization_cache.clear()
+        normalization_cache.update(self.saved_terms)
+        self.directory.cleanup()
+
+    def test_same_index_as_single_process(self):
+        inv_index, _ = build_index_parallel(self.corpus_path, workers=1)
+        parallel_index, _ = build_index_parallel(self.corpus_path, workers=2, batch_size=1)
+        self.assertEqual(list(parallel_index.doc_stats), list(inv_index.doc_stats))
+        self.assertEqual(sorted(parallel_index.index), sorted(inv_index.index))
+        for term in inv_index.index:
+            self.assertEqual(dict(parallel_index.get_postings(term)), dict(inv_index.get_postings(term)), term)
+
+    def test_build_not_tracked_as_changes(self):
+        for workers in (1, 2):
+            for index_class in (None, MultiFieldInvertedIndex):
+                kwargs = {"index_class": index_class} if index_class else {}
+                inv_index, _ = build_index_parallel(self.corpus_path, workers=workers, batch_size=1, **kwargs)
+                indexes = [inv_index] + list(getattr(inv_index, "fields", {}).values())
+                self.assertTrue(all(not index.changed_terms and not index.changed_docs for index in indexes), (workers, index_class))
+
+                if index_class:
+                    inv_index.add_fields("5", {"title": {"brain": 1}, "text": {"insulin": 1}})
+                else:
+                    inv_index.add_documents("5", {"brain": 1, "insulin": 1})
+                self.assertEqual(inv_index.changed_terms, {"brain", "insulin"})
+                self.assertEqual(inv_index.changed_docs, {"5"})
+
+    def test_worker_tokens_added_to_cache(self):
+        build_index_parallel(self.corpus_path, workers=2, batch_size=1)
+        self.assertEqual(normalization_cache.terms.get("mice"), ("mouse",))
+        self.assertEqual(normalization_cache.terms.get("body-mass"), ("body", "mass"))
+        self.assertEqual(normalization_cache.terms.get("the"), ())
+        self.assertIsNone(normalization_cache.new_terms)
+
+    def test_update_respects_maxsize(self):
+        cache = preprocessing.NormalizationCache(maxsize=2)
+        cache.update({"a": (), "b": ("b",), "c": ("c",)})
+        self.assertEqual(list(cache.terms), ["b", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+from evaluation import Evaluator
+from parameter_sweep import ParameterSweep, make_grid, run_sweep
+from preprocessing import Query
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+from test_fixtures import use_test_resources, restore_resources, build_collection, make_corpus, make_documents
+
+# Checks that every point of the parameter sweep gives the rankings of the term-at-a-time scorer and the measures of the evaluator
+# for those rankings, in one process and across processes.
+# Run with: python -m unittest test_parameter_sweep
+
+# The sweep worker processes are forked from this one, so they get the same resources
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+QUERIES = ["insulin resistance", "obesity diabetes mice", "protein expression of the gene", "vitamin deficiency risk", "brain", "no such words"]
+
+GRID = make_grid([0.6, 1.2, 1.8], [0.25, 1.0], [0.0, 1.0])
+
+
+class ParameterSweepTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.documents = make_documents(make_corpus(60))
+        cls.inv_index, cls.avg_doc_length, cls.document_vectors = build_collection(cls.documents)
+        cls.queries = [Query(_id=str(number), query=text) for number, text in enumerate(QUERIES)]
+        # Every third document is relevant to the first four queries, with grades 1 and 2; the last queries have no judgements
+        doc_ids = list(cls.documents)
+        qrels = {str(number): {doc_id: 1 + position % 2 for position, doc_id in enumerate(doc_ids[number::3])} for number in range(4)}
+        cls.evaluator = Evaluator(qrels)
+        cls.sweep = ParameterSweep(cls.queries, cls.inv_index, cls.documents, cls.document_vectors, cls.avg_doc_length, cls.evaluator, top_n=10)
+
+    def rank(self, k1, b, delta):
+        return {query.get_id(): bm25_taat_rank_documents_for_query(query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length, k1=k1, b=b, delta=delta, top_n=10)
+                for query in self.queries}
+
+    def assertSameMeasures(self, actual, expected):
+        self.assertEqual(set(actual), set(expected))
+        self.assertEqual(actual["num_q"], expected["num_q"])
+        for name, value in expected.items():
+            self.assertAlmostEqual(actual[name], value, places=12, msg=name)
+
+    def test_same_rankings_as_taat(self):
+        for k1, b, delta in GRID:
+            self.assertEqual(self.sweep.rankings(k1, b, delta), self.rank(k1, b, delta), (k1, b, delta))
+
+    def test_same_measures_as_evaluator(self):
+        for k1, b, delta in GRID:
+            expected = self.evaluator.evaluate(self.rank(k1, b, delta))
+            self.assertEqual(expected["num_q"], 4)
+            self.assertSameMeasures(self.sweep.evaluate(k1, b, delta), expected)
+
+    def test_run_sweep(self):
+        results = run_sweep(self.sweep, GRID, workers=1)
+        self.assertEqual([(result["k1"], result["b"], result["delta"]) for result in results], GRID)
+        parallel_results = run_sweep(self.sweep, GRID, workers=2, chunk_size=3)
+        for result, parallel_result in zip(results, parallel_results):
+            self.assertSameMeasures(parallel_result, result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import unittest
+
+from preprocessing import Query, extract_index_terms, extract_index_term_positions
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+from positional_index import (PositionalIndex, LazyPositionalIndex, build_positional_index, get_phrase_terms, find_phrase, compute_proximity,
+                              positional_rank_documents_for_query)
+from test_fixtures import use_test_resources, restore_resources, build_collection, make_corpus, make_documents, write_corpus
+
+# Checks the positions of the index terms, that a saved positional index is read back the same, the phrase matches against a
+# scan of the documents and that the phrase and proximity ranking only filters and boosts the BM25+ rankings.
+# Run with: python -m unittest test_positional_index
+
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+PHRASES = ["insulin resistance", "growth insulin", "risk gene risk"]
+
+
+class PositionalIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.corpus_path = os.path.join(cls.directory.name, "corpus.jsonl")
+        cls.corpus = make_corpus(60)
+        write_corpus(cls.corpus_path, cls.corpus)
+        cls.positional_index = build_positional_index(cls.corpus_path)
+        cls.documents = make_documents(cls.corpus)
+        cls.inv_index, cls.avg_doc_length, cls.document_vectors = build_collection(cls.documents)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def get_text(self, record):
+        return record["title"] + " " + record["text"]
+
+    def test_positions(self):
+        self.assertEqual(extract_index_term_positions("Insulin of the insulin-resistance, 10 mice."), {"insulin": [0, 3], "resistance": [4], "mice": [5]})
+        for record in self.corpus:
+            term_positions = extract_index_term_positions(self.get_text(record))
+            # Same terms as the inverted index, as many positions as the term frequency
+            self.assertEqual({term: len(positions) for term, positions in term_positions.items()}, extract_index_terms(self.get_text(record)))
+            for term, positions in term_positions.items():
+                self.assertEqual(self.positional_index.get_positions(term, record["_id"]), positions)
+
+    def test_saved_index(self):
+        base_path = os.path.join(self.directory.name, "positions")
+        self.positional_index.save(base_path)
+        lazy_index = LazyPositionalIndex(base_path, max_decoded_postings=10)
+        try:
+            self.assertEqual(len(lazy_index), len(self.positional_index))
+            for term in self.positional_index.postings:
+                self.assertEqual(lazy_index.get_doc_positions(term), self.positional_index.get_doc_positions(term), term)
+            self.assertEqual(lazy_index.get_doc_positions("missing"), {})
+            # The cache of decoded positional postings stays bounded
+            self.assertLessEqual(len(lazy_index.decoded), 10)
+        finally:
+            lazy_index.close()
+
+        empty = PositionalIndex()
+        empty.save(base_path)
+        lazy_index = LazyPositionalIndex(base_path)
+        self.assertEqual(lazy_index.get_doc_positions("insulin"), {})
+        lazy_index.close()
+
+    def test_phrases(self):
+        for phrase in PHRASES:
+            # Every word of the synthetic corpus is an index term, so a phrase is found where its words follow each other
+            phrase_words = phrase.split()
+            expected = {}
+            for record in self.corpus:
+                words = self.get_text(record).replace(".", "").split()
+                matches = sum(words[start:start + len(phrase_words)] == phrase_words for start in range(len(words)))
+                if matches:
+                    expected[record["_id"]] = matches
+            self.assertTrue(expected, phrase)
+            self.assertEqual(find_phrase(get_phrase_terms(phrase), self.positional_index), expected, phrase)
+
+        # A stopword takes a position, so "deficiency of mice" is not found in "deficiency mice"
+        self.assertEqual(get_phrase_terms("deficiency of mice"), [("deficiency", 0), ("mice", 2)])
+        self.assertEqual(find_phrase([], self.positional_index), {})
+
+    def test_proximity(self):
+        self.assertEqual(compute_proximity([0], [1]), 1)
+        self.assertEqual(compute_proximity([0, 10], [2, 11], window=5), 1 / 4 + 1)
+        self.assertEqual(compute_proximity([0], [6], window=5), 0)
+
+    def test_rankings(self):
+        def rank(query, **kwargs):
+            return positional_rank_documents_for_query(query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                                       self.positional_index, k1=1.8, b=1.0, delta=1.0, **kwargs)
+
+        query = Query(_id="1", query="insulin resistance growth")
+        expected = bm25_taat_rank_documents_for_query(query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length, k1=1.8, b=1.0, delta=1.0, top_n=None)
+        # Without phrases or proximity, the rankings are the BM25+ ones
+        self.assertEqual(rank(query, top_n=None), expected)
+
+        phrase_query = Query(_id="2", query='"insulin resistance" growth')
+        phrase_freqs = find_phrase(get_phrase_terms("insulin resistance"), self.positional_index)
+        phrase_expected = bm25_taat_rank_documents_for_query(phrase_query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length, k1=1.8, b=1.0, delta=1.0, top_n=None)
+        self.assertEqual(rank(phrase_query, top_n=None), [(doc_id, score) for doc_id, score in phrase_expected if doc_id in phrase_freqs])
+
+        # The proximity boost is below its weight and only added to the documents with several query terms
+        scores = dict(expected)
+        boosted = dict(rank(query, top_n=None, proximity_weight=0.1))
+        self.assertEqual(set(boosted), set(scores))
+        self.assertTrue(all(0 <= boosted[doc_id] - scores[doc_id] < 0.1 for doc_id in scores))
+        self.assertTrue(any(boosted[doc_id] > scores[doc_id] for doc_id in scores))
+
+
+if __name__ == "__main__":
+    unittest.main()
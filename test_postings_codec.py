@@ -0,0 +1,96 @@
+import pickle
+import unittest
+
+from indexing import CompactInvertedIndex
+from postings_codec import vbyte_encode, vbyte_decode, encode_postings, CompressedPostings, intersect_postings
+
+# Checks that compressed postings lists decode to the postings they were encoded from, and the seek and intersection over them.
+# Run with: python -m unittest test_postings_codec
+
+def make_postings(step, count, start=0):
+    doc_numbers = list(range(start, start + step * count, step))
+    frequencies = [1 + doc_number % 5 for doc_number in doc_numbers]
+    return doc_numbers, frequencies
+
+def build_index(documents=1000):
+    # Every document has the terms of the numbers that divide its number
+    inv_index = CompactInvertedIndex()
+    for number in range(documents):
+        inv_index.add_documents(f"doc{number}", {f"multiple_of_{divisor}": 1 + number % 3 for divisor in (1, 2, 3, 7, 50) if number % divisor == 0})
+    return inv_index
+
+
+class PostingsCodecTest(unittest.TestCase):
+
+    def test_vbyte_round_trip(self):
+        numbers = [0, 1, 127, 128, 255, 16383, 16384, 2**32 - 1, 2**40]
+        data = bytearray()
+        vbyte_encode(numbers, data)
+        self.assertEqual(len(data), 1 + 1 + 1 + 2 + 2 + 2 + 3 + 5 + 6)
+        self.assertEqual(vbyte_decode(data, 0, len(numbers)), (numbers, len(data)))
+        # Decoding can start at any integer
+        self.assertEqual(vbyte_decode(data, 3, 2), ([128, 255], 7))
+
+    def test_blocks_and_skip_table(self):
+        doc_numbers, frequencies = make_postings(3, 300, start=5)
+        skip_docs, skip_offsets, data = encode_postings(doc_numbers, frequencies, block_size=128)
+        self.assertEqual(list(skip_docs), [doc_numbers[127], doc_numbers[255], doc_numbers[-1]])
+        self.assertEqual(skip_offsets[0], 0)
+        self.assertEqual(list(skip_offsets), sorted(skip_offsets))
+
+        postings = CompressedPostings.from_postings(None, doc_numbers, frequencies, block_size=128)
+        self.assertEqual(len(postings), 300)
+        self.assertEqual(list(postings.doc_numbers()), doc_numbers)
+        self.assertEqual(list(postings.frequencies()), frequencies)
+        # The serialized postings list decodes the same
+        restored = CompressedPostings.from_bytes(None, len(postings), postings.to_bytes(), block_size=128)
+        self.assertEqual(list(restored.doc_numbers()), doc_numbers)
+        self.assertEqual(list(restored.frequencies()), frequencies)
+
+    def test_seek(self):
+        doc_numbers, frequencies = make_postings(10, 400)
+        postings = CompressedPostings.from_postings(None, doc_numbers, frequencies, block_size=16)
+        self.assertEqual(postings.seek(0), (0, frequencies[0]))
+        self.assertEqual(postings.seek(11), (20, frequencies[2]))
+        self.assertEqual(postings.seek(3990), (3990, frequencies[-1]))
+        self.assertIsNone(postings.seek(3991))
+        self.assertEqual(postings.get_frequency(170), frequencies[17])
+        self.assertEqual(postings.get_frequency(171), 0)
+        # Only the block of the document is decoded
+        postings.seek(2000)
+        self.assertEqual(postings.cached_block, 2000 // 10 // 16)
+
+    def test_intersection(self):
+        lists = [make_postings(step, 1000 // step) for step in (2, 3, 7)]
+        compressed = [CompressedPostings.from_postings(None, doc_numbers, frequencies, block_size=8) for doc_numbers, frequencies in lists]
+        expected = sorted(set.intersection(*(set(doc_numbers) for doc_numbers, _ in lists)))
+        self.assertEqual(intersect_postings(compressed), expected)
+        self.assertEqual(intersect_postings(compressed[:1]), lists[0][0])
+        self.assertEqual(intersect_postings([]), [])
+
+    def test_compressed_index(self):
+        inv_index = build_index()
+        expected = {term: inv_index.get_postings(term).items() for term in inv_index.index}
+        inv_index.compress(block_size=32)
+        self.assertTrue(all(isinstance(postings, CompressedPostings) for postings in inv_index.index.values()))
+        for term, items in expected.items():
+            postings = inv_index.get_postings(term)
+            self.assertEqual(postings.items(), items, term)
+            self.assertEqual(list(postings), [doc_id for doc_id, _ in items], term)
+        postings = inv_index.get_postings("multiple_of_7")
+        self.assertEqual(postings["doc14"], 1 + 14 % 3)
+        self.assertNotIn("doc15", postings)
+        self.assertNotIn("missing", postings)
+        with self.assertRaises(KeyError):
+            postings["doc15"]
+
+        # A compressed postings list is decompressed when it is updated, and a compressed index can be pickled
+        inv_index.add_documents("doc1000", {"multiple_of_7": 2})
+        self.assertEqual(inv_index.get_postings("multiple_of_7").items(), expected["multiple_of_7"] + [("doc1000", 2)])
+        loaded = pickle.loads(pickle.dumps(inv_index))
+        for term in expected:
+            self.assertEqual(loaded.get_postings(term).items(), inv_index.get_postings(term).items(), term)
+
+
+if __name__ == "__main__":
+    unittest.main()
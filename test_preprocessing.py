@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import preprocessing
+from preprocessing import NormalizationCache, extract_index_terms, normalize_token, is_hyphenated_compound_word, lemmatize
+from doc_utils import load_jsonl
+from benchmarks import reference_extract_index_terms
+from test_fixtures import use_test_resources, restore_resources, get_test_texts, TEST_RESOURCES_FILE, CORPUS_FILE
+
+# Checks that the single pass tokenizer gives the same term dictionaries as the previous pipeline, that the prebuilt resources
+# are loaded without NLTK and give the same index terms as the spellchecker and WordNet.
+# Run with: python -m unittest test_preprocessing
+
+TRICKY_TEXTS = [
+    "I like to read.I like hats.",
+    "Body-mass index and pre-diabetes: a cross-sectional study of obese mice",
+    "Insulin's effects (in vivo) on β-cells, a 10-fold increase!!",
+    "Tabs\tand\nnewlines  and   spaces between   words",
+    "A backslash \\n is not a newline",
+    "Myeloid-derived suppressor cells -- and dashes - alone",
+    "Café naïve résumé",
+    "   ",
+    "",
+]
+
+HYPHENATED_WORDS = ["body-mass", "pre-diabetes", "cross-sectional", "myeloid-derived", "in-vivo", "mice-insulin"]
+
+def has_spellchecker():
+    try:
+        import spellchecker
+    except ImportError:
+        return False
+    return True
+
+def has_nltk_data():
+    '''Returns True if the NLTK stopwords and WordNet are installed and pyspellchecker can be imported.'''
+    try:
+        import nltk
+        nltk.data.find("corpora/stopwords")
+        nltk.data.find("corpora/wordnet")
+    except (ImportError, LookupError):
+        return False
+    return has_spellchecker()
+
+
+class PreprocessingTest(unittest.TestCase):
+
+    def setUp(self):
+        use_test_resources()
+
+    def tearDown(self):
+        restore_resources()
+
+    def test_same_terms_as_previous_pipeline(self):
+        cache = NormalizationCache()
+        for text in get_test_texts() + TRICKY_TEXTS:
+            # Same terms, frequencies and order
+            self.assertEqual(list(extract_index_terms(text, cache).items()), list(reference_extract_index_terms(text, cache).items()), text)
+
+    def test_resources_loaded_without_nltk(self):
+        with mock.patch.object(preprocessing, "resources_path", TEST_RESOURCES_FILE):
+            preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas, preprocessing.resources_checked = None, None, None, False
+            self.assertIn("the", preprocessing.get_stop_words())
+            self.assertIsInstance(preprocessing.get_spell_checker(), frozenset)
+            self.assertEqual(lemmatize("insulin"), "insulin")
+        self.assertFalse(preprocessing.load_preprocessing_resources(os.path.join(tempfile.gettempdir(), "missing_resources.json")))
+
+    def test_lemma_table_before_wordnet(self):
+        preprocessing.lemmas = dict(preprocessing.lemmas, mice="mouse")
+        preprocessing.lemmas.pop("unlisted", None)
+        with mock.patch.object(preprocessing, "lemmatize_with_wordnet", side_effect=lambda word: word + "_wordnet") as lemmatize_with_wordnet:
+            self.assertEqual(normalize_token("mice"), ("mouse",))
+            self.assertEqual(normalize_token("Body-mass".lower()), ("body", "mass"))
+            lemmatize_with_wordnet.assert_not_called()
+            # A word missing from the table is lemmatized with WordNet
+            self.assertEqual(lemmatize("unlisted"), "unlisted_wordnet")
+            lemmatize_with_wordnet.assert_called_once_with("unlisted")
+
+    @unittest.skipUnless(has_spellchecker(), "needs pyspellchecker")
+    def test_spell_words_same_as_spellchecker(self):
+        from spellchecker import SpellChecker
+        expected = {}
+        with mock.patch.object(preprocessing, "spell", SpellChecker()):
+            for word in HYPHENATED_WORDS:
+                expected[word] = is_hyphenated_compound_word(word)
+        self.assertTrue(expected["body-mass"])
+        self.assertEqual({word: is_hyphenated_compound_word(word) for word in HYPHENATED_WORDS}, expected)
+
+    @unittest.skipUnless(has_nltk_data(), "needs the NLTK stopwords, WordNet and pyspellchecker")
+    def test_root_words_same_as_wordnet(self):
+        texts = [doc["title"] + " " + doc["text"] for doc in load_jsonl(CORPUS_FILE)]
+        tokens = sorted({token for text in texts for token in preprocessing.word_splitter.findall(text.lower())})
+        with tempfile.TemporaryDirectory() as directory:
+            resources = preprocessing.build_preprocessing_resources(os.path.join(directory, "resources.json"), CORPUS_FILE)
+
+        preprocessing.lemmas = None
+        expected = [normalize_token(token) for token in tokens]
+        preprocessing.lemmas = resources["lemmas"]
+        with mock.patch.object(preprocessing, "lemmatize_with_wordnet", side_effect=AssertionError("WordNet was used")):
+            self.assertEqual([normalize_token(token) for token in tokens], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
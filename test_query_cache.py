@@ -0,0 +1,82 @@
+import gc
+import unittest
+
+from indexing import InvertedIndex
+from query_cache import QueryResultCache, cached_rank_documents_for_query
+
+# Checks that the query result cache never returns the ranking computed from another index or other document vectors.
+# Run with: python -m unittest test_query_cache
+
+class IndexTermsQuery:
+    '''Query whose index terms are given, so the cache can be tested without preprocessing.'''
+
+    def __init__(self, index_terms):
+        self.index_terms = index_terms
+
+    def get_index_terms(self):
+        return self.index_terms
+
+
+def rank_by_postings(query, inverted_index, document_vectors, documents, avg_doc_length, k1, b, delta, top_n):
+    '''Ranks the documents by the number of query terms they contain (a stand-in for the BM25+ ranking functions).'''
+    scores = {}
+    for term in query.get_index_terms():
+        for doc_id in inverted_index.get_postings(term):
+            scores[doc_id] = scores.get(doc_id, 0) + document_vectors.get(doc_id, 1)
+    return sorted(scores.items(), key=lambda item: -item[1])[:top_n]
+
+def build_index(doc_ids):
+    inv_index = InvertedIndex()
+    for doc_id in doc_ids:
+        inv_index.add_documents(doc_id, {"insulin": 1})
+    return inv_index
+
+
+class QueryResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.document_vectors = {}
+
+    def rank(self, cache, inv_index, document_vectors=None):
+        if document_vectors is None:
+            document_vectors = self.document_vectors
+        return cached_rank_documents_for_query(IndexTermsQuery({"insulin": 1}), inv_index, document_vectors, {}, 1.0,
+                                               cache=cache, rank_function=rank_by_postings)
+
+    def test_indexes_with_same_version(self):
+        cache = QueryResultCache()
+        first, second = build_index(["a", "b"]), build_index(["c", "d"])
+        self.assertEqual(first.version, second.version)
+        self.assertEqual(self.rank(cache, first), [("a", 1), ("b", 1)])
+        self.assertEqual(self.rank(cache, second), [("c", 1), ("d", 1)])
+        self.assertEqual(cache.stats()["hits"], 0)
+        self.assertEqual(self.rank(cache, first), [("a", 1), ("b", 1)])
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_collected_index(self):
+        cache = QueryResultCache()
+        for doc_ids in (["a"], ["b"], ["c"]):
+            # Every index is garbage collected before the next one is built, so they may get the same id
+            self.assertEqual(self.rank(cache, build_index(doc_ids)), [(doc_ids[0], 1)])
+            gc.collect()
+        self.assertEqual(cache.stats()["hits"], 0)
+        self.assertEqual(cache.index_versions, {})
+
+    def test_different_document_vectors(self):
+        cache = QueryResultCache()
+        inv_index = build_index(["a", "b"])
+        self.assertEqual(self.rank(cache, inv_index, {"a": 1, "b": 2}), [("b", 2), ("a", 1)])
+        self.assertEqual(self.rank(cache, inv_index, {"a": 3, "b": 2}), [("a", 3), ("b", 2)])
+        self.assertEqual(cache.stats()["hits"], 0)
+
+    def test_changed_index(self):
+        cache = QueryResultCache()
+        inv_index = build_index(["a"])
+        self.rank(cache, inv_index)
+        inv_index.add_documents("b", {"insulin": 1})
+        self.assertEqual(self.rank(cache, inv_index), [("a", 1), ("b", 1)])
+        self.assertEqual(cache.invalidations, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
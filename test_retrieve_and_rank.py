@@ -0,0 +1,149 @@
+import contextlib
+import io
+import unittest
+
+from doc_utils import load_jsonl, load_inverted_index_jsonl, get_stored_documents
+from matrix_ranking import BM25Matrix
+from preprocessing import Document, Query
+from retrieve_and_rank import get_bm25_document_vector, get_document_magnitudes, bm25_rank_documents_for_query, bm25_taat_rank_documents_for_query, bm25_maxscore_rank_documents_for_query, bm25_batch_rank_documents_for_queries
+
+from test_fixtures import use_test_resources, restore_resources, build_collection, CORPUS_FILE, TEST_QUERIES_FILE, TITLES_INDEX_FILE
+
+# Checks that the faster ranking functions return exactly the same rankings (documents, scores and order) as the original scorer,
+# on corpus_first_5.jsonl and on the SciFact titles index with the SciFact test queries.
+# Run with: python -m unittest test_retrieve_and_rank
+
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+# The original scorer scores every document for every query, so it is only run on every SCIFACT_ORIGINAL_STEP-th test query
+# (the faster scorers are compared with each other on all of them)
+SCIFACT_ORIGINAL_STEP = 6
+
+QUERIES = [
+    "Development of the cerebral white matter of newborns",
+    "Myeloid-derived suppressor cells induce myelodysplasia",
+    "DNA methylation of human blood cells",
+    "Expression of the myelin basic protein gene",
+    "RNA transcript of a master gene",
+    "human cells",
+    "no matching words whatsoever",
+]
+
+class RankingParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.documents = {doc["_id"]: Document(title=doc["title"], text=doc["text"], _id=doc["_id"]) for doc in load_jsonl(CORPUS_FILE)}
+        cls.inv_index, cls.avg_doc_length, cls.document_vectors = build_collection(cls.documents)
+        cls.queries = [Query(_id=str(number), query=text) for number, text in enumerate(QUERIES)]
+
+    def rank(self, rank_function, query, collection=None, top_n=100, **kwargs):
+        documents, inv_index, avg_doc_length, document_vectors = collection or (self.documents, self.inv_index, self.avg_doc_length, self.document_vectors)
+        return rank_function(query, inv_index, document_vectors, documents, avg_doc_length, k1=1.8, b=1.0, delta=1.0, top_n=top_n, **kwargs)
+
+    def test_taat_same_rankings_as_original_scorer(self):
+        doc_magnitudes = get_document_magnitudes(self.document_vectors)
+        for query in self.queries:
+            expected = self.rank(bm25_rank_documents_for_query, query)
+            self.assertEqual(self.rank(bm25_taat_rank_documents_for_query, query), expected, query.get_query())
+            self.assertEqual(self.rank(bm25_taat_rank_documents_for_query, query, doc_magnitudes=doc_magnitudes), expected, query.get_query())
+
+    def test_batch_same_rankings_as_original_scorer(self):
+        expected = [self.rank(bm25_rank_documents_for_query, query) for query in self.queries]
+        for batch_size in (1, 2, 256):
+            actual = bm25_batch_rank_documents_for_queries(self.queries, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                                           k1=1.8, b=1.0, delta=1.0, top_n=100, batch_size=batch_size)
+            self.assertEqual(actual, expected)
+
+    def test_ties_in_corpus_order(self):
+        # "insulin obesity" and "resistance diabetes" have the same score for "resistance insulin": the original scorer ranks them in the
+        # order of the corpus, even though the term-at-a-time scorer reaches "resistance diabetes" first
+        documents = {_id: Document(title=title, text="", _id=_id) for _id, title in [("30", "insulin obesity"), ("10", "heart surgery"), ("20", "resistance diabetes"), ("5", "knee injury")]}
+        collection = (documents, *build_collection(documents))
+        query = Query(_id="ties", query="resistance insulin")
+
+        expected = self.rank(bm25_rank_documents_for_query, query, collection)
+        self.assertEqual([doc_id for doc_id, _ in expected], ["30", "20"])
+        self.assertEqual(expected[0][1], expected[1][1])
+        self.assertEqual(self.rank(bm25_taat_rank_documents_for_query, query, collection), expected)
+        _, inv_index, avg_doc_length, document_vectors = collection
+        self.assertEqual(bm25_batch_rank_documents_for_queries([query], inv_index, document_vectors, documents, avg_doc_length, k1=1.8, b=1.0, delta=1.0, top_n=100), [expected])
+
+        # With a cutoff between the tied documents, the one that comes first in the corpus is kept
+        inv_index.compute_max_scores(document_vectors)
+        for top_n in (1, 2, 100):
+            self.assertEqual(self.rank(bm25_maxscore_rank_documents_for_query, query, collection, top_n=top_n), expected[:top_n], top_n)
+
+    def test_maxscore_same_rankings_as_original_scorer(self):
+        self.inv_index.compute_max_scores(self.document_vectors)
+        for query in self.queries:
+            expected = self.rank(bm25_rank_documents_for_query, query)
+            for top_n in (1, 2, 3, 100):
+                self.assertEqual(self.rank(bm25_maxscore_rank_documents_for_query, query, top_n=top_n), expected[:top_n], query.get_query())
+
+    def test_tombstoned_documents_same_rankings_as_rebuilt_index(self):
+        # Deleting a document without its terms only tombstones it: the rankings must be the ones of an index built without it
+        deleted_id = next(iter(self.documents))
+        documents = {_id: document for _id, document in self.documents.items() if _id != deleted_id}
+        rebuilt = (documents, *build_collection(documents))
+        avg_doc_length = rebuilt[2]
+
+        inv_index, _, _ = build_collection(self.documents)
+        inv_index.delete_document(deleted_id)
+        document_vectors = {_id: get_bm25_document_vector(document, inv_index, len(documents), avg_doc_length, delta=0.25) for _id, document in documents.items()}
+        for query in self.queries:
+            self.assertEqual(self.rank(bm25_taat_rank_documents_for_query, query, (documents, inv_index, avg_doc_length, document_vectors)),
+                             self.rank(bm25_taat_rank_documents_for_query, query, rebuilt), query.get_query())
+
+
+
+class SciFactParityTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.inv_index = load_inverted_index_jsonl(TITLES_INDEX_FILE)
+        cls.documents = get_stored_documents(cls.inv_index)
+        cls.avg_doc_length = sum(len(document) for document in cls.documents.values()) / len(cls.documents)
+        cls.document_vectors = {_id: get_bm25_document_vector(document, cls.inv_index, len(cls.documents), cls.avg_doc_length, delta=0.25) for _id, document in cls.documents.items()}
+        cls.queries = [Query(_id=query["_id"], query=query["text"]) for query in load_jsonl(TEST_QUERIES_FILE)]
+        # The queries without any document would print a message for every scorer
+        with contextlib.redirect_stdout(io.StringIO()):
+            cls.taat_rankings = [cls.rank(bm25_taat_rank_documents_for_query, query) for query in cls.queries]
+
+    @classmethod
+    def rank(cls, rank_function, query, top_n=100, **kwargs):
+        return rank_function(query, cls.inv_index, cls.document_vectors, cls.documents, cls.avg_doc_length, k1=1.8, b=1.0, delta=1.0, top_n=top_n, **kwargs)
+
+    def test_taat_same_rankings_as_original_scorer(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            for query, actual in list(zip(self.queries, self.taat_rankings))[::SCIFACT_ORIGINAL_STEP]:
+                self.assertEqual(actual, self.rank(bm25_rank_documents_for_query, query), query.get_id())
+        self.assertGreater(sum(len(ranking) for ranking in self.taat_rankings), 10000)
+
+    def test_batch_same_rankings_as_taat(self):
+        doc_magnitudes = get_document_magnitudes(self.document_vectors)
+        with contextlib.redirect_stdout(io.StringIO()):
+            actual = bm25_batch_rank_documents_for_queries(self.queries, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length,
+                                                           k1=1.8, b=1.0, delta=1.0, top_n=100, batch_size=64, doc_magnitudes=doc_magnitudes)
+        self.assertEqual(actual, self.taat_rankings)
+
+    def test_maxscore_same_rankings_as_taat(self):
+        self.inv_index.compute_max_scores(self.document_vectors)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for query, expected in zip(self.queries, self.taat_rankings):
+                for top_n in (10, 100):
+                    self.assertEqual(self.rank(bm25_maxscore_rank_documents_for_query, query, top_n=top_n), expected[:top_n], query.get_id())
+
+    def test_matrix_same_documents_as_taat(self):
+        # The matrices add up the weights in another order, so the scores may differ in the last bits, but not the documents and their order
+        matrix = BM25Matrix(self.documents, self.avg_doc_length, k1=1.8, b=1.0, delta=1.0)
+        for query, expected in zip(self.queries, self.taat_rankings):
+            actual = matrix.rank(query, top_n=100)
+            self.assertEqual([doc_id for doc_id, _ in actual], [doc_id for doc_id, _ in expected], query.get_id())
+            for (_, actual_score), (_, expected_score) in zip(actual, expected):
+                self.assertAlmostEqual(actual_score, expected_score, places=12)
+
+
+if __name__ == "__main__":
+    unittest.main()
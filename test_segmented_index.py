@@ -0,0 +1,96 @@
+import tempfile
+import unittest
+
+from preprocessing import Query, StoredDocument
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+from segmented_index import SegmentedIndex
+from test_fixtures import use_test_resources, restore_resources, build_collection, make_corpus, make_documents
+
+# Checks that a segmented index ranks its live documents like one index of the same documents, across flushes, deletions,
+# merges and reopening, and that a snapshot does not change when the index does.
+# Run with: python -m unittest test_segmented_index
+
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+QUERIES = ["insulin resistance", "obesity diabetes mice", "protein expression of the gene", "vitamin deficiency risk", "brain"]
+
+
+class SegmentedIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.documents = make_documents(make_corpus(60))
+        self.queries = [Query(_id=str(number), query=text) for number, text in enumerate(QUERIES)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fill(self, segmented_index):
+        '''Add the documents, delete every fifth one and replace every seventh one. Returns the index terms of the live documents.'''
+        live = {}
+        for doc_id, document in self.documents.items():
+            segmented_index.add_document(doc_id, document.get_index_terms())
+            live[doc_id] = document.get_index_terms()
+        for doc_id in list(self.documents)[::5]:
+            self.assertTrue(segmented_index.delete_document(doc_id))
+            del live[doc_id]
+        for doc_id in list(self.documents)[1::7]:
+            terms = {"insulin": 3, "brain": 1}
+            segmented_index.add_document(doc_id, terms)
+            live[doc_id] = terms
+        self.assertFalse(segmented_index.delete_document("missing"))
+        return live
+
+    def assertSameRankings(self, segmented_index, live):
+        snapshot = segmented_index.snapshot()
+        self.assertEqual(set(snapshot.documents), set(live))
+        self.assertEqual(len(segmented_index), len(live))
+
+        # The reference index has the documents in the order of the snapshot, the order tied documents are ranked in
+        documents = {doc_id: StoredDocument(doc_id, live[doc_id]) for doc_id in snapshot.documents}
+        inv_index, avg_doc_length, document_vectors = build_collection(documents)
+        for query in self.queries:
+            expected = bm25_taat_rank_documents_for_query(query, inv_index, document_vectors, documents, avg_doc_length, k1=1.8, b=1.0, delta=1.0)
+            self.assertEqual(segmented_index.search(query, k1=1.8, b=1.0, delta=1.0), expected, query.get_query())
+
+    def test_same_rankings_as_one_index(self):
+        segmented_index = SegmentedIndex(self.directory.name, buffer_size=4, merge_factor=2, background_merge=False)
+        live = self.fill(segmented_index)
+        self.assertGreater(segmented_index.merges, 0)
+        # Only the last segments of every tier are left
+        self.assertLess(len(segmented_index.segments), 8)
+        self.assertSameRankings(segmented_index, live)
+
+        segmented_index.close()
+        reopened = SegmentedIndex(self.directory.name, buffer_size=4, merge_factor=2, background_merge=False)
+        self.assertSameRankings(reopened, live)
+        reopened.close()
+
+    def test_background_merges(self):
+        with SegmentedIndex(self.directory.name, buffer_size=4, merge_factor=2) as segmented_index:
+            live = self.fill(segmented_index)
+            segmented_index.wait_for_merges()
+            self.assertGreater(segmented_index.merges, 0)
+            self.assertEqual(segmented_index.find_merge(), [])
+            self.assertSameRankings(segmented_index, live)
+
+    def test_snapshot_isolation(self):
+        segmented_index = SegmentedIndex(self.directory.name, buffer_size=4, merge_factor=2, background_merge=False)
+        live = self.fill(segmented_index)
+        snapshot = segmented_index.snapshot()
+        self.assertIs(segmented_index.snapshot(), snapshot)
+        expected = [snapshot.search(query) for query in self.queries]
+
+        # Replacing, deleting and adding documents (and the merges they cause) do not change the snapshot
+        for doc_id in list(live)[:10]:
+            segmented_index.delete_document(doc_id)
+        for number in range(20):
+            segmented_index.add_document(f"new{number}", {"insulin": 1 + number % 3, "resistance": 1})
+        self.assertIsNot(segmented_index.snapshot(), snapshot)
+        self.assertEqual([snapshot.search(query) for query in self.queries], expected)
+        segmented_index.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
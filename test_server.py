@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.client import HTTPConnection
+
+import preprocessing
+from preprocessing import Document
+from indexing import InvertedIndex
+from doc_utils import save_inverted_index_jsonl
+from retrieve_and_rank import get_bm25_document_vector, bm25_rank_documents_for_query
+from server import RetrievalService, RetrievalServer
+
+# Checks the answers of the retrieval server to valid and invalid requests, and that a saved index is loaded without the corpus.
+# Run with: python -m unittest test_server
+
+CORPUS = [
+    ("1", "Insulin resistance in obese mice"),
+    ("2", "Obesity and the risk of diabetes"),
+    ("3", "Insulin treatment of diabetes"),
+]
+
+RESOURCES = {
+    "stop_words": sorted(preprocessing.additional_stop_words),
+    "spell_words": [],
+    "lemmas": {"insulin": "insulin", "resistance": "resistance", "obese": "obese", "mice": "mouse", "obesity": "obesity",
+               "risk": "risk", "diabetes": "diabetes", "treatment": "treatment"},
+}
+
+
+class RetrievalServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        resources_path = os.path.join(self.directory.name, "resources.json")
+        with open(resources_path, "w") as file:
+            json.dump(RESOURCES, file)
+        self.saved_resources = (preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas)
+        preprocessing.load_preprocessing_resources(resources_path)
+
+        self.documents = {_id: Document(title=title, text="", _id=_id) for _id, title in CORPUS}
+        self.inv_index = InvertedIndex()
+        for _id, document in self.documents.items():
+            self.inv_index.add_documents(_id, document.get_index_terms())
+        self.index_file_path = os.path.join(self.directory.name, "inverted_index.jsonl")
+        save_inverted_index_jsonl(self.inv_index, self.index_file_path)
+
+        # The corpus does not exist: the service must be loaded from the saved index
+        self.service = RetrievalService.load(os.path.join(self.directory.name, "missing.jsonl"), self.index_file_path)
+        self.server = RetrievalServer(("127.0.0.1", 0), self.service, workers=2, verbose=False)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        preprocessing.stop_words, preprocessing.spell, preprocessing.lemmas = self.saved_resources
+        self.directory.cleanup()
+
+    def request(self, method, path, body=None):
+        connection = HTTPConnection(*self.server.server_address, timeout=10)
+        try:
+            connection.request(method, path, body=None if body is None else json.dumps(body))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_loaded_from_saved_index(self):
+        self.assertEqual(list(self.service.documents), ["1", "2", "3"])
+        avg_doc_length = sum(len(document) for document in self.documents.values()) / len(self.documents)
+        document_vectors = {_id: get_bm25_document_vector(document, self.inv_index, len(self.documents), avg_doc_length, delta=0.25)
+                            for _id, document in self.documents.items()}
+        expected = bm25_rank_documents_for_query(self.service.make_query("insulin diabetes"), self.inv_index, document_vectors, self.documents,
+                                                 avg_doc_length, k1=1.2, b=0.75, delta=1, top_n=3)
+        actual = self.service.search("insulin diabetes", top_n=3)
+        self.assertEqual([doc_id for doc_id, _ in actual], [doc_id for doc_id, _ in expected])
+        for (_, score), (_, expected_score) in zip(actual, expected):
+            self.assertAlmostEqual(score, expected_score)
+
+    def test_search(self):
+        status, body = self.request("GET", "/search?q=insulin+diabetes&k=2")
+        self.assertEqual(status, 200)
+        self.assertEqual([result["doc_id"] for result in body["results"]], [doc_id for doc_id, _ in self.service.search("insulin diabetes", 2)])
+
+        status, body = self.request("POST", "/search", {"queries": [{"_id": "q1", "text": "obese mice"}], "k": 1})
+        self.assertEqual(status, 200)
+        self.assertEqual(body["results"][0]["query_id"], "q1")
+        self.assertEqual(body["results"][0]["results"][0]["doc_id"], "1")
+
+    def test_invalid_requests(self):
+        for body in ({"queries": [{"_id": "q1", "text": 5}]},
+                     {"queries": [{"_id": ["q1"], "text": "insulin"}]},
+                     {"queries": [{"text": "insulin"}]},
+                     {"queries": [{"_id": "q1", "text": "insulin"}], "k": 0},
+                     {"queries": "insulin"}):
+            status, response = self.request("POST", "/search", body)
+            self.assertEqual(status, 400, body)
+            self.assertIn("error", response)
+
+        self.assertEqual(self.request("GET", "/search")[0], 400)
+        self.assertEqual(self.request("GET", "/search?q=insulin&k=x")[0], 400)
+        self.assertEqual(self.request("GET", "/missing")[0], 404)
+        # The server still answers after the invalid requests
+        self.assertEqual(self.request("GET", "/health")[1]["documents"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+
+from preprocessing import Query
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+from sharded_index import ShardedIndex, get_shard_number
+from test_fixtures import use_test_resources, restore_resources, build_collection, make_corpus, make_documents, write_corpus
+
+# Checks that the scatter-gather rankings of a sharded index are exactly the ones of one index of the whole corpus.
+# Run with: python -m unittest test_sharded_index
+
+QUERIES = ["insulin resistance", "obesity diabetes mice", "protein expression of the gene", "vitamin deficiency risk", "brain", "no such words"]
+
+# The shard processes are forked from this one, so they get the same resources
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+
+class ShardedIndexTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.corpus_path = os.path.join(cls.directory.name, "corpus.jsonl")
+        corpus = make_corpus(80)
+        write_corpus(cls.corpus_path, corpus)
+        cls.documents = make_documents(corpus)
+        cls.inv_index, cls.avg_doc_length, cls.document_vectors = build_collection(cls.documents)
+        cls.queries = [Query(_id=str(number), query=text) for number, text in enumerate(QUERIES)]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def rank(self, query, top_n):
+        return bm25_taat_rank_documents_for_query(query, self.inv_index, self.document_vectors, self.documents, self.avg_doc_length, k1=1.8, b=1.0, delta=1.0, top_n=top_n)
+
+    def test_same_rankings_as_one_index(self):
+        with ShardedIndex(self.corpus_path, shards=3, k1=1.8, b=1.0, delta=1.0) as sharded_index:
+            self.assertEqual(len(sharded_index), len(self.documents))
+            self.assertEqual(sum(sharded_index.shard_sizes), len(self.documents))
+            self.assertTrue(all(sharded_index.shard_sizes))
+            self.assertEqual(sharded_index.avg_doc_length, self.avg_doc_length)
+
+            for top_n in (1, 5, 100):
+                expected = [self.rank(query, top_n) for query in self.queries]
+                rankings = sharded_index.search_batch([(query.get_id(), query.get_query()) for query in self.queries], top_n=top_n)
+                self.assertEqual(rankings, expected, top_n)
+            self.assertEqual(sharded_index.search(QUERIES[0], top_n=10), self.rank(self.queries[0], 10))
+
+    def test_shard_number_is_stable(self):
+        self.assertEqual(get_shard_number("1000", 3), get_shard_number(1000, 3))
+        self.assertEqual(len({get_shard_number(doc_id, 4) for doc_id in self.documents}), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
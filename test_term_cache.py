@@ -0,0 +1,74 @@
+import unittest
+
+from indexing import CompactInvertedIndex
+from preprocessing import Query
+from retrieve_and_rank import bm25_taat_rank_documents_for_query
+from term_cache import CachedInvertedIndex
+from test_fixtures import use_test_resources, restore_resources, build_collection, make_corpus, make_documents
+
+# Checks that ranking through the term cache gives the same rankings as the index it wraps, that the cached postings stay within
+# their bound and that the cache is cleared when the index changes.
+# Run with: python -m unittest test_term_cache
+
+setUpModule = use_test_resources
+tearDownModule = restore_resources
+
+QUERIES = ["insulin resistance", "obesity diabetes mice", "protein expression of the gene", "vitamin deficiency risk", "brain", "insulin brain"]
+
+
+class TermCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.documents = make_documents(make_corpus(60))
+        self.inv_index, self.avg_doc_length, self.document_vectors = build_collection(self.documents)
+        self.queries = [Query(_id=str(number), query=text) for number, text in enumerate(QUERIES)]
+
+    def rank(self, inv_index, query):
+        return bm25_taat_rank_documents_for_query(query, inv_index, self.document_vectors, self.documents, self.avg_doc_length, k1=1.8, b=1.0, delta=1.0)
+
+    def test_same_rankings_as_index(self):
+        cached_index = CachedInvertedIndex(self.inv_index)
+        for _ in range(2):
+            for query in self.queries:
+                self.assertEqual(self.rank(cached_index, query), self.rank(self.inv_index, query), query.get_query())
+        stats = cached_index.stats()
+        self.assertGreater(stats["hits"], 0)
+        self.assertEqual(stats["cached_terms"], len({term for query in self.queries for term in query.get_index_terms()}))
+
+        # Same postings, document frequencies and IDFs for compact postings, which are decoded into dictionaries
+        compact_index = CompactInvertedIndex()
+        for doc_id, document in self.documents.items():
+            compact_index.add_documents(doc_id, document.get_index_terms())
+        compact_index.pack()
+        cached_index = CachedInvertedIndex(compact_index)
+        for term in list(self.inv_index.index) + ["missing"]:
+            self.assertEqual(cached_index.get_postings(term), dict(self.inv_index.get_postings(term)), term)
+            self.assertEqual(cached_index.get_doc_freq(term), self.inv_index.get_doc_freq(term), term)
+            self.assertEqual(cached_index.get_idf(term), self.inv_index.get_idf(term), term)
+            self.assertEqual(cached_index.get_idf(term, 1000), self.inv_index.get_idf(term, 1000), term)
+        # The other attributes are the ones of the wrapped index
+        self.assertEqual(cached_index.get_document_count(), len(self.documents))
+
+    def test_bounded_postings(self):
+        max_postings = 40
+        cached_index = CachedInvertedIndex(self.inv_index, max_postings=max_postings, working_set_window=5)
+        for query in self.queries:
+            self.assertEqual(self.rank(cached_index, query), self.rank(self.inv_index, query), query.get_query())
+            self.assertLessEqual(cached_index.cached_postings, max_postings)
+        stats = cached_index.stats()
+        self.assertGreater(stats["evictions"], 0)
+        self.assertEqual(stats["cached_postings"], sum(entry.doc_freq for entry in cached_index.entries.values()))
+        self.assertLessEqual(stats["working_set_terms"], 5)
+
+    def test_cleared_when_index_changes(self):
+        cached_index = CachedInvertedIndex(self.inv_index)
+        postings = dict(cached_index.get_postings("insulin"))
+        self.inv_index.add_documents("new", {"insulin": 2})
+        self.assertEqual(cached_index.get_postings("insulin"), dict(postings, new=2))
+        self.assertEqual(cached_index.get_idf("insulin"), self.inv_index.get_idf("insulin"))
+        self.inv_index.delete_document("new")
+        self.assertEqual(cached_index.get_postings("insulin"), postings)
+
+
+if __name__ == "__main__":
+    unittest.main()